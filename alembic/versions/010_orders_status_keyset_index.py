@@ -0,0 +1,32 @@
+"""Composite (status, created_at, order_id) index for keyset pagination
+
+    Revision ID: 010_orders_status_keyset_index
+    Revises: 009_admin_visibility_flags
+Create Date: 2025-09-01 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '010_orders_status_keyset_index'
+down_revision = '009_admin_visibility_flags'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # الحالة الفارغة تُعامل كـ pending؛ نثبّت ذلك في البيانات حتى يبقى فلتر التبويب مساواة بسيطة
+    op.execute("UPDATE orders SET status = 'pending' WHERE status IS NULL")
+    op.execute("ALTER TABLE orders ALTER COLUMN status SET NOT NULL")
+
+    # فهرس مركّب يخدم فلترة التبويب + الترتيب + مؤشر الصفحات (keyset) بمسح واحد
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_status_created_order "
+        "ON orders(status, created_at DESC, order_id DESC)"
+    )
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS idx_orders_status_created_order")
+    op.execute("ALTER TABLE orders ALTER COLUMN status DROP NOT NULL")
@@ -0,0 +1,111 @@
+"""Trigger-maintained per-status order counters
+
+    Revision ID: 011_order_status_counters
+    Revises: 010_orders_status_keyset_index
+Create Date: 2025-09-01 00:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '011_order_status_counters'
+down_revision = '010_orders_status_keyset_index'
+branch_labels = None
+depends_on = None
+
+# عدد الـ slots لكل (status, stage) لتوزيع التحديثات المتزامنة
+SLOTS = 8
+
+
+def upgrade():
+    op.execute(
+        """
+CREATE TABLE IF NOT EXISTS order_status_counters (
+  status VARCHAR(32) NOT NULL,
+  stage VARCHAR(50) NOT NULL DEFAULT '',
+  slot SMALLINT NOT NULL DEFAULT 0,
+  cnt BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (status, stage, slot)
+);
+        """
+    )
+
+    op.execute(
+        f"""
+CREATE OR REPLACE FUNCTION trg_orders_status_counters()
+RETURNS trigger AS $$
+DECLARE
+  _slot smallint := pg_backend_pid() % {SLOTS};
+BEGIN
+  IF TG_OP = 'UPDATE'
+     AND NEW.status IS NOT DISTINCT FROM OLD.status
+     AND NEW.current_stage_name IS NOT DISTINCT FROM OLD.current_stage_name THEN
+    RETURN NULL;
+  END IF;
+
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    INSERT INTO order_status_counters(status, stage, slot, cnt)
+    VALUES (COALESCE(OLD.status::text, 'pending'), COALESCE(OLD.current_stage_name, ''), _slot, -1)
+    ON CONFLICT (status, stage, slot) DO UPDATE SET cnt = order_status_counters.cnt + EXCLUDED.cnt;
+  END IF;
+
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    INSERT INTO order_status_counters(status, stage, slot, cnt)
+    VALUES (COALESCE(NEW.status::text, 'pending'), COALESCE(NEW.current_stage_name, ''), _slot, 1)
+    ON CONFLICT (status, stage, slot) DO UPDATE SET cnt = order_status_counters.cnt + EXCLUDED.cnt;
+  END IF;
+
+  RETURN NULL;
+END$$ LANGUAGE plpgsql;
+        """
+    )
+
+    op.execute(
+        """
+CREATE OR REPLACE FUNCTION trg_orders_status_counters_truncate()
+RETURNS trigger AS $$
+BEGIN
+  DELETE FROM order_status_counters;
+  RETURN NULL;
+END$$ LANGUAGE plpgsql;
+        """
+    )
+
+    # نقفل orders أثناء التعبئة الأولية حتى لا تضيع أي كتابة بين العدّ وتفعيل التريغر
+    op.execute("LOCK TABLE orders IN SHARE ROW EXCLUSIVE MODE")
+    op.execute("DROP TRIGGER IF EXISTS orders_status_counters ON orders")
+    op.execute("DROP TRIGGER IF EXISTS orders_status_counters_truncate ON orders")
+    op.execute(
+        """
+CREATE TRIGGER orders_status_counters
+AFTER INSERT OR UPDATE OF status, current_stage_name OR DELETE ON orders
+FOR EACH ROW
+EXECUTE FUNCTION trg_orders_status_counters();
+        """
+    )
+    op.execute(
+        """
+CREATE TRIGGER orders_status_counters_truncate
+AFTER TRUNCATE ON orders
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_orders_status_counters_truncate();
+        """
+    )
+    op.execute("DELETE FROM order_status_counters")
+    op.execute(
+        """
+INSERT INTO order_status_counters(status, stage, slot, cnt)
+SELECT COALESCE(status::text, 'pending'), COALESCE(current_stage_name, ''), 0, COUNT(*)
+FROM orders
+GROUP BY 1, 2;
+        """
+    )
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS orders_status_counters_truncate ON orders")
+    op.execute("DROP TRIGGER IF EXISTS orders_status_counters ON orders")
+    op.execute("DROP FUNCTION IF EXISTS trg_orders_status_counters_truncate()")
+    op.execute("DROP FUNCTION IF EXISTS trg_orders_status_counters()")
+    op.execute("DROP TABLE IF EXISTS order_status_counters")
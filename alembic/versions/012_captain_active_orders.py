@@ -0,0 +1,113 @@
+"""Trigger-maintained active order count per captain
+
+    Revision ID: 012_captain_active_orders
+    Revises: 011_order_status_counters
+Create Date: 2025-09-01 00:12:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '012_captain_active_orders'
+down_revision = '011_order_status_counters'
+branch_labels = None
+depends_on = None
+
+# القيم الخام (مع الـ aliases) التي تُعدّ طلباً نشطاً: choose_captain / processing / out_for_delivery
+ACTIVE_RAW = (
+    "choose_captain", "accepted", "waiting_restaurant_acceptance",
+    "processing", "preparing", "pick_up_ready",
+    "out_for_delivery",
+)
+_ACTIVE_SQL = "ARRAY[" + ", ".join(f"'{s}'" for s in ACTIVE_RAW) + "]"
+
+
+def upgrade():
+    op.execute(
+        """
+CREATE TABLE IF NOT EXISTS captain_active_orders (
+  captain_id INTEGER PRIMARY KEY,
+  active_orders INTEGER NOT NULL DEFAULT 0
+);
+        """
+    )
+
+    op.execute(
+        f"""
+CREATE OR REPLACE FUNCTION trg_orders_captain_active()
+RETURNS trigger AS $$
+DECLARE
+  _old boolean := TG_OP <> 'INSERT' AND OLD.captain_id IS NOT NULL
+                  AND lower(trim(OLD.status::text)) = ANY({_ACTIVE_SQL});
+  _new boolean := TG_OP <> 'DELETE' AND NEW.captain_id IS NOT NULL
+                  AND lower(trim(NEW.status::text)) = ANY({_ACTIVE_SQL});
+BEGIN
+  IF _old AND _new AND NEW.captain_id = OLD.captain_id THEN
+    RETURN NULL;
+  END IF;
+
+  IF _old THEN
+    UPDATE captain_active_orders SET active_orders = active_orders - 1 WHERE captain_id = OLD.captain_id;
+  END IF;
+
+  IF _new THEN
+    INSERT INTO captain_active_orders(captain_id, active_orders)
+    VALUES (NEW.captain_id, 1)
+    ON CONFLICT (captain_id) DO UPDATE SET active_orders = captain_active_orders.active_orders + 1;
+  END IF;
+
+  RETURN NULL;
+END$$ LANGUAGE plpgsql;
+        """
+    )
+
+    op.execute(
+        """
+CREATE OR REPLACE FUNCTION trg_orders_captain_active_truncate()
+RETURNS trigger AS $$
+BEGIN
+  DELETE FROM captain_active_orders;
+  RETURN NULL;
+END$$ LANGUAGE plpgsql;
+        """
+    )
+
+    # نفس أسلوب 011: قفل orders أثناء التعبئة الأولية
+    op.execute("LOCK TABLE orders IN SHARE ROW EXCLUSIVE MODE")
+    op.execute("DROP TRIGGER IF EXISTS orders_captain_active ON orders")
+    op.execute("DROP TRIGGER IF EXISTS orders_captain_active_truncate ON orders")
+    op.execute(
+        """
+CREATE TRIGGER orders_captain_active
+AFTER INSERT OR UPDATE OF status, captain_id OR DELETE ON orders
+FOR EACH ROW
+EXECUTE FUNCTION trg_orders_captain_active();
+        """
+    )
+    op.execute(
+        """
+CREATE TRIGGER orders_captain_active_truncate
+AFTER TRUNCATE ON orders
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_orders_captain_active_truncate();
+        """
+    )
+    op.execute("DELETE FROM captain_active_orders")
+    op.execute(
+        f"""
+INSERT INTO captain_active_orders(captain_id, active_orders)
+SELECT captain_id, COUNT(*)
+FROM orders
+WHERE captain_id IS NOT NULL AND lower(trim(status::text)) = ANY({_ACTIVE_SQL})
+GROUP BY captain_id;
+        """
+    )
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS orders_captain_active_truncate ON orders")
+    op.execute("DROP TRIGGER IF EXISTS orders_captain_active ON orders")
+    op.execute("DROP FUNCTION IF EXISTS trg_orders_captain_active_truncate()")
+    op.execute("DROP FUNCTION IF EXISTS trg_orders_captain_active()")
+    op.execute("DROP TABLE IF EXISTS captain_active_orders")
@@ -0,0 +1,24 @@
+"""Store the response next to each idempotency key
+
+    Revision ID: 013_idempotency_response
+    Revises: 012_captain_active_orders
+Create Date: 2025-09-01 00:13:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '013_idempotency_response'
+down_revision = '012_captain_active_orders'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # الاستجابة تُحفظ في نفس معاملة العملية، فإعادة الطلب بنفس المفتاح ترجعها كما هي
+    op.execute("ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS response JSONB")
+
+
+def downgrade():
+    op.execute("ALTER TABLE idempotency_keys DROP COLUMN IF EXISTS response")
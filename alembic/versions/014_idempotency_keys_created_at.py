@@ -0,0 +1,36 @@
+"""Index idempotency_keys.created_at for the expiry purge
+
+    Revision ID: 014_idempotency_keys_created_at
+    Revises: 013_idempotency_response
+Create Date: 2025-09-01 00:14:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '014_idempotency_keys_created_at'
+down_revision = '013_idempotency_response'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("UPDATE idempotency_keys SET created_at = NOW() WHERE created_at IS NULL")
+    op.execute("ALTER TABLE idempotency_keys ALTER COLUMN created_at SET NOT NULL")
+    # الحذف الدوري (core.idempotency.purge_job) يمسح أقدم المفاتيح عبر هذا الفهرس
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at "
+        "ON idempotency_keys(created_at)"
+    )
+    # جدول بحذف مستمر: تنظيف تلقائي أبكر حتى لا يتضخّم
+    op.execute(
+        "ALTER TABLE idempotency_keys SET ("
+        "autovacuum_vacuum_scale_factor = 0.02, autovacuum_analyze_scale_factor = 0.05)"
+    )
+
+
+def downgrade():
+    op.execute("ALTER TABLE idempotency_keys RESET (autovacuum_vacuum_scale_factor, autovacuum_analyze_scale_factor)")
+    op.execute("DROP INDEX IF EXISTS idx_idempotency_keys_created_at")
+    op.execute("ALTER TABLE idempotency_keys ALTER COLUMN created_at DROP NOT NULL")
@@ -0,0 +1,114 @@
+"""Monthly range partitions for order_events with a BRIN time index
+
+    Revision ID: 015_partition_order_events
+    Revises: 014_idempotency_keys_created_at
+Create Date: 2025-09-01 00:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '015_partition_order_events'
+down_revision = '014_idempotency_keys_created_at'
+branch_labels = None
+depends_on = None
+
+# أشهر تُنشأ مسبقاً بعد الشهر الحالي؛ الباقي تنشئه مهمة الصيانة core.event_partitions
+MONTHS_AHEAD = 3
+
+
+def upgrade():
+    # دالة إنشاء قسم شهري: order_events_pYYYYMM = [بداية الشهر، بداية الشهر التالي)
+    op.execute(
+        """
+CREATE OR REPLACE FUNCTION order_events_create_partition(_month date)
+RETURNS text AS $$
+DECLARE
+  _from date := date_trunc('month', _month)::date;
+  _name text := 'order_events_p' || to_char(_from, 'YYYYMM');
+BEGIN
+  IF to_regclass(_name) IS NULL THEN
+    EXECUTE format(
+      'CREATE TABLE %I PARTITION OF order_events FOR VALUES FROM (%L) TO (%L)',
+      _name, _from, (_from + interval '1 month')::date
+    );
+  END IF;
+  RETURN _name;
+END$$ LANGUAGE plpgsql;
+        """
+    )
+
+    op.execute("LOCK TABLE order_events IN ACCESS EXCLUSIVE MODE")
+    op.execute("ALTER TABLE order_events RENAME TO order_events_legacy")
+    op.execute("ALTER INDEX IF EXISTS order_events_pkey RENAME TO order_events_legacy_pkey")
+    op.execute("ALTER INDEX IF EXISTS idx_order_events_order_id RENAME TO idx_order_events_legacy_order_id")
+    op.execute(
+        """
+CREATE TABLE order_events (
+  id BIGINT NOT NULL DEFAULT nextval('order_events_id_seq'),
+  order_id INTEGER NOT NULL,
+  event_type TEXT NOT NULL,
+  payload JSONB,
+  created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+        """
+    )
+    op.execute("ALTER SEQUENCE order_events_id_seq OWNED BY order_events.id")
+    op.execute("CREATE INDEX IF NOT EXISTS idx_order_events_order_id ON order_events(order_id)")
+    # BRIN: الأحداث تُكتب بترتيب الزمن تقريباً، فالفهرس صغير جداً ويكفي لمسح نوافذ زمنية
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_order_events_created_brin "
+        "ON order_events USING brin(created_at) WITH (pages_per_range = 32)"
+    )
+    # أي صف خارج الأقسام الشهرية (مثلاً تاريخ خاطئ بعيد) لا يُرفض
+    op.execute("CREATE TABLE IF NOT EXISTS order_events_default PARTITION OF order_events DEFAULT")
+
+    op.execute(
+        f"""
+SELECT order_events_create_partition(m::date)
+FROM generate_series(
+  date_trunc('month', LEAST(COALESCE((SELECT MIN(created_at) FROM order_events_legacy), NOW()), NOW())),
+  date_trunc('month', NOW()) + interval '{MONTHS_AHEAD} months',
+  interval '1 month'
+) AS m;
+        """
+    )
+    op.execute(
+        """
+INSERT INTO order_events(id, order_id, event_type, payload, created_at)
+SELECT id, order_id, event_type, payload, COALESCE(created_at, NOW())
+FROM order_events_legacy;
+        """
+    )
+    op.execute("DROP TABLE order_events_legacy")
+
+
+def downgrade():
+    op.execute("LOCK TABLE order_events IN ACCESS EXCLUSIVE MODE")
+    op.execute("ALTER TABLE order_events RENAME TO order_events_partitioned")
+    op.execute("ALTER INDEX IF EXISTS order_events_pkey RENAME TO order_events_partitioned_pkey")
+    op.execute("ALTER INDEX IF EXISTS idx_order_events_order_id RENAME TO idx_order_events_partitioned_order_id")
+    op.execute(
+        """
+CREATE TABLE order_events (
+  id INTEGER PRIMARY KEY DEFAULT nextval('order_events_id_seq'),
+  order_id INTEGER NOT NULL,
+  event_type TEXT NOT NULL,
+  payload JSONB,
+  created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()
+);
+        """
+    )
+    op.execute("ALTER SEQUENCE order_events_id_seq OWNED BY order_events.id")
+    op.execute("CREATE INDEX IF NOT EXISTS idx_order_events_order_id ON order_events(order_id)")
+    op.execute(
+        """
+INSERT INTO order_events(id, order_id, event_type, payload, created_at)
+SELECT id, order_id, event_type, payload, created_at
+FROM order_events_partitioned;
+        """
+    )
+    op.execute("DROP TABLE order_events_partitioned")
+    op.execute("DROP FUNCTION IF EXISTS order_events_create_partition(date)")
@@ -0,0 +1,31 @@
+"""Covering (order_id, created_at) index for order timelines
+
+    Revision ID: 016_order_events_timeline_index
+    Revises: 015_partition_order_events
+Create Date: 2025-09-01 00:16:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '016_order_events_timeline_index'
+down_revision = '015_partition_order_events'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # الخط الزمني للطلب مرتب حسب created_at مباشرة من الفهرس؛ INCLUDE يغطي id/event_type.
+    # payload (JSONB بحجم غير محدود) يبقى في الجدول حتى لا يتجاوز صف الفهرس الحد الأقصى
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_order_events_order_created "
+        "ON order_events(order_id, created_at) INCLUDE (id, event_type)"
+    )
+    # الفهرس الجديد يغطي كل استعلامات order_id وحده
+    op.execute("DROP INDEX IF EXISTS idx_order_events_order_id")
+
+
+def downgrade():
+    op.execute("CREATE INDEX IF NOT EXISTS idx_order_events_order_id ON order_events(order_id)")
+    op.execute("DROP INDEX IF EXISTS idx_order_events_order_created")
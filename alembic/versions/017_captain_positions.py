@@ -0,0 +1,73 @@
+"""Daily partitioned captain_positions track store
+
+    Revision ID: 017_captain_positions
+    Revises: 016_order_events_timeline_index
+Create Date: 2025-09-01 00:17:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '017_captain_positions'
+down_revision = '016_order_events_timeline_index'
+branch_labels = None
+depends_on = None
+
+# أيام تُنشأ مسبقاً بعد اليوم الحالي؛ الباقي تنشئه مهمة الصيانة core.position_history
+DAYS_AHEAD = 3
+
+
+def upgrade():
+    # قسم يومي captain_positions_pYYYYMMDD = [بداية اليوم، بداية اليوم التالي)
+    op.execute(
+        """
+CREATE OR REPLACE FUNCTION captain_positions_create_partition(_day date)
+RETURNS text AS $$
+DECLARE
+  _name text := 'captain_positions_p' || to_char(_day, 'YYYYMMDD');
+BEGIN
+  IF to_regclass(_name) IS NULL THEN
+    EXECUTE format(
+      'CREATE TABLE %I PARTITION OF captain_positions FOR VALUES FROM (%L) TO (%L)',
+      _name, _day, _day + 1
+    );
+  END IF;
+  RETURN _name;
+END$$ LANGUAGE plpgsql;
+        """
+    )
+    # صف لكل كابتن لكل دقيقة (span_sec = 60)، أو لكل ساعة بعد التخفيف (span_sec = 3600).
+    # data = نقاط مرمّزة بالفروق (varint) — انظر core.position_history
+    op.execute(
+        """
+CREATE TABLE IF NOT EXISTS captain_positions (
+  captain_id INTEGER NOT NULL,
+  bucket TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+  span_sec INTEGER NOT NULL DEFAULT 60,
+  points INTEGER NOT NULL,
+  data BYTEA NOT NULL
+) PARTITION BY RANGE (bucket);
+        """
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_captain_positions_captain_bucket "
+        "ON captain_positions(captain_id, bucket)"
+    )
+    # مهمة التخفيف تبحث عن أقدم ساعة خام؛ الفهرس الجزئي يفرغ من الأقسام بعد تخفيفها
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_captain_positions_raw_bucket "
+        "ON captain_positions(bucket) WHERE span_sec = 60"
+    )
+    op.execute("CREATE TABLE IF NOT EXISTS captain_positions_default PARTITION OF captain_positions DEFAULT")
+    op.execute(
+        f"""
+SELECT captain_positions_create_partition(d::date)
+FROM generate_series(CURRENT_DATE, CURRENT_DATE + {DAYS_AHEAD}, interval '1 day') AS d;
+        """
+    )
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS captain_positions")
+    op.execute("DROP FUNCTION IF EXISTS captain_positions_create_partition(date)")
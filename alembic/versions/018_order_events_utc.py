@@ -0,0 +1,24 @@
+"""order_events.created_at defaults to UTC
+
+    Revision ID: 018_order_events_utc
+    Revises: 017_captain_positions
+Create Date: 2025-09-01 00:18:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '018_order_events_utc'
+down_revision = '017_captain_positions'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # ساعة واحدة للخط الزمني ولتوجيه الأقسام الشهرية: UTC، كما يكتبها core.events من التطبيق
+    op.execute("ALTER TABLE order_events ALTER COLUMN created_at SET DEFAULT timezone('utc', now())")
+
+
+def downgrade():
+    op.execute("ALTER TABLE order_events ALTER COLUMN created_at SET DEFAULT NOW()")
@@ -0,0 +1,50 @@
+"""captain_positions without a DEFAULT partition; UTC partition days
+
+    Revision ID: 019_captain_positions_no_default
+    Revises: 018_order_events_utc
+Create Date: 2025-09-01 00:19:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '019_captain_positions_no_default'
+down_revision = '018_order_events_utc'
+branch_labels = None
+depends_on = None
+
+DAYS_AHEAD = 3
+
+
+def upgrade():
+    # صف في القسم الافتراضي يمنع إنشاء قسم يومه لاحقاً (فتفشل مهمة الصيانة كلها):
+    # تُنقل صفوفه إلى أقسامها اليومية ثم يُحذف. اليوم المفقود تنشئه core.position_history عند الكتابة
+    op.execute(
+        """
+DO $$
+DECLARE _d date;
+BEGIN
+  IF to_regclass('captain_positions_default') IS NOT NULL THEN
+    ALTER TABLE captain_positions DETACH PARTITION captain_positions_default;
+    FOR _d IN SELECT DISTINCT bucket::date FROM captain_positions_default LOOP
+      PERFORM captain_positions_create_partition(_d);
+    END LOOP;
+    INSERT INTO captain_positions SELECT * FROM captain_positions_default;
+    DROP TABLE captain_positions_default;
+  END IF;
+END$$;
+        """
+    )
+    # bucket بتوقيت UTC (core.position_history)، فأيام الأقسام بالـ UTC لا بـ CURRENT_DATE للجلسة
+    op.execute(
+        f"""
+SELECT captain_positions_create_partition(d::date)
+FROM generate_series((now() AT TIME ZONE 'utc')::date, (now() AT TIME ZONE 'utc')::date + {DAYS_AHEAD},
+                     interval '1 day') AS d;
+        """
+    )
+
+
+def downgrade():
+    op.execute("CREATE TABLE IF NOT EXISTS captain_positions_default PARTITION OF captain_positions DEFAULT")
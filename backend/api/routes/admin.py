@@ -1,10 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, text
 from typing import Dict, Any, List
+from datetime import datetime, timedelta, timezone
+import json
 
-from core.db import get_session
+from core.db import get_session, AsyncSessionLocal
+from core import captain_load, position_history
+from core.singleflight import singleflight
+from core.status_counts import admin_tab_counts
 from models.order import Order
 from models.captain import Captain
 from models.restaurant import Restaurant
@@ -14,29 +20,16 @@ router = APIRouter(prefix="/api/v1/admin", tags=["admin"])
 
 
 @router.get("/counters")
-async def counters(session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(Order))
-    orders = result.scalars().all()
-    tabs = ["pending", "assign", "processing", "out_for_delivery", "delivered", "cancelled", "issue"]
-    counts = {k: 0 for k in tabs}
-    for o in orders:
-        # naive mapping
-        st = (o.status or '').lower().strip()
-        if st == 'choose_captain':
-            st = 'assign'
-        if st not in counts:
-            if st == 'problem':
-                st = 'issue'
-            else:
-                st = 'pending'
-        counts[st] += 1
-    return counts
+async def counters():
+    return await admin_tab_counts()
 
 
-@router.get("/captains/live")
-async def captains_live(session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(Captain))
-    rows: List[Captain] = result.scalars().all()
+@singleflight(ttl=0.5, name="admin.captains_live")
+async def _load_captains_live() -> List[Dict[str, Any]]:
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(Captain))
+        rows: List[Captain] = result.scalars().all()
+        loads = await captain_load.get_many([c.captain_id for c in rows], session)
     out = []
     for c in rows:
         out.append({
@@ -45,7 +38,7 @@ async def captains_live(session: AsyncSession = Depends(get_session)):
             "lat": float(c.last_lat or 33.5138),
             "lng": float(c.last_lng or 36.2765),
             "status": 'active' if c.available else 'offline',
-            "orders_now": 0,
+            "orders_now": loads.get(c.captain_id, 0),
             "delivered_today": int(c.orders_delivered or 0),
             "vehicle": c.vehicle_type,
             "rating": float(c.performance or 5.0),
@@ -53,6 +46,38 @@ async def captains_live(session: AsyncSession = Depends(get_session)):
     return out
 
 
+@router.get("/captains/live")
+async def captains_live():
+    return await _load_captains_live()
+
+
+@router.get("/captains/{captain_id}/track")
+async def captain_track(
+    captain_id: int,
+    since: datetime | None = Query(default=None),
+    until: datetime | None = Query(default=None),
+):
+    """Recorded movement of a captain in [since, until) (UTC; default: the last hour), streamed as NDJSON points."""
+    # captain_positions بتوقيت UTC دون منطقة زمنية؛ المدخلات بلا منطقة تُعامل كـ UTC
+    since, until = (d.astimezone(timezone.utc).replace(tzinfo=None) if d and d.tzinfo else d for d in (since, until))
+    until = until or position_history.utcnow()
+    since = since or until - timedelta(hours=1)
+    if since >= until or until - since > position_history.MAX_WINDOW:
+        raise HTTPException(status_code=422, detail="since must be before until and the window at most 7 days")
+
+    async def _lines():
+        chunk = []
+        async for at, lat, lng in position_history.track(captain_id, since, until):
+            chunk.append(json.dumps({"t": at.isoformat() + "Z", "lat": lat, "lng": lng}, separators=(",", ":")))
+            if len(chunk) >= 500:
+                yield "\n".join(chunk) + "\n"
+                chunk = []
+        if chunk:
+            yield "\n".join(chunk) + "\n"
+
+    return StreamingResponse(_lines(), media_type="application/x-ndjson")
+
+
 class Toggle(BaseModel):
     visible: bool
 
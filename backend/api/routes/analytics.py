@@ -3,18 +3,16 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, text
 from typing import List, Dict, Any
 
-from core.db import get_session
+from core.db import get_session, AsyncSessionLocal
+from core.singleflight import singleflight
 from models.order import Order
 from models.customer import Customer
 
 router = APIRouter(prefix="/api/v1/analytics", tags=["analytics"])
 
 
-@router.get("/forecast", response_model=Dict[str, Any])
-async def forecast(
-    hours: int = Query(default=24, ge=1, le=168),
-    session: AsyncSession = Depends(get_session),
-):
+@singleflight(ttl=2.0, name="analytics.forecast")
+async def _load_forecast(hours: int) -> Dict[str, Any]:
     # توقع بسيط: تجميع عدد الطلبات في كل ساعة خلال آخر N ساعات
     bucket = func.date_trunc('hour', Order.created_at).label('bucket')
     q = (
@@ -23,7 +21,8 @@ async def forecast(
         .group_by(bucket)
         .order_by(bucket)
     )
-    rows = (await session.execute(q)).all()
+    async with AsyncSessionLocal() as session:
+        rows = (await session.execute(q)).all()
     series = [{"ts": r[0].isoformat() if hasattr(r[0], 'isoformat') else str(r[0]), "count": int(r[1])} for r in rows]
 
     # متوسط متحرك بسيط لتنعيم السلسلة (نافذة 3)
@@ -35,6 +34,11 @@ async def forecast(
     return {"hours": hours, "series": smooth}
 
 
+@router.get("/forecast", response_model=Dict[str, Any])
+async def forecast(hours: int = Query(default=24, ge=1, le=168)):
+    return await _load_forecast(hours)
+
+
 @router.get("/anomalies", response_model=Dict[str, Any])
 async def anomalies(session: AsyncSession = Depends(get_session)):
     # كشف مبسط: 
@@ -1,34 +1,28 @@
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
 from typing import List
-from math import radians, sin, cos, asin, sqrt
-import random
 
 from sqlalchemy import select, text as sa_text
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends
 import asyncio
 import json
+import os
 
 from core.db import get_session, AsyncSessionLocal
-from models.order import Order
-from models.restaurant import Restaurant
 from models.captain import Captain
 from .ws import manager
+from realtime.simulator import sim
 from core.redis import get_redis
+from core import captain_index, captain_load, dispatch
+from core.scoring import top_k
+from core.status_counts import invalidate_status_counts
+from core.idempotency import Idempotency, idempotency
 
 
 router = APIRouter(prefix="/api/v1/assign", tags=["assign"])
 
 
-def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    R = 6371.0
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
-    return 2 * R * asin(sqrt(a))
-
-
 class Candidate(BaseModel):
     captain_id: int
     captain_name: str
@@ -41,145 +35,257 @@ class Candidate(BaseModel):
     last_order_ids: List[int] = []
 
 
-@router.get("/orders/{order_id}/candidates", response_model=List[Candidate])
-async def candidates(order_id: int, radius_km: float = 5, session: AsyncSession = Depends(get_session)):
-    # احصل على الطلب والمطعم
-    result = await session.execute(select(Order).where(Order.order_id == order_id))
-    order = result.scalar_one_or_none()
-    if not order:
+# بحث الكباتن داخل نصف القطر يتم كله في SQL (استعلام واحد):
+# مع PostGIS: ST_DWithin + ترتيب KNN (<->) على فهرس GiST لـ captains.last_geo (migration 005)
+# بدونها: صندوق إحاطة على فهارس last_lat/last_lng (migration 004) ثم haversine على المرشحين فقط
+# يعود أقرب limit × CANDIDATE_PREFETCH_FACTOR كابتناً (بالمسافة، LIMIT محدود) ثم يرتّبهم top_k بالسكور كما
+# في مسار الفهرس؛ الهامش فوق limit يعطي الكابتن المتفرغ أو عالي التقييم الأبعد قليلاً فرصة الفوز
+CANDIDATE_PREFETCH_FACTOR = int(os.getenv("CANDIDATE_PREFETCH_FACTOR", "4"))
+_CANDIDATES_POSTGIS_SQL = sa_text(
+    """
+WITH ref AS (
+  SELECT o.order_id, r.restaurant_id, r.latitude AS lat, r.longitude AS lng,
+         COALESCE(r.geo, ST_SetSRID(ST_MakePoint(r.longitude, r.latitude), 4326)::geography) AS g
+  FROM orders o
+  LEFT JOIN restaurants r ON r.restaurant_id = o.restaurant_id
+  WHERE o.order_id = :order_id
+)
+SELECT ref.order_id, ref.restaurant_id, ref.lat AS ref_lat, ref.lng AS ref_lng,
+       c.captain_id, c.name, c.last_lat, c.last_lng, c.performance, c.distance_m
+FROM ref
+LEFT JOIN LATERAL (
+  SELECT c.captain_id, c.name, c.last_lat, c.last_lng, c.performance, ST_Distance(c.last_geo, ref.g) AS distance_m
+  FROM captains c
+  WHERE c.available AND ST_DWithin(c.last_geo, ref.g, :radius_m)
+  ORDER BY c.last_geo <-> ref.g
+  LIMIT :prefetch
+) c ON ref.g IS NOT NULL
+    """
+)
+
+_CANDIDATES_BBOX_SQL = sa_text(
+    """
+WITH ref AS (
+  SELECT o.order_id, r.restaurant_id, r.latitude::float8 AS lat, r.longitude::float8 AS lng
+  FROM orders o
+  LEFT JOIN restaurants r ON r.restaurant_id = o.restaurant_id
+  WHERE o.order_id = :order_id
+)
+SELECT ref.order_id, ref.restaurant_id, ref.lat AS ref_lat, ref.lng AS ref_lng,
+       c.captain_id, c.name, c.last_lat, c.last_lng, c.performance, c.distance_m
+FROM ref
+LEFT JOIN LATERAL (
+  SELECT b.*
+  FROM (
+    SELECT c.captain_id, c.name, c.last_lat, c.last_lng, c.performance,
+           2 * 6371000 * asin(least(1.0, sqrt(
+             power(sin(radians(c.last_lat - ref.lat) / 2), 2)
+             + cos(radians(ref.lat)) * cos(radians(c.last_lat)) * power(sin(radians(c.last_lng - ref.lng) / 2), 2)
+           ))) AS distance_m
+    FROM captains c
+    WHERE c.available
+      AND c.last_lat BETWEEN ref.lat - :dlat AND ref.lat + :dlat
+      AND c.last_lng BETWEEN ref.lng - :dlat / greatest(cos(radians(ref.lat)), 0.01)
+                         AND ref.lng + :dlat / greatest(cos(radians(ref.lat)), 0.01)
+  ) b
+  WHERE b.distance_m <= :radius_m
+  ORDER BY b.distance_m
+  LIMIT :prefetch
+) c ON ref.lat IS NOT NULL AND ref.lng IS NOT NULL
+    """
+)
+
+_REF_SQL = sa_text(
+    """
+SELECT o.order_id, r.restaurant_id, r.latitude AS lat, r.longitude AS lng
+FROM orders o
+LEFT JOIN restaurants r ON r.restaurant_id = o.restaurant_id
+WHERE o.order_id = :order_id
+    """
+)
+
+_postgis: bool | None = None
+
+
+async def _has_postgis(session: AsyncSession) -> bool:
+    """Whether captains.last_geo exists (migration 005 ran with PostGIS); checked once per worker."""
+    global _postgis
+    if _postgis is None:
+        _postgis = bool((await session.execute(sa_text(
+            "SELECT EXISTS (SELECT 1 FROM pg_attribute WHERE attrelid = to_regclass('captains') "
+            "AND attname = 'last_geo' AND NOT attisdropped)"
+        ))).scalar())
+    return _postgis
+
+
+def _candidate(captain_id: int, name: str, lat: float, lng: float, scored: tuple, active_orders: int) -> Candidate:
+    _, d, eta_sec, score = scored
+    return Candidate(
+        captain_id=captain_id,
+        captain_name=name,
+        last_lat=lat,
+        last_lng=lng,
+        active_orders=active_orders,
+        distance_km=round(d, 2),
+        eta_sec=eta_sec,
+        score=round(score, 3),
+        last_order_ids=[],
+    )
+
+
+async def _candidates_from_index(session: AsyncSession, order_id: int, radius_km: float, limit: int) -> List[Candidate]:
+    """Score every captain of the in-memory grid inside the radius in one batch; the DB is only hit by primary key."""
+    ref = (await session.execute(_REF_SQL, {"order_id": order_id})).first()
+    if ref is None:
         raise HTTPException(404, detail="Order not found")
+    if ref.restaurant_id is None or ref.lat is None or ref.lng is None:
+        raise HTTPException(404, detail="Restaurant not found")
+
+    ids, lats, lngs, _, perf = captain_index.INDEX.within(float(ref.lat), float(ref.lng), radius_km)
+    loads = await captain_load.get_many(ids, session)
+    active = [loads.get(cid, 0) for cid in ids]
+    best = top_k(float(ref.lat), float(ref.lng), lats, lngs, active, perf, radius_km, limit)
+    if not best:
+        return []
+    names = dict((await session.execute(
+        select(Captain.captain_id, Captain.name).where(Captain.captain_id.in_([ids[b[0]] for b in best]))
+    )).all())
+    return [
+        _candidate(ids[b[0]], names[ids[b[0]]], lats[b[0]], lngs[b[0]], b, active[b[0]])
+        for b in best
+        if ids[b[0]] in names
+    ]
+
+
+async def _candidates_from_db(session: AsyncSession, order_id: int, radius_km: float, limit: int) -> List[Candidate]:
+    """Score the nearest limit × CANDIDATE_PREFETCH_FACTOR captains with top_k (same scoring as the index path)."""
+    params = {
+        "order_id": order_id,
+        "radius_m": radius_km * 1000.0,
+        "prefetch": limit * max(1, CANDIDATE_PREFETCH_FACTOR),
+    }
+    if await _has_postgis(session):
+        rows = (await session.execute(_CANDIDATES_POSTGIS_SQL, params)).all()
+    else:
+        params["dlat"] = radius_km / 111.32
+        rows = (await session.execute(_CANDIDATES_BBOX_SQL, params)).all()
 
-    result = await session.execute(select(Restaurant).where(Restaurant.restaurant_id == order.restaurant_id))
-    restaurant = result.scalar_one_or_none()
-    if not restaurant:
+    if not rows:
+        raise HTTPException(404, detail="Order not found")
+    if rows[0].restaurant_id is None:
         raise HTTPException(404, detail="Restaurant not found")
 
-    ref_lat = float(restaurant.latitude)
-    ref_lng = float(restaurant.longitude)
-
-    # أحضر كباتن متاحين
-    result = await session.execute(select(Captain).where(Captain.available == True))
-    captains = result.scalars().all()
-
-    out: List[Candidate] = []
-    for c in captains:
-        # استخدم last_lat/last_lng إن توفّرت، وإلا ولّد إحداثيات قريبة مؤقتاً
-        if c.last_lat is not None and c.last_lng is not None:
-            lat = float(c.last_lat)
-            lng = float(c.last_lng)
-        else:
-            lat = ref_lat + random.uniform(-0.01, 0.01)
-            lng = ref_lng + random.uniform(-0.01, 0.01)
-        d = haversine_km(ref_lat, ref_lng, lat, lng)
-        if d <= radius_km:
-            # تقدير ETA بسيط: سرعة افتراضية 25 كم/ساعة + 60 ثانية ثابتة
-            avg_speed_kmh = 25.0
-            travel_hours = d / avg_speed_kmh
-            eta_sec = int(travel_hours * 3600 + 60)
-            # سكور: أقرب مسافة وأقل حمل أفضل
-            active_orders = 0
-            score = max(0.0, 1.0 - (d / radius_km)) + (0.5 if active_orders == 0 else 0.0)
-            out.append(
-                Candidate(
-                    captain_id=c.captain_id,
-                    captain_name=c.name,
-                    last_lat=lat,
-                    last_lng=lng,
-                    active_orders=active_orders,
-                    distance_km=round(d, 2),
-                    eta_sec=eta_sec,
-                    score=round(score, 3),
-                    last_order_ids=[],
-                )
-            )
+    ref_lat, ref_lng = float(rows[0].ref_lat), float(rows[0].ref_lng)
+    rows = [row for row in rows if row.captain_id is not None]
+    if not rows:
+        return []
+    lats = [float(row.last_lat) for row in rows]
+    lngs = [float(row.last_lng) for row in rows]
+    perf = [float(row.performance if row.performance is not None else 5) for row in rows]
+    loads = await captain_load.get_many([row.captain_id for row in rows], session)
+    active = [loads.get(row.captain_id, 0) for row in rows]
+    best = top_k(ref_lat, ref_lng, lats, lngs, active, perf, radius_km, limit)
+    return [_candidate(rows[b[0]].captain_id, rows[b[0]].name, lats[b[0]], lngs[b[0]], b, active[b[0]]) for b in best]
+
 
-    # رتب حسب score ثم المسافة
-    out.sort(key=lambda x: (-(x.score or 0), x.distance_km))
+@router.get("/orders/{order_id}/candidates", response_model=List[Candidate])
+async def candidates(
+    order_id: int,
+    radius_km: float = Query(5, gt=0, le=100),
+    limit: int = Query(50, ge=1, le=500),
+    session: AsyncSession = Depends(get_session),
+):
+    if captain_index.ready():
+        out = await _candidates_from_index(session, order_id, radius_km, limit)
+    else:
+        out = await _candidates_from_db(session, order_id, radius_km, limit)
+    # مرتبة مسبقاً حسب score ثم المسافة (core.scoring.top_k)
     return out
 
 
+@router.post("/dispatch")
+async def dispatch_batch(
+    limit: int = Query(dispatch.DISPATCH_MAX_ORDERS, ge=1, le=5000),
+    radius_km: float = Query(dispatch.DISPATCH_RADIUS_KM, gt=0, le=100),
+    dry_run: bool = False,
+    session: AsyncSession = Depends(get_session),
+):
+    """Assign every unassigned choose_captain order at once (global min total ETA)."""
+    return await dispatch.dispatch(session, limit=limit, radius_km=radius_km, dry_run=dry_run)
+
+
 class AssignIn(BaseModel):
     captain_id: int
 
 
+_ASSIGN_SQL = sa_text(
+    """
+WITH prev AS (
+  SELECT order_id, captain_id FROM orders WHERE order_id = :order_id FOR UPDATE
+)
+UPDATE orders o SET captain_id = :captain_id, status = 'choose_captain'
+FROM prev
+WHERE o.order_id = prev.order_id
+RETURNING prev.captain_id AS previous_captain_id
+    """
+)
+
+_ASSIGN_EVENTS_SQL = sa_text(
+    """
+INSERT INTO order_events(order_id, event_type, payload, created_at)
+VALUES (:oid, 'assigned', CAST(:p AS JSONB), timezone('utc', now())),
+       (:oid, 'accepted', CAST(:p AS JSONB), timezone('utc', now()))
+    """
+)
+
+
 @router.post("/orders/{order_id}/assign")
-async def assign(order_id: int, body: AssignIn, Idempotency_Key: str | None = Header(default=None)):
-    # تحقق idempotency اختياري: إذا تم إرسال نفس المفتاح سابقًا، نتجاهل التكرار
-    if Idempotency_Key:
-        try:
-            async with AsyncSessionLocal() as idempotency_session:
-                await idempotency_session.execute(sa_text("INSERT INTO idempotency_keys(key) VALUES (:k) ON CONFLICT DO NOTHING"), {"k": Idempotency_Key})
-                rows = (await idempotency_session.execute(sa_text("SELECT key FROM idempotency_keys WHERE key=:k"), {"k": Idempotency_Key})).all()
-                if not rows:
-                    return {"ok": True, "duplicate": True}
-                await idempotency_session.commit()
-        except Exception:
-            pass
-    
-    # استخدام جلسة جديدة لضمان نظافتها
-    async with AsyncSessionLocal() as clean_session:
+async def assign(order_id: int, body: AssignIn, idem: Idempotency = Depends(idempotency("assign"))):
+    """Assign a captain: order update, both events and the idempotency key commit together.
+
+    Replaying the same Idempotency-Key returns the stored response without touching orders.
+    """
+    async with AsyncSessionLocal() as session:
         try:
-            # إعادة تعيين الجلسة للتأكد من نظافتها
-            await clean_session.rollback()
-            
-            result = await clean_session.execute(select(Order).where(Order.order_id == order_id))
-            order = result.scalar_one_or_none()
-            if not order:
+            replay = await idem.replay(session)
+            if replay is not None:
+                await session.rollback()
+                return replay
+
+            row = (await session.execute(_ASSIGN_SQL, {"order_id": order_id, "captain_id": body.captain_id})).first()
+            if row is None:
                 raise HTTPException(404, detail="Order not found")
-            
-            # تحديث الطلب
-            if hasattr(order, 'captain_id'):
-                setattr(order, 'captain_id', body.captain_id)
-            if hasattr(order, 'status'):
-                setattr(order, 'status', 'choose_captain')
-            if hasattr(order, 'current_status'):
-                setattr(order, 'current_status', 'choose_captain')
-            
-            await clean_session.commit()
-            
-            # بثّ حدث التعيين عبر Redis (اختياري)
-            try:
-                r = await get_redis()
-                if r:
-                    channel = f"captain:{body.captain_id}"
-                    await r.publish(channel, json.dumps({"type": "assigned", "order_id": order_id, "captain_id": body.captain_id}))
-            except Exception:
-                pass
-                
-            # سجل الحدث في order_events باستخدام جلسة جديدة
-            try:
-                async with AsyncSessionLocal() as event_session:
-                    await event_session.execute(sa_text("INSERT INTO order_events(order_id, event_type, payload) VALUES (:oid, 'assigned', CAST(:p AS JSONB))"), {"oid": order_id, "p": json.dumps({"captain_id": body.captain_id})})
-                    await event_session.commit()
-            except Exception:
-                pass
-
-            # إرسال قبول محاكى بعد 3 ثوانٍ عبر WS
-            try:
-                asyncio.create_task(
-                    manager.send_json_after(
-                        body.captain_id,
-                        {"type": "accepted", "captain_id": body.captain_id, "order_id": order_id},
-                        3.0,
-                    )
-                )
-            except Exception:
-                pass
-                
-            # سجل accepted أيضاً باستخدام جلسة جديدة
-            try:
-                async with AsyncSessionLocal() as event_session:
-                    await event_session.execute(sa_text("INSERT INTO order_events(order_id, event_type, payload) VALUES (:oid, 'accepted', CAST(:p AS JSONB))"), {"oid": order_id, "p": json.dumps({"captain_id": body.captain_id})})
-                    await event_session.commit()
-            except Exception:
-                pass
-                
-            return {"ok": True}
-            
+            await session.execute(
+                _ASSIGN_EVENTS_SQL, {"oid": order_id, "p": json.dumps({"captain_id": body.captain_id})}
+            )
+            response = {"ok": True}
+            await idem.save(session, response)
+            await session.commit()
+        except HTTPException:
+            await session.rollback()
+            raise
         except Exception as e:
-            await clean_session.rollback()
+            await session.rollback()
             raise HTTPException(500, detail=f"Failed to assign captain: {str(e)}")
 
+    await idem.done(response)
+    await invalidate_status_counts()
+    await captain_load.refresh([body.captain_id, row.previous_captain_id])
+
+    # بثّ حدث التعيين عبر Redis (اختياري)
+    try:
+        r = await get_redis()
+        if r:
+            channel = f"captain:{body.captain_id}"
+            await r.publish(channel, json.dumps({"type": "assigned", "order_id": order_id, "captain_id": body.captain_id}))
+    except Exception:
+        pass
+
+    # إرسال قبول محاكى عبر WS (نفس مسار التوزيع الدفعي)
+    dispatch.notify_accepted(body.captain_id, order_id)
+
+    return response
+
 
 class StartDeliveryBody(BaseModel):
     captain_id: int
@@ -211,17 +317,7 @@ async def test_start_delivery(order_id: int, body: StartDeliveryBody):
     c_lat = float(c.get('lat', 33.515))
     c_lng = float(c.get('lng', 36.28))
 
-    async def _route_loop():
-        steps = 30
-        for i in range(steps + 1):
-            t = i / steps
-            lat = r_lat + (c_lat - r_lat) * t
-            lng = r_lng + (c_lng - r_lng) * t
-            await manager.send_json(cpt, { 'type': 'pos', 'captain_id': cpt, 'lat': lat, 'lng': lng })
-            await asyncio.sleep(1)
-        await manager.send_json(cpt, { 'type': 'delivered', 'captain_id': cpt })
-
-    asyncio.create_task(_route_loop())
+    sim.route(cpt, r_lat, r_lng, c_lat, c_lng)
     return {"ok": True}
 
 
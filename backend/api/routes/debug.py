@@ -1,10 +1,13 @@
 from fastapi import APIRouter, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select as _select
-from core.status import compute_current_status
-from core.db import get_session
-from models.order import Order
+from core import maintenance, singleflight, captain_index, captain_load, idempotency, events, event_partitions, positions, position_history
+from core.db import get_session, AsyncSessionLocal
+from core.status_counts import get_status_counts, reconcile_status_counters, reconcile_job, RECONCILE_JOB
 from core.db import engine
+from realtime.connections import manager as ws_manager
+from realtime.pubsub import bus as ws_bus
+from realtime.broadcast import feed as ws_feed
+from realtime.simulator import sim as ws_sim
 
 router = APIRouter()
 
@@ -27,12 +30,90 @@ def _sanitize_db_url() -> str:
 @router.get("/diag")
 async def debug_diag(session: AsyncSession = Depends(get_session)):
     async with session as db_session:
-        result = await db_session.execute(_select(Order))
-        orders = result.scalars().all()
-        counts = {}
-        for o in orders:
-            cs = compute_current_status(o)
-            counts[cs] = counts.get(cs, 0) + 1
-        return {"db_url": _sanitize_db_url(), "orders_total": len(orders), "by_status": counts}
+        snap = await get_status_counts(db_session, fresh=True)
+        counts = {k: v for k, v in snap["statuses"].items() if v}
+        return {"db_url": _sanitize_db_url(), "orders_total": sum(snap["statuses"].values()), "by_status": counts}
 
 
+@router.post("/counters/reconcile")
+async def debug_reconcile_counters(repair: bool = True):
+    """Run the order_status_counters drift check now (same job as the periodic one)."""
+    if repair:
+        drift = await maintenance.run_job(RECONCILE_JOB, reconcile_job)
+    else:
+        async with AsyncSessionLocal() as session:
+            drift = await reconcile_status_counters(session, repair=False)
+    if drift is None:
+        return {"ok": False, "detail": "reconcile already running on another worker"}
+    return {"ok": True, "repaired": repair, "drift": drift}
+
+
+@router.get("/singleflight")
+async def debug_singleflight():
+    """Hit/miss counters of the coalesced read endpoints in this worker."""
+    return singleflight.metrics()
+
+
+@router.get("/captain_index")
+async def debug_captain_index(snapshot: bool = False):
+    """Size/state of this worker's in-memory captain grid (optionally with the full snapshot)."""
+    out = captain_index.metrics()
+    if snapshot:
+        out["snapshot"] = captain_index.INDEX.snapshot()
+    return out
+
+
+@router.post("/captain_load/reconcile")
+async def debug_reconcile_captain_load(repair: bool = True):
+    """Run the captain_active_orders drift check now (same job as the periodic one)."""
+    if repair:
+        drift = await maintenance.run_job(captain_load.RECONCILE_JOB, captain_load.reconcile_job)
+    else:
+        async with AsyncSessionLocal() as session:
+            drift = await captain_load.reconcile(session, repair=False)
+    if drift is None:
+        return {"ok": False, "detail": "reconcile already running on another worker"}
+    return {"ok": True, "repaired": repair, "drift": drift, "metrics": captain_load.metrics()}
+
+
+@router.get("/idempotency")
+async def debug_idempotency():
+    """Replay/claim counters of the Idempotency-Key store in this worker."""
+    return idempotency.metrics()
+
+
+@router.get("/events")
+async def debug_events():
+    """Queue depth and flush counters of the batched order_events writer."""
+    return events.metrics()
+
+
+@router.get("/positions")
+async def debug_positions():
+    """Live position ingestion (batched flushes to captains) and the captain_positions history writer."""
+    return {**positions.metrics(), "history": position_history.metrics()}
+
+
+@router.post("/captain_positions/maintenance")
+async def debug_captain_positions_maintenance():
+    """Run the captain_positions job now (partitions, retention, downsampling)."""
+    result = await maintenance.run_job(position_history.JOB, position_history.maintenance_job)
+    if result is None:
+        return {"ok": False, "detail": "job already running on another worker"}
+    return {"ok": True, **result}
+
+
+@router.post("/order_events/partitions")
+async def debug_order_events_partitions():
+    """Run the order_events partition job now (create upcoming months, drop expired ones)."""
+    result = await maintenance.run_job(event_partitions.JOB, event_partitions.partitions_job)
+    if result is None:
+        return {"ok": False, "detail": "partition job already running on another worker"}
+    async with AsyncSessionLocal() as session:
+        return {"ok": True, **result, "partitions": await event_partitions.partitions(session)}
+
+
+@router.get("/ws")
+async def debug_ws():
+    """Captain WebSocket fan-out (connections, queue depths, drops), shared Redis pubsub, dashboard feed and simulator."""
+    return {**ws_manager.metrics(), "pubsub": ws_bus.metrics(), "feed": ws_feed.metrics(), "sim": ws_sim.metrics()}
@@ -1,13 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Body
-from sqlalchemy import select, func
+from fastapi import APIRouter, Depends, HTTPException, Query, Body, Request, Response
+from pydantic import BaseModel, Field
+from sqlalchemy import select, update, func, tuple_
 from sqlalchemy import text as sa_text, literal_column
 from sqlalchemy import text as sa_text
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List, Dict, Any
-import logging
-
-from core.status import compute_current_status, compute_substage, normalize_status, VALID
-from core.db import get_session
+from typing import List, Dict, Any, Tuple, Literal
+from datetime import datetime
+import base64
+import json
+
+from core.status import compute_current_status, compute_substage, normalize_status, current_status_filter, substage_sql, VALID
+from core.transitions import TRANSITIONS
+from core.db import engine, get_session, get_autocommit_connection
+from core.status_counts import operator_tab_counts, invalidate_status_counts
+from core import captain_load, events, timeline
+from core.idempotency import Idempotency, idempotency
 from models.order import Order
 from models.note import Note
 from models.rating import Rating
@@ -18,21 +25,28 @@ from models.restaurant import Restaurant
 
 router = APIRouter()
 
-# خريطة الحالات القديمة إلى الجديدة
-ALIASES = {"issue": "problem"}
-
 def _norm(v: str | None) -> str | None:
     """Normalize status value: lowercase, strip, apply aliases."""
-    if not v:
-        return None
-    v = v.strip().lower()
-    return ALIASES.get(v, v)
+    return normalize_status(v) if v else None
 
 def _extract_status(status=None, order_status=None, tab=None):
     """Extract and validate status from any of the three parameters."""
     q = _norm(status) or _norm(order_status) or _norm(tab)
     return q if q in VALID else None
 
+def _encode_cursor(o: Order) -> str:
+    """Opaque keyset cursor pointing just after `o` in (created_at DESC, order_id DESC) order."""
+    raw = json.dumps([o.created_at.isoformat() if o.created_at else None, o.order_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        ts, oid = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(ts), int(oid)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 def serialize(o: Order) -> dict:
     """Serialize order with current_status and substage."""
     d = {
@@ -60,47 +74,47 @@ def serialize(o: Order) -> dict:
 
 @router.get("", response_model=List[Dict[str, Any]])
 async def list_orders(
+    response: Response,
     status: str | None = Query(default=None),
     order_status: str | None = Query(default=None),
     tab: str | None = Query(default=None),
     limit: int = Query(default=50, ge=1, le=100),
     offset: int = Query(default=0, ge=0),
+    cursor: str | None = Query(default=None),
     session: AsyncSession = Depends(get_session),
 ):
-    """List orders with filtering by status, order_status, or tab."""
+    """List orders with filtering by status, order_status, or tab.
+
+    Pass the `X-Next-Cursor` response header back as `cursor` to fetch the next
+    page; `offset` is kept for older clients and ignored when a cursor is given.
+    """
     q = _extract_status(status, order_status, tab)
-    
-    # Get orders with pagination
-    result = await session.execute(
-        select(Order).order_by(Order.created_at.desc()).limit(limit).offset(offset)
-    )
-    orders = result.scalars().all()
-    
-    # Serialize orders
-    rows = [serialize(o) for o in orders]
-    
-    # Apply status filtering if requested - الفلترة تعتمد حصرياً على current_status
+
+    # الفلترة تتم داخل SQL (نفس منطق current_status) حتى تكون الصفحة ممتلئة دائماً
+    stmt = select(Order)
     if q:
-        rows = [r for r in rows if r.get("current_status") == q]
-    
-    return rows
+        stmt = stmt.where(current_status_filter(Order.status, q))
+    if cursor:
+        created_at, order_id = _decode_cursor(cursor)
+        stmt = stmt.where(tuple_(Order.created_at, Order.order_id) < tuple_(created_at, order_id))
+    elif offset:
+        stmt = stmt.offset(offset)
+    stmt = stmt.order_by(Order.created_at.desc(), Order.order_id.desc()).limit(limit)
+
+    orders = (await session.execute(stmt)).scalars().all()
+    if len(orders) == limit:
+        response.headers["X-Next-Cursor"] = _encode_cursor(orders[-1])
+
+    return [serialize(o) for o in orders]
 
 
 @router.get("/counts", response_model=Dict[str, int])
-async def counts(session: AsyncSession = Depends(get_session)) -> Dict[str, int]:
+async def counts(substages: bool = Query(default=False)) -> Dict[str, int]:
     """Return counts per tab (using current_status logic to match UI).
     This aligns counters with what the dashboard renders under each tab.
+    With `substages=true` the processing breakdown is added as `processing.<substage>`.
     """
-    result = await session.execute(select(Order))
-    orders = result.scalars().all()
-
-    counts_map: Dict[str, int] = {k: 0 for k in VALID}
-    for order in orders:
-        current = compute_current_status(order)
-        if current in counts_map:
-            counts_map[current] += 1
-
-    return counts_map
+    return await operator_tab_counts(substages)
 
 @router.post("/demo", response_model=Dict[str, Any])
 async def create_demo_order(session: AsyncSession = Depends(get_session)):
@@ -136,8 +150,11 @@ async def create_demo_order(session: AsyncSession = Depends(get_session)):
     await session.refresh(o)
     
     await session.commit()
+    await invalidate_status_counts()
     
-    return serialize(o)
+    d = serialize(o)
+    await _log_transition("create", d)
+    return d
 
 @router.post("/demo/processing", response_model=Dict[str, Any])
 async def create_demo_processing_order(session: AsyncSession = Depends(get_session)):
@@ -174,160 +191,248 @@ async def create_demo_processing_order(session: AsyncSession = Depends(get_sessi
     await session.refresh(o)
     
     await session.commit()
+    await invalidate_status_counts()
     
-    return serialize(o)
+    d = serialize(o)
+    await _log_transition("create", d)
+    return d
 
-@router.patch("/{order_id}/next", response_model=Dict[str, Any])
-async def advance_order(order_id: int, session: AsyncSession = Depends(get_session)):
-    """Advance order to next status."""
-    result = await session.execute(select(Order).where(Order.order_id == order_id))
-    order = result.scalar_one_or_none()
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    current = compute_current_status(order)
-    
-    # Check if order is in a valid state for transition
-    if current in ['delivered', 'cancelled', 'problem', 'deferred', 'pickup']:
-        raise HTTPException(status_code=400, detail="Invalid transition")
-    
-    # Apply next transition - منع ازدواج "حالات نشطة"
-    if current == 'pending':
-        # إذا كان الطلب deferred، اقفز مباشرة إلى processing
-        if getattr(order, 'is_deferred', False):
-            order.status = 'processing'
-            order.current_stage_name = 'waiting_approval'
-        else:
-            # Normal orders go to choose_captain
-            order.status = 'choose_captain'
-    elif current == 'choose_captain':
-        order.status = 'processing'
-        order.current_stage_name = 'waiting_approval'
-    elif current == 'processing':
-        # تحديث substage داخل processing
-        substage = compute_substage(order)
-        if substage == 'waiting_approval':
-            order.current_stage_name = 'preparing'
-        elif substage == 'preparing':
-            order.current_stage_name = 'captain_received'
-        elif substage == 'captain_received':
-            order.status = 'out_for_delivery'
-    elif current == 'out_for_delivery':
-        order.status = 'delivered'
-    elif current == 'deferred':
-        # الطلبات المؤجلة تنتقل إلى processing
-        order.status = 'processing'
-        order.current_stage_name = 'waiting_approval'
-    elif current == 'pickup':
-        # الطلبات الاستلام الشخصي تنتقل إلى processing
-        order.status = 'processing'
-        order.current_stage_name = 'waiting_approval'
-    
+class BulkIn(BaseModel):
+    order_ids: List[int] = Field(..., min_length=1, max_length=1000)
+    action: Literal["next", "cancel", "problem"]
+
+
+def _locked_update(*where) -> Tuple[Any, Any]:
+    """UPDATE orders over the rows matched by `where`, plus a locked pre-image whose `prev_status`
+    RETURNING can carry (captain_load.crosses decides from it whether the captain's counter changed)."""
+    prev = select(Order.order_id, Order.status.label("prev_status")).where(*where).with_for_update().subquery("prev")
+    return update(Order).where(Order.order_id == prev.c.order_id, *where), prev
+
+
+def _transition(action: str, *where) -> Any:
+    """Build the single statement for next/cancel/problem over the rows matched by `where`.
+
+    Returns a SELECT over an UPDATE ... RETURNING CTE (plus `prev_status`, the
+    status before the update); for cancel the same statement also bumps
+    customers.cancelled_count once per affected customer.
+    """
+    stmt, prev = _locked_update(*where)
+    if action == "next":
+        guard, new_status, new_stage = TRANSITIONS.next_sql(Order.status, Order.current_stage_name, Order.is_deferred)
+        stmt = stmt.where(guard).values(status=new_status, current_stage_name=new_stage)
+    else:
+        target = "cancelled" if action == "cancel" else "problem"
+        stmt = stmt.where(TRANSITIONS.status_in_sql(Order.status, TRANSITIONS.sources(target))).values(status=target)
+    upd = stmt.returning(*Order.__table__.c, prev.c.prev_status).cte("upd")
+
+    query = select(upd)
+    if action == "cancel":
+        # زيادة cancelled_count لكل عميل دفعة واحدة ضمن نفس الاستعلام
+        per_customer = (
+            select(upd.c.customer_id, func.count().label("n"))
+            .where(upd.c.customer_id.is_not(None))
+            .group_by(upd.c.customer_id)
+            .subquery()
+        )
+        bump = (
+            update(Customer)
+            .where(Customer.customer_id == per_customer.c.customer_id)
+            .values(cancelled_count=func.coalesce(Customer.cancelled_count, 0) + per_customer.c.n)
+            .returning(Customer.customer_id)
+            .cte("bump")
+        )
+        query = query.add_cte(bump)
+    return query
+
+
+def _expected(expected_status: str | None, expected_substage: str | None) -> List[Any]:
+    """Optimistic-concurrency predicates for the state the client last saw."""
+    where: List[Any] = []
+    if expected_status:
+        where.append(current_status_filter(Order.status, normalize_status(expected_status)))
+    if expected_substage:
+        where.append(substage_sql(Order.status, Order.current_stage_name) == expected_substage.strip().lower())
+    return where
+
+
+async def _apply(order_id: int, action: str, query: Any, reject, idem: Idempotency | None = None) -> Dict[str, Any]:
+    """Run one guarded UPDATE ... RETURNING in autocommit and serialize the returned row.
+
+    When no row comes back the order is looked up once and `reject(order)`
+    decides the error (404 is handled here). With an Idempotency-Key the key,
+    the update and the stored response share one transaction instead.
+    """
+    keyed = idem is not None and idem.key is not None
+    async with (engine.begin() if keyed else get_autocommit_connection()) as conn:
+        if keyed:
+            replay = await idem.replay(conn)
+            if replay is not None:
+                return replay
+        row = (await conn.execute(query)).first()
+        if row is None:
+            current = (await conn.execute(
+                select(Order.status, Order.current_stage_name, Order.is_deferred).where(Order.order_id == order_id)
+            )).first()
+            if current is None:
+                raise HTTPException(status_code=404, detail="Order not found")
+            raise reject(current)
+        response = serialize(row)
+        # العداد يُقرأ على الاتصال نفسه، وفقط إن دخل الطلب حالة نشطة أو خرج منها (لا لخطوات substage)
+        loads = {}
+        if row.captain_id is not None and captain_load.crosses(row.prev_status, row.status):
+            loads = await captain_load.read([row.captain_id], conn)
+        if keyed:
+            await idem.save(conn, response)
+    if keyed:
+        await idem.done(response)
+    await _log_transition(action, response)
+    await invalidate_status_counts()
+    await captain_load.publish(loads)
+    return response
+
+
+async def _log_transition(action: str, order: Dict[str, Any]) -> None:
+    """Append a status_changed row to order_events through the batched writer (not awaited on the DB)."""
+    await events.emit(order["order_id"], "status_changed", {
+        "action": action,
+        "status": order["current_status"],
+        "substage": order["substage"],
+        "captain_id": order["captain_id"],
+    })
+
+
+def _conflict(current) -> HTTPException:
+    return HTTPException(
+        status_code=409,
+        detail=f"Order status changed (now {compute_current_status(current)})",
+    )
+
+
+@router.patch("/bulk", response_model=Dict[str, Any])
+async def bulk_transition(body: BulkIn, session: AsyncSession = Depends(get_session)):
+    """Apply next/cancel/problem to many orders with one UPDATE ... RETURNING.
+
+    Orders that cannot make the transition are reported per id and left untouched.
+    """
+    ids = list(dict.fromkeys(body.order_ids))
+    query = _transition(body.action, Order.order_id.in_(ids))
+
+    rows = (await session.execute(query)).all()
+    updated = {row.order_id: serialize(row) for row in rows}
     await session.commit()
-    await session.refresh(order)
-    
-    return serialize(order)
+    if updated:
+        for order in updated.values():
+            await _log_transition(body.action, order)
+        await invalidate_status_counts()
+        await captain_load.refresh(
+            [row.captain_id for row in rows if captain_load.crosses(row.prev_status, row.status)], session
+        )
+
+    missing = [oid for oid in ids if oid not in updated]
+    existing: set = set()
+    if missing:
+        existing = set((await session.execute(
+            select(Order.order_id).where(Order.order_id.in_(missing))
+        )).scalars().all())
+
+    results = []
+    for oid in ids:
+        if oid in updated:
+            results.append({"order_id": oid, "ok": True, "order": updated[oid]})
+        elif oid in existing:
+            results.append({"order_id": oid, "ok": False, "error": "Invalid transition"})
+        else:
+            results.append({"order_id": oid, "ok": False, "error": "Order not found"})
+    return {"action": body.action, "updated": len(updated), "results": results}
+
+
+@router.patch("/{order_id}/next", response_model=Dict[str, Any])
+async def advance_order(
+    order_id: int,
+    expected_status: str | None = Query(default=None),
+    expected_substage: str | None = Query(default=None),
+):
+    """Advance order to next status.
+
+    `expected_status` (and `expected_substage` for processing orders) is the
+    state the client last saw and is part of the UPDATE guard, so a repeated
+    click fails with 409 instead of advancing twice. Without it (older builds
+    such as movo-ts/dist_copy) only the transition table guards the update and
+    a double click can advance two stages; current clients always send it.
+    """
+    if expected_status and normalize_status(expected_status) == "processing" and not expected_substage:
+        # بدون substage تبقى خطوتان داخل processing ممكنتين لنقرة مكررة
+        raise HTTPException(status_code=422, detail="expected_substage is required for processing orders")
+
+    def reject(current) -> HTTPException:
+        if TRANSITIONS.next(current.status, current.current_stage_name, current.is_deferred) is None:
+            return HTTPException(status_code=400, detail="Invalid transition")
+        return _conflict(current)
+
+    where = [Order.order_id == order_id, *_expected(expected_status, expected_substage)]
+    return await _apply(order_id, "next", _transition("next", *where), reject)
 
 @router.patch("/{order_id}/cancel", response_model=Dict[str, Any])
-async def cancel_order(order_id: int, session: AsyncSession = Depends(get_session)):
-    """Cancel order and increment customer cancelled count."""
-    result = await session.execute(select(Order).where(Order.order_id == order_id))
-    order = result.scalar_one_or_none()
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    # Cancel the order
-    order.status = 'cancelled'
-    
-    # Increment customer cancelled count
-    if order.customer_id:
-        try:
-            await session.execute(
-                sa_text(
-                    "UPDATE customers SET cancelled_count = COALESCE(cancelled_count, 0) + 1 WHERE customer_id = :cid"
-                ),
-                {"cid": order.customer_id},
-            )
-        except Exception as e:
-            # إذا كان العمود غير موجود أو حدث خطأ، نسجل فقط ولا نفشل العملية
-            logging.getLogger(__name__).warning("cancelled_count update failed: %s", e)
-    
-    await session.commit()
-    await session.refresh(order)
-    
-    return serialize(order)
+async def cancel_order(
+    order_id: int,
+    expected_status: str | None = Query(default=None),
+    idem: Idempotency = Depends(idempotency("cancel")),
+):
+    """Cancel order and increment customer cancelled count (once, in the same statement)."""
+    where = [Order.order_id == order_id, *_expected(expected_status, None)]
+    return await _apply(order_id, "cancel", _transition("cancel", *where), _conflict, idem)
 
 
 @router.patch("/{order_id}/problem", response_model=Dict[str, Any])
-async def mark_order_problem(order_id: int, session: AsyncSession = Depends(get_session)):
+async def mark_order_problem(order_id: int, expected_status: str | None = Query(default=None)):
     """Mark order as problem (moves to 'problem' tab)."""
-    result = await session.execute(select(Order).where(Order.order_id == order_id))
-    order = result.scalar_one_or_none()
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-
-    # Set status to problem
-    order.status = 'problem'
+    where = [Order.order_id == order_id, *_expected(expected_status, None)]
+    return await _apply(order_id, "problem", _transition("problem", *where), _conflict)
 
-    await session.commit()
-    await session.refresh(order)
 
-    return serialize(order)
+def _set_status(target_status: str) -> Dict[str, Any]:
+    # Initialize processing substage when moving into processing with no substage
+    values: Dict[str, Any] = {"status": target_status}
+    if target_status == "processing":
+        values["current_stage_name"] = func.coalesce(
+            func.nullif(Order.current_stage_name, ""), "waiting_approval"
+        )
+    return values
 
 
 @router.patch("/{order_id}/resolve", response_model=Dict[str, Any])
-async def resolve_order_problem(order_id: int, payload: Dict[str, Any] = Body(...), session: AsyncSession = Depends(get_session)):
+async def resolve_order_problem(order_id: int, payload: Dict[str, Any] = Body(...)):
     """Resolve order from problem status to specified status."""
-    result = await session.execute(select(Order).where(Order.order_id == order_id))
-    order = result.scalar_one_or_none()
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-
-    # Check if order is currently in problem status
-    if order.status != 'problem':
-        raise HTTPException(status_code=400, detail="Order is not in problem status")
-
     # Get target status from payload
     target_status = payload.get("status")
-    if not target_status or target_status not in VALID:
+    if not target_status or not TRANSITIONS.can_transition(TRANSITIONS.resolve_from, target_status):
         raise HTTPException(status_code=422, detail="Invalid target status")
 
-    # Apply target status
-    order.status = target_status
-
-    # Initialize processing substage when moving into processing with no substage
-    if target_status == "processing" and not getattr(order, "current_stage_name", None):
-        order.current_stage_name = "waiting_approval"
-
-    await session.commit()
-    await session.refresh(order)
-
-    return serialize(order)
+    # الشرط status = 'problem' جزء من نفس التحديث
+    stmt, prev = _locked_update(Order.order_id == order_id, current_status_filter(Order.status, TRANSITIONS.resolve_from))
+    stmt = stmt.values(**_set_status(target_status)).returning(*Order.__table__.c, prev.c.prev_status)
+    return await _apply(
+        order_id,
+        "resolve",
+        stmt,
+        lambda current: HTTPException(status_code=400, detail="Order is not in problem status"),
+    )
 
 
 @router.patch("/{order_id}", response_model=Dict[str, Any])
-async def update_order_status(order_id: int, payload: Dict[str, Any] = Body(None), session: AsyncSession = Depends(get_session)):
+async def update_order_status(
+    order_id: int,
+    payload: Dict[str, Any] = Body(None),
+    expected_status: str | None = Query(default=None),
+):
     """Generic status update endpoint: expects {"status": "..."}."""
-    result = await session.execute(select(Order).where(Order.order_id == order_id))
-    order = result.scalar_one_or_none()
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-
     requested = normalize_status(payload.get("status")) if payload else None
     if not requested or requested not in VALID:
         raise HTTPException(status_code=422, detail="Invalid status")
 
-    # Apply status
-    order.status = requested
-
-    # Initialize processing substage when moving into processing with no substage
-    if requested == "processing" and not getattr(order, "current_stage_name", None):
-        order.current_stage_name = "waiting_approval"
-
-    await session.commit()
-    await session.refresh(order)
-
-    return serialize(order)
+    stmt, prev = _locked_update(Order.order_id == order_id, *_expected(expected_status, None))
+    stmt = stmt.values(**_set_status(requested)).returning(*Order.__table__.c, prev.c.prev_status)
+    return await _apply(order_id, "set_status", stmt, _conflict)
 
 
 # Notes endpoints (order-scoped)
@@ -356,7 +461,12 @@ async def list_order_notes(order_id: int, session: AsyncSession = Depends(get_se
 
 
 @router.post("/{order_id}/notes", response_model=Dict[str, Any])
-async def add_order_note(order_id: int, payload: Dict[str, Any] = Body(...), session: AsyncSession = Depends(get_session)):
+async def add_order_note(
+    order_id: int,
+    payload: Dict[str, Any] = Body(...),
+    session: AsyncSession = Depends(get_session),
+    idem: Idempotency = Depends(idempotency("notes")),
+):
     text = (payload or {}).get("note_text")
     source = (payload or {}).get("source") or 'employee'
     if not text or not isinstance(text, str) or not text.strip():
@@ -366,6 +476,9 @@ async def add_order_note(order_id: int, payload: Dict[str, Any] = Body(...), ses
     order = result.scalar_one_or_none()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
+    replay = await idem.replay(session)
+    if replay is not None:
+        return replay
 
     # Insert with explicit cast to avoid enum/varchar mismatch
     ins = sa_text(
@@ -376,8 +489,18 @@ async def add_order_note(order_id: int, payload: Dict[str, Any] = Body(...), ses
         """
     )
     row = (await session.execute(ins, {"nt": "order", "t": "order", "rid": order_id, "txt": text.strip(), "src": source})).first()
-    await session.commit()
     note_id, created_at = row[0], row[1]
+    response = {
+        "note_id": int(note_id),
+        "target_type": "order",
+        "reference_id": order_id,
+        "note_text": text.strip(),
+        "created_at": created_at.isoformat() if hasattr(created_at, 'isoformat') else str(created_at),
+        "source": source,
+    }
+    await idem.save(session, response)
+    await session.commit()
+    await idem.done(response)
 
     # إشعار تبويب مطابق لحالة الطلب الحالية
     try:
@@ -393,14 +516,7 @@ async def add_order_note(order_id: int, payload: Dict[str, Any] = Body(...), ses
                 pass
     except Exception:
         pass
-    return {
-        "note_id": int(note_id),
-        "target_type": "order",
-        "reference_id": order_id,
-        "note_text": text.strip(),
-        "created_at": created_at.isoformat() if hasattr(created_at, 'isoformat') else str(created_at),
-        "source": source,
-    }
+    return response
 
 
 @router.get("/notes/flags", response_model=Dict[int, bool])
@@ -427,6 +543,40 @@ async def notes_flags(ids: str = Query(default=""), session: AsyncSession = Depe
     return flags
 
 
+@router.get("/timeline")
+async def orders_timeline(
+    request: Request,
+    ids: str = Query(default=""),
+    format: Literal["json", "msgpack"] | None = Query(default=None),
+    session: AsyncSession = Depends(get_session),
+):
+    """Timelines of up to 500 comma-separated order ids in one query: {"orders": {id: [...]}, "missing": [...]}."""
+    order_ids = list(dict.fromkeys(int(x) for x in ids.split(',') if x.strip().isdigit()))
+    if len(order_ids) > timeline.MAX_BATCH:
+        raise HTTPException(status_code=422, detail=f"At most {timeline.MAX_BATCH} ids per request")
+    found = await timeline.load(session, order_ids) if order_ids else {}
+    body = {
+        "orders": {str(oid): found[oid] for oid in order_ids if oid in found},
+        "missing": [oid for oid in order_ids if oid not in found],
+    }
+    return timeline.respond(request, body, timeline.etag(found), format)
+
+
+@router.get("/{order_id}/timeline")
+async def order_timeline(
+    order_id: int,
+    request: Request,
+    format: Literal["json", "msgpack"] | None = Query(default=None),
+    session: AsyncSession = Depends(get_session),
+):
+    """Order history from order_events, oldest first (ETag / If-None-Match, optional msgpack)."""
+    found = await timeline.load(session, [order_id])
+    if order_id not in found:
+        raise HTTPException(status_code=404, detail="Order not found")
+    body = {"order_id": order_id, "events": found[order_id]}
+    return timeline.respond(request, body, timeline.etag(found), format)
+
+
 # Rating endpoints (order-scoped)
 @router.get("/{order_id}/rating", response_model=Dict[str, Any])
 async def get_order_rating(order_id: int, session: AsyncSession = Depends(get_session)):
@@ -452,7 +602,12 @@ async def get_order_rating(order_id: int, session: AsyncSession = Depends(get_se
 
 
 @router.post("/{order_id}/rating", response_model=Dict[str, Any])
-async def add_order_rating(order_id: int, payload: Dict[str, Any] = Body(...), session: AsyncSession = Depends(get_session)):
+async def add_order_rating(
+    order_id: int,
+    payload: Dict[str, Any] = Body(...),
+    session: AsyncSession = Depends(get_session),
+    idem: Idempotency = Depends(idempotency("ratings")),
+):
     """Add rating for a specific order."""
     rating_score = (payload or {}).get("rating")
     comment = (payload or {}).get("comment", "")
@@ -465,6 +620,9 @@ async def add_order_rating(order_id: int, payload: Dict[str, Any] = Body(...), s
     order = result.scalar_one_or_none()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
+    replay = await idem.replay(session)
+    if replay is not None:
+        return replay
     
     # Check if rating already exists for this order
     existing_result = await session.execute(
@@ -476,7 +634,7 @@ async def add_order_rating(order_id: int, payload: Dict[str, Any] = Body(...), s
         # Update existing rating
         existing_rating.order_emoji_score = rating_score
         existing_rating.order_comment = comment
-        await session.commit()
+        await session.flush()
         await session.refresh(existing_rating)
         
         rating_data = {
@@ -494,7 +652,7 @@ async def add_order_rating(order_id: int, payload: Dict[str, Any] = Body(...), s
             order_comment=comment
         )
         session.add(new_rating)
-        await session.commit()
+        await session.flush()
         await session.refresh(new_rating)
         
         rating_data = {
@@ -504,6 +662,9 @@ async def add_order_rating(order_id: int, payload: Dict[str, Any] = Body(...), s
             "order_comment": new_rating.order_comment,
             "timestamp": new_rating.timestamp.isoformat() if new_rating.timestamp else None,
         }
+    await idem.save(session, rating_data)
+    await session.commit()
+    await idem.done(rating_data)
     
     # إشعار تبويب مطابق لحالة الطلب الحالية
     try:
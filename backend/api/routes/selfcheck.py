@@ -6,6 +6,7 @@ import asyncio
 
 from core.db import AsyncSessionLocal
 from core.status import compute_current_status
+from core.status_counts import get_status_counts
 from models.order import Order
 from models.customer import Customer
 from models.restaurant import Restaurant
@@ -282,6 +283,41 @@ async def _check_cancel_tx_ok(session: AsyncSession) -> tuple[bool, List[str]]:
 		return False, errors
 
 
+async def _check_counters_ok(session: AsyncSession) -> tuple[bool, List[str]]:
+	"""Check that order_status_counters follows an INSERT (read in O(1), rolled back)."""
+	errors = []
+	try:
+		before = (await get_status_counts(session, fresh=True))["statuses"].get("pending", 0)
+
+		cust_result = await session.execute(sa_text("SELECT customer_id FROM customers ORDER BY customer_id ASC LIMIT 1"))
+		cust_id = cust_result.scalar_one_or_none()
+		rest_result = await session.execute(sa_text("SELECT restaurant_id FROM restaurants ORDER BY restaurant_id ASC LIMIT 1"))
+		rest_id = rest_result.scalar_one_or_none()
+		if cust_id is None or rest_id is None:
+			errors.append("No customers or restaurants available for counters test")
+			await session.rollback()
+			return False, errors
+
+		await session.execute(sa_text("""
+			INSERT INTO orders (customer_id, restaurant_id, status, total_price_customer, total_price_restaurant)
+			VALUES (:cust_id, :rest_id, 'pending'::order_status_enum, 25.00, 20.00)
+		"""), {"cust_id": int(cust_id), "rest_id": int(rest_id)})
+
+		after = (await get_status_counts(session, fresh=True))["statuses"].get("pending", 0)
+		# لا نثبّت الطلب التجريبي؛ التراجع يعيد العداد كما كان
+		await session.rollback()
+
+		if after != before + 1:
+			errors.append(f"order_status_counters not updated by trigger: pending {before} → {after}")
+			return False, errors
+		return True, errors
+
+	except Exception as e:
+		await session.rollback()
+		errors.append(f"Counters check failed: {str(e)}")
+		return False, errors
+
+
 @router.get("/__selfcheck")
 async def selfcheck():
 	"""Comprehensive backend self-check to validate functionality."""
@@ -296,12 +332,14 @@ async def selfcheck():
 		list_pending_ok, list_errors = await _check_list_pending_ok(session)
 		next_flow_ok, flow_errors = await _check_next_flow_ok(session)
 		cancel_tx_ok, cancel_errors = await _check_cancel_tx_ok(session)
+		counters_ok, counters_errors = await _check_counters_ok(session)
 		
 		# Collect all errors
 		errors.extend(demo_errors)
 		errors.extend(list_errors)
 		errors.extend(flow_errors)
 		errors.extend(cancel_errors)
+		errors.extend(counters_errors)
 	
 	# Get DB URL (masked)
 	try:
@@ -322,6 +360,7 @@ async def selfcheck():
 		"list_pending_ok": list_pending_ok,
 		"next_flow_ok": next_flow_ok,
 		"cancel_tx_ok": cancel_tx_ok,
+		"counters_ok": counters_ok,
 		"db_url": db_url,
 		"errors": errors
 	}
@@ -1,98 +1,25 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import Dict, Set
 import asyncio
-import random
-import contextlib
 
-router = APIRouter(tags=["realtime"])
-
-
-class ConnectionManager:
-    def __init__(self):
-        self.active: Dict[int, Set[WebSocket]] = {}
-
-    async def connect(self, captain_id: int, websocket: WebSocket):
-        await websocket.accept()
-        self.active.setdefault(captain_id, set()).add(websocket)
-
-    def disconnect(self, captain_id: int, websocket: WebSocket):
-        conns = self.active.get(captain_id)
-        if not conns:
-            return
-        with contextlib.suppress(KeyError):
-            conns.remove(websocket)
-        if not conns:
-            self.active.pop(captain_id, None)
-
-    async def send_json(self, captain_id: int, data: dict):
-        for ws in list(self.active.get(captain_id, set())):
-            with contextlib.suppress(Exception):
-                await ws.send_json(data)
-
-    async def send_json_after(self, captain_id: int, data: dict, delay_sec: float):
-        await asyncio.sleep(delay_sec)
-        await self.send_json(captain_id, data)
+from core import captain_index, positions, position_history
+from realtime.broadcast import CAPTAIN_POLICY, FEED_POLICY, PositionFilter, encode, feed
+from realtime.connections import Connection, manager
+from realtime.pubsub import bus
+from realtime.simulator import sim
 
-
-manager = ConnectionManager()
-_PUBSUB_CHANNEL_PREFIX = "captain:"
+router = APIRouter(tags=["realtime"])
 
 
 @router.websocket("/ws/captain/{captain_id}")
 async def ws_captain(websocket: WebSocket, captain_id: int):
-    await manager.connect(captain_id, websocket)
-    # اشتراك اختياري عبر Redis لبث مشترك بين نسخ التطبيق
-    pubsub_task = None
-    try:
-        from core.redis import get_redis
-        import json
-
-        async def _pubsub_loop():
-            r = await get_redis()
-            if not r:
-                return
-            ch = _PUBSUB_CHANNEL_PREFIX + str(captain_id)
-            psub = r.pubsub()
-            await psub.subscribe(ch)
-            async for msg in psub.listen():
-                if msg and msg.get('type') == 'message':
-                    try:
-                        data = json.loads(msg.get('data'))
-                        await manager.send_json(captain_id, data)
-                    except Exception:
-                        pass
-
-        pubsub_task = asyncio.create_task(_pubsub_loop())
-    except Exception:
-        pubsub_task = None
-
-    async def _pos_loop():
-        base_lat = 33.5138 + random.uniform(-0.01, 0.01)
-        base_lng = 36.2765 + random.uniform(-0.01, 0.01)
-        while True:
-            base_lat += random.uniform(-0.0005, 0.0005)
-            base_lng += random.uniform(-0.0005, 0.0005)
-            await manager.send_json(
-                captain_id,
-                {"type": "pos", "captain_id": captain_id, "lat": base_lat, "lng": base_lng},
-            )
-            await asyncio.sleep(1)
-
-    async def _route_loop(r_lat: float, r_lng: float, c_lat: float, c_lng: float):
-        steps = 30
-        for i in range(steps + 1):
-            t = i / steps
-            lat = r_lat + (c_lat - r_lat) * t
-            lng = r_lng + (c_lng - r_lng) * t
-            await manager.send_json(
-                captain_id,
-                {"type": "pos", "captain_id": captain_id, "lat": lat, "lng": lng},
-            )
-            await asyncio.sleep(1)
-        await manager.send_json(captain_id, {"type": "delivered", "captain_id": captain_id})
-
-    pos_task = asyncio.create_task(_pos_loop())
-    route_task = None
+    conn = await manager.connect(captain_id, websocket)
+    # سياسة بث pos لهذا المقبس: ?min_distance_m=&min_interval_ms=&max_rate= أو رسالة {"type": "policy", ...}
+    conn.filter = PositionFilter(CAPTAIN_POLICY.override(websocket.query_params))
+    # رسائل captain:{id} من Redis تصل عبر اشتراك العامل المشترك (realtime.pubsub)
+    bus.add(captain_id)
+
+    # الحركة المحاكاة يديرها مجدول العامل الواحد (realtime.simulator) وليس مهمة لكل مقبس
+    sim.wander(captain_id)
     try:
         while True:
             msg = await websocket.receive_json()
@@ -108,40 +35,64 @@ async def ws_captain(websocket: WebSocket, captain_id: int):
                         3.0,
                     )
                 )
+            elif mtype == "policy":
+                conn.filter.policy = conn.filter.policy.override(msg)
+            elif mtype == "pos":
+                # موقع حي من تطبيق الكابتن → الفهرس الشبكي (ومنه لبقية العمال عبر Redis)
+                try:
+                    lat = float(msg["lat"])
+                    lng = float(msg["lng"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                # captains.last_lat/last_lng/last_geo تُكتب دفعة واحدة من core.positions
+                if positions.record(captain_id, lat, lng):
+                    position_history.append(captain_id, lat, lng)
+                    await captain_index.update_position(captain_id, lat, lng)
             elif mtype == "start_delivery":
-                if pos_task and not pos_task.done():
-                    pos_task.cancel()
-                    with contextlib.suppress(Exception):
-                        await pos_task
                 rest = msg.get("restaurant") or {}
                 cust = msg.get("customer") or {}
                 r_lat = float(rest.get("lat", 33.5138))
                 r_lng = float(rest.get("lng", 36.2765))
                 c_lat = float(cust.get("lat", 33.515))
                 c_lng = float(cust.get("lng", 36.28))
-                route_task = asyncio.create_task(_route_loop(r_lat, r_lng, c_lat, c_lng))
+                sim.route(captain_id, r_lat, r_lng, c_lat, c_lng)
             elif mtype == "stop_delivery":
-                if route_task and not route_task.done():
-                    route_task.cancel()
-                    with contextlib.suppress(Exception):
-                        await route_task
-                if (not pos_task) or pos_task.done():
-                    pos_task = asyncio.create_task(_pos_loop())
+                sim.wander(captain_id)
     except WebSocketDisconnect:
         pass
     finally:
-        if pubsub_task and not pubsub_task.done():
-            pubsub_task.cancel()
-            with contextlib.suppress(Exception):
-                await pubsub_task
-        if route_task and not route_task.done():
-            route_task.cancel()
-            with contextlib.suppress(Exception):
-                await route_task
-        if pos_task and not pos_task.done():
-            pos_task.cancel()
-            with contextlib.suppress(Exception):
-                await pos_task
+        bus.remove(captain_id)
         manager.disconnect(captain_id, websocket)
+        if captain_id not in manager.active:
+            sim.remove(captain_id)
+
+
+@router.websocket("/ws/positions")
+async def ws_positions(websocket: WebSocket):
+    """Dashboard feed: {"type": "positions", "items": [[captain_id, lat, lng], ...]} frames of captains that moved.
+
+    The first frame is a snapshot; the policy comes from the query string or a {"type": "policy", ...} message.
+    """
+    await websocket.accept()
 
+    def _closed(c: Connection):
+        # المقبس البطيء يُغلق؛ عند إعادة الاتصال تصل لقطة كاملة
+        feed.unsubscribe(c)
+        asyncio.create_task(websocket.close(code=1013))
 
+    conn = Connection(websocket, on_close=_closed)
+    policy = FEED_POLICY.override(websocket.query_params)
+    feed.subscribe(conn, lambda frame: conn.put(encode(frame), False), policy)
+    conn.start()
+    try:
+        while True:
+            msg = await websocket.receive_json()
+            if isinstance(msg, dict) and msg.get("type") == "policy":
+                policy = policy.override(msg)
+                feed.set_policy(conn, policy)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        feed.unsubscribe(conn)
+        conn._on_close = None
+        conn.close()
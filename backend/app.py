@@ -8,11 +8,17 @@ import traceback
 
 from core.config import settings
 from core.db import engine
+from core import maintenance, captain_index, events, positions, position_history
+# يُستورد لتسجيل مهمة صيانة أقسام order_events (maintenance.periodic) فقط
+from core import event_partitions  # noqa: F401
 from api.routes import orders, debug, selfcheck
 from api.routes import analytics
 import os
 import socketio
 from realtime.sio import sio
+from realtime.pubsub import bus as captain_bus
+from realtime.broadcast import feed as position_feed
+from realtime.simulator import sim
 from api.routes import assign, ws
 from api.routes import admin as admin_router
 
@@ -46,6 +52,7 @@ if settings.DEBUG:
 		allow_credentials=False,
 		allow_methods=["*"],
 		allow_headers=["*"],
+		expose_headers=["X-Next-Cursor"],
 	)
 else:
 	app.add_middleware(
@@ -54,6 +61,7 @@ else:
 		allow_credentials=True,
 		allow_methods=["*"],
 		allow_headers=["*"],
+		expose_headers=["X-Next-Cursor"],
 	)
 
 app.add_middleware(
@@ -101,5 +109,26 @@ async def _startup():
 		logger.info(f"[DB] {url_str}")
 	except Exception:
 		logger.info("[DB] URL unavailable")
+	maintenance.start()
+	events.start()
+	positions.start()
+	position_history.start()
+	await captain_index.start()
+	captain_bus.start()
+	position_feed.start()
+	sim.start()
+
+
+@app.on_event("shutdown")
+async def _shutdown():
+	await sim.stop()
+	await position_feed.stop()
+	await captain_bus.stop()
+	await captain_index.stop()
+	await maintenance.stop()
+	await positions.stop()
+	await position_history.stop()
+	# بعد توقف كل ما قد يضيف أحداثاً
+	await events.stop()
 
 
@@ -0,0 +1,481 @@
+import asyncio
+import contextlib
+import heapq
+import json
+import os
+import time
+import uuid
+from math import cos, floor, radians
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from loguru import logger
+from sqlalchemy import text as sa_text
+
+from core.db import AsyncSessionLocal
+from core.redis import get_redis
+from core.scoring import haversine_km
+
+# فهرس شبكي في ذاكرة العامل لمواقع الكباتن الحية: captain_id → (lat, lng, available, active_orders).
+# يُحدَّث من رسائل pos على WebSocket، ويُنشر كل تحديث عبر Redis (قناة + hash للّقطة) لبقية العمال،
+# ويُعاد تحميل التوفر من قاعدة البيانات دورياً.
+CELL_DEG = float(os.getenv("CAPTAIN_INDEX_CELL_DEG", "0.01"))
+REFRESH_SEC = float(os.getenv("CAPTAIN_INDEX_REFRESH_SEC", "60"))
+REDIS_CHANNEL = "captains:geo"
+REDIS_HASH = "captains:geo:snapshot"
+RECONNECT_MAX_SEC = 30.0
+KM_PER_DEG = 111.32
+
+_WORKER = uuid.uuid4().hex[:12]
+
+
+class _Entry:
+    __slots__ = ("lat", "lng", "available", "active_orders", "cell", "ts", "performance")
+
+    def __init__(self, lat: float, lng: float, available: bool, active_orders: int, cell: Tuple[int, int], ts: float):
+        self.lat = lat
+        self.lng = lng
+        self.available = available
+        self.active_orders = active_orders
+        self.cell = cell
+        self.ts = ts
+        # التقييم يأتي من قاعدة البيانات فقط (لا يُنشر عبر Redis)
+        self.performance = 5.0
+
+
+class CaptainGrid:
+    """Uniform lat/lng grid over live captain positions (k-nearest and radius queries)."""
+
+    def __init__(self, cell_deg: float = CELL_DEG):
+        self.cell_deg = cell_deg
+        self._entries: Dict[int, _Entry] = {}
+        self._cells: Dict[Tuple[int, int], Set[int]] = {}
+        # حدود الخلايا المستخدمة (تتسع فقط) لتحديد آخر حلقة في nearest
+        self._bounds: Optional[List[int]] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, captain_id: int) -> bool:
+        return captain_id in self._entries
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (floor(lat / self.cell_deg), floor(lng / self.cell_deg))
+
+    def _add(self, captain_id: int, cell: Tuple[int, int]) -> None:
+        self._cells.setdefault(cell, set()).add(captain_id)
+        b = self._bounds
+        if b is None:
+            self._bounds = [cell[0], cell[0], cell[1], cell[1]]
+        else:
+            b[0], b[1] = min(b[0], cell[0]), max(b[1], cell[0])
+            b[2], b[3] = min(b[2], cell[1]), max(b[3], cell[1])
+
+    def get(self, captain_id: int) -> Optional[Dict[str, Any]]:
+        e = self._entries.get(captain_id)
+        if e is None:
+            return None
+        return {
+            "lat": e.lat,
+            "lng": e.lng,
+            "available": e.available,
+            "active_orders": e.active_orders,
+            "performance": e.performance,
+            "ts": e.ts,
+        }
+
+    def upsert(
+        self,
+        captain_id: int,
+        lat: Optional[float] = None,
+        lng: Optional[float] = None,
+        available: Optional[bool] = None,
+        active_orders: Optional[int] = None,
+        ts: Optional[float] = None,
+    ) -> bool:
+        """Insert or update one captain; None fields keep their value. Older `ts` updates are ignored."""
+        ts = time.time() if ts is None else ts
+        e = self._entries.get(captain_id)
+        if e is None:
+            if lat is None or lng is None:
+                return False
+            cell = self._cell(lat, lng)
+            self._entries[captain_id] = _Entry(lat, lng, True if available is None else available, active_orders or 0, cell, ts)
+            self._add(captain_id, cell)
+            return True
+        if lat is not None and lng is not None:
+            if ts < e.ts:
+                return False
+            cell = self._cell(lat, lng)
+            if cell != e.cell:
+                old = self._cells.get(e.cell)
+                if old is not None:
+                    old.discard(captain_id)
+                    if not old:
+                        del self._cells[e.cell]
+                self._add(captain_id, cell)
+                e.cell = cell
+            e.lat, e.lng, e.ts = lat, lng, ts
+        if available is not None:
+            e.available = available
+        if active_orders is not None:
+            e.active_orders = active_orders
+        return True
+
+    def position(self, captain_id: int) -> Optional[Tuple[float, float]]:
+        e = self._entries.get(captain_id)
+        return None if e is None else (e.lat, e.lng)
+
+    def positions(self) -> Iterator[Tuple[int, float, float]]:
+        for cid, e in self._entries.items():
+            yield cid, e.lat, e.lng
+
+    def remove(self, captain_id: int) -> None:
+        e = self._entries.pop(captain_id, None)
+        if e is None:
+            return
+        ids = self._cells.get(e.cell)
+        if ids is not None:
+            ids.discard(captain_id)
+            if not ids:
+                del self._cells[e.cell]
+
+    def _ring(self, ci: int, cj: int, r: int) -> Iterable[Tuple[int, int]]:
+        if r == 0:
+            yield (ci, cj)
+            return
+        for dj in range(-r, r + 1):
+            yield (ci - r, cj + dj)
+            yield (ci + r, cj + dj)
+        for di in range(-r + 1, r):
+            yield (ci + di, cj - r)
+            yield (ci + di, cj + r)
+
+    def _keys(self, lat: float, lng: float, radius_km: float) -> Tuple[float, float, List[Tuple[int, int]]]:
+        dlat = radius_km / KM_PER_DEG
+        dlng = dlat / max(cos(radians(lat)), 0.01)
+        i0, j0 = self._cell(lat - dlat, lng - dlng)
+        i1, j1 = self._cell(lat + dlat, lng + dlng)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self._cells):
+            # نصف قطر كبير: أسرع أن نمرّ على الخلايا المشغولة فقط
+            return dlat, dlng, [c for c in self._cells if i0 <= c[0] <= i1 and j0 <= c[1] <= j1]
+        return dlat, dlng, [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+
+    def within(
+        self, lat: float, lng: float, radius_km: float, available_only: bool = True
+    ) -> Tuple[List[int], List[float], List[float], List[int], List[float]]:
+        """Column lists (ids, lats, lngs, active_orders, performance) of captains in the bounding box
+        of the radius, unsorted — input for core.scoring.top_k."""
+        dlat, dlng, keys = self._keys(lat, lng, radius_km)
+        ids: List[int] = []
+        lats: List[float] = []
+        lngs: List[float] = []
+        active: List[int] = []
+        perf: List[float] = []
+        entries, cells = self._entries, self._cells
+        for key in keys:
+            for cid in cells.get(key, ()):
+                e = entries[cid]
+                if available_only and not e.available:
+                    continue
+                if abs(e.lat - lat) > dlat or abs(e.lng - lng) > dlng:
+                    continue
+                ids.append(cid)
+                lats.append(e.lat)
+                lngs.append(e.lng)
+                active.append(e.active_orders)
+                perf.append(e.performance)
+        return ids, lats, lngs, active, perf
+
+    def radius(
+        self, lat: float, lng: float, radius_km: float, limit: Optional[int] = None, available_only: bool = True
+    ) -> List[Tuple[int, float]]:
+        """[(captain_id, distance_km)] within `radius_km`, nearest first."""
+        dlat, _, keys = self._keys(lat, lng, radius_km)
+        entries, cells = self._entries, self._cells
+        # ترشيح وترتيب بمسافة مستوية (equirectangular) رخيصة، ثم haversine للنتائج المختارة فقط
+        kx = cos(radians(lat))
+        r2 = dlat * dlat
+        hits: List[Tuple[float, int]] = []
+        for key in keys:
+            ids = cells.get(key)
+            if not ids:
+                continue
+            for cid in ids:
+                e = entries[cid]
+                if available_only and not e.available:
+                    continue
+                dy = e.lat - lat
+                dx = (e.lng - lng) * kx
+                d2 = dx * dx + dy * dy
+                if d2 <= r2:
+                    hits.append((d2, cid))
+        hits = heapq.nsmallest(limit, hits) if limit is not None else sorted(hits)
+        return [(cid, haversine_km(lat, lng, entries[cid].lat, entries[cid].lng)) for _, cid in hits]
+
+    def nearest(
+        self, lat: float, lng: float, k: int, max_km: Optional[float] = None, available_only: bool = True
+    ) -> List[Tuple[int, float]]:
+        """k nearest captains (optionally within `max_km`), scanning grid rings outwards."""
+        if not self._entries or k <= 0:
+            return []
+        ci, cj = self._cell(lat, lng)
+        kx = cos(radians(lat))
+        # أصغر بُعد لخلية (بوحدات المسافة المستوية) — بعد الحلقة r تكون كل النقاط ضمن r * step مغطاة
+        step = self.cell_deg * min(1.0, max(kx, 0.01))
+        b = self._bounds
+        max_ring = max(abs(ci - b[0]), abs(ci - b[1]), abs(cj - b[2]), abs(cj - b[3]))
+        max2 = None
+        if max_km is not None:
+            max_ring = min(max_ring, int(max_km / KM_PER_DEG / step) + 1)
+            max2 = (max_km / KM_PER_DEG) ** 2
+        entries, cells = self._entries, self._cells
+        found: List[Tuple[float, int]] = []
+        r = 0
+        while r <= max_ring:
+            for cell in self._ring(ci, cj, r):
+                ids = cells.get(cell)
+                if not ids:
+                    continue
+                for cid in ids:
+                    e = entries[cid]
+                    if available_only and not e.available:
+                        continue
+                    dy = e.lat - lat
+                    dx = (e.lng - lng) * kx
+                    d2 = dx * dx + dy * dy
+                    if max2 is None or d2 <= max2:
+                        found.append((d2, cid))
+            if len(found) >= k:
+                found = heapq.nsmallest(k, found)
+                if found[-1][0] <= (r * step) ** 2:
+                    break
+            r += 1
+        found = heapq.nsmallest(k, found)
+        return [(cid, haversine_km(lat, lng, entries[cid].lat, entries[cid].lng)) for _, cid in found]
+
+    # ---- لقطة ----
+    def snapshot(self) -> Dict[str, List[Any]]:
+        """JSON-serializable {captain_id: [lat, lng, available, active_orders, ts]}."""
+        return {
+            str(cid): [e.lat, e.lng, e.available, e.active_orders, e.ts]
+            for cid, e in self._entries.items()
+        }
+
+    def restore(self, snap: Dict[Any, Any], replace: bool = False) -> int:
+        """Load a snapshot(); entries newer than the snapshot row are kept. Returns rows applied."""
+        if replace:
+            self._entries.clear()
+            self._cells.clear()
+            self._bounds = None
+        n = 0
+        for cid, row in snap.items():
+            if isinstance(row, (bytes, str)):
+                row = json.loads(row)
+            lat, lng, available, active_orders, ts = row
+            if self.upsert(int(cid), float(lat), float(lng), bool(available), int(active_orders), float(ts)):
+                n += 1
+        return n
+
+
+INDEX = CaptainGrid()
+_state: Dict[str, Any] = {"ready": False, "synced_at": 0.0, "listening": False, "healthy": False, "reconnects": 0}
+_tasks: List[asyncio.Task] = []
+# مستمعون لتحركات الكباتن (محلية أو من عمال آخرين عبر Redis)، مثل realtime.broadcast.feed
+_watchers: List[Callable[[int], None]] = []
+
+
+def on_move(fn: Callable[[int], None]) -> None:
+    """Call `fn(captain_id)` whenever a captain's position changes in this worker's index."""
+    _watchers.append(fn)
+
+
+def _moved(captain_id: int) -> None:
+    for fn in _watchers:
+        try:
+            fn(captain_id)
+        except Exception:
+            pass
+
+
+def ready() -> bool:
+    """True once the index was hydrated from the database on this worker."""
+    return _state["ready"]
+
+
+def _message(captain_id: int, e: Dict[str, Any]) -> str:
+    return json.dumps({"w": _WORKER, "id": captain_id, "v": [e["lat"], e["lng"], e["available"], e["active_orders"], e["ts"]]})
+
+
+async def publish(captain_id: int) -> None:
+    """Share this captain's entry with other workers (channel) and later restores (hash)."""
+    e = INDEX.get(captain_id)
+    if e is None:
+        return
+    try:
+        r = await get_redis()
+        if not r:
+            return
+        row = [e["lat"], e["lng"], e["available"], e["active_orders"], e["ts"]]
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.hset(REDIS_HASH, str(captain_id), json.dumps(row))
+            pipe.publish(REDIS_CHANNEL, _message(captain_id, e))
+            await pipe.execute()
+    except Exception:
+        pass
+
+
+async def update_position(captain_id: int, lat: float, lng: float) -> None:
+    """Record a live position (from the captain's WebSocket) and broadcast it."""
+    if INDEX.upsert(captain_id, lat=lat, lng=lng):
+        _moved(captain_id)
+        await publish(captain_id)
+
+
+async def set_active_orders(captain_id: int, active_orders: int) -> None:
+    if INDEX.upsert(captain_id, active_orders=active_orders):
+        await publish(captain_id)
+
+
+async def load_from_db() -> int:
+    """Hydrate/refresh from captains: availability always, positions only for captains without a live fix."""
+    async with AsyncSessionLocal() as session:
+        rows = (await session.execute(sa_text(
+            "SELECT captain_id, last_lat, last_lng, COALESCE(available, false) AS available, "
+            "COALESCE(performance, 5) AS performance FROM captains"
+        ))).all()
+    seen = set()
+    for cid, lat, lng, available, performance in rows:
+        seen.add(cid)
+        if cid in INDEX:
+            INDEX.upsert(cid, available=bool(available))
+        elif lat is not None and lng is not None:
+            INDEX.upsert(cid, float(lat), float(lng), bool(available), ts=0.0)
+        e = INDEX._entries.get(cid)
+        if e is not None:
+            e.performance = float(performance)
+    gone = [c for c in INDEX._entries if c not in seen]
+    for cid in gone:
+        INDEX.remove(cid)
+    if gone:
+        # وإلا أعادهم restore_from_redis بعد إعادة التشغيل
+        with contextlib.suppress(Exception):
+            r = await get_redis()
+            if r:
+                await r.hdel(REDIS_HASH, *[str(c) for c in gone])
+    _state["synced_at"] = time.time()
+    return len(rows)
+
+
+async def restore_from_redis() -> int:
+    try:
+        r = await get_redis()
+        if not r:
+            return 0
+        snap = await r.hgetall(REDIS_HASH)
+    except Exception:
+        return 0
+    return INDEX.restore({k.decode() if isinstance(k, bytes) else k: v for k, v in snap.items()})
+
+
+def _apply(msg: Dict[str, Any]) -> None:
+    try:
+        data = json.loads(msg["data"])
+        if data.get("w") == _WORKER:
+            return
+        lat, lng, available, active_orders, ts = data["v"]
+        if INDEX.upsert(int(data["id"]), lat, lng, available, active_orders, ts):
+            _moved(int(data["id"]))
+    except Exception:
+        pass
+
+
+async def _listen_once(r) -> None:
+    psub = r.pubsub(ignore_subscribe_messages=True)
+    try:
+        await psub.subscribe(REDIS_CHANNEL)
+        if _state["reconnects"]:
+            # ما فات أثناء الانقطاع موجود في لقطة الـ hash (الأحدث حسب ts يفوز)
+            await restore_from_redis()
+        _state["listening"] = _state["healthy"] = True
+        async for msg in psub.listen():
+            if msg and msg.get("type") == "message":
+                _apply(msg)
+    finally:
+        _state["listening"] = False
+        with contextlib.suppress(Exception):
+            await psub.close()
+
+
+async def _listen() -> None:
+    # نفس نمط realtime.pubsub: انقطاع Redis لا يوقف المزامنة بل يعيد الاشتراك بمهلة متزايدة
+    delay = 1.0
+    while True:
+        _state["healthy"] = False
+        r = await get_redis()
+        if not r:
+            return
+        try:
+            await _listen_once(r)
+            raise ConnectionError("subscription closed")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if _state["healthy"]:
+                delay = 1.0
+            _state["reconnects"] += 1
+            logger.warning(f"[captain_index] redis sync lost ({e}), retrying in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_SEC)
+
+
+async def _hydrate() -> None:
+    # لقطة Redis أولاً (مواقع حية أحدث)، ثم قاعدة البيانات لحالة التوفر والكباتن غير المتصلين
+    if not _state["ready"]:
+        await restore_from_redis()
+    await load_from_db()
+    _state["ready"] = True
+
+
+async def _refresh_loop() -> None:
+    while True:
+        await asyncio.sleep(REFRESH_SEC)
+        try:
+            # أول تحميل ناجح (ولو فشل عند الإقلاع) يفعّل مسار الفهرس
+            await _hydrate()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"[captain_index] refresh failed: {e}")
+
+
+async def start() -> None:
+    if _tasks:
+        return
+    try:
+        await _hydrate()
+    except Exception as e:
+        logger.warning(f"[captain_index] initial load failed, candidates use the database: {e}")
+    _tasks.append(asyncio.create_task(_listen()))
+    _tasks.append(asyncio.create_task(_refresh_loop()))
+
+
+async def stop() -> None:
+    for t in _tasks:
+        t.cancel()
+    for t in _tasks:
+        with contextlib.suppress(BaseException):
+            await t
+    _tasks.clear()
+    _state["ready"] = False
+
+
+def metrics() -> Dict[str, Any]:
+    return {
+        "ready": _state["ready"],
+        "captains": len(INDEX),
+        "cells": len(INDEX._cells),
+        "cell_deg": INDEX.cell_deg,
+        "synced_at": _state["synced_at"],
+        "listening": _state["listening"],
+        "reconnects": _state["reconnects"],
+    }
@@ -0,0 +1,207 @@
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+from loguru import logger
+from sqlalchemy import func, select, text as sa_text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core import captain_index, maintenance
+from core.db import AsyncSessionLocal
+from core.redis import get_redis
+from core.status import ALIASES, VALID, current_status_of
+from core.transitions import TRANSITIONS
+from models.captain_active_orders import CaptainActiveOrders
+from models.order import Order
+
+# عدد الطلبات النشطة لكل كابتن. مصدر الحقيقة جدول captain_active_orders الذي يحدّثه التريغر
+# (migration 012)، وRedis hash نسخة مشتركة بين العمال تُقرأ لكل المرشحين بـ HMGET واحد.
+# الحقول الغائبة من Redis (أو غياب Redis) تُقرأ من قاعدة البيانات باستعلام واحد للدفعة كلها.
+ACTIVE_STATUSES = ("choose_captain", "processing", "out_for_delivery")
+REDIS_KEY = "captains:active_orders"
+REDIS_TTL_SEC = int(os.getenv("CAPTAIN_LOAD_REDIS_TTL", "600"))
+RECONCILE_INTERVAL_SEC = float(os.getenv("CAPTAIN_LOAD_RECONCILE_SEC", "300"))
+RECONCILE_JOB = "captain_load_reconcile"
+_ACTIVE_RAW = sorted(v for v in VALID | set(ALIASES) if current_status_of(v) in ACTIVE_STATUSES)
+
+_table: Optional[bool] = None
+_stats = {"redis_hits": 0, "db_reads": 0, "refreshes": 0}
+
+
+async def _has_table(session: AsyncSession) -> bool:
+    """Whether migration 012 (captain_active_orders) is applied; checked once per worker."""
+    global _table
+    if _table is None:
+        _table = bool((await session.execute(
+            sa_text("SELECT to_regclass('captain_active_orders') IS NOT NULL")
+        )).scalar())
+    return _table
+
+
+async def _read_db(session: AsyncSession, ids: List[int]) -> Dict[int, int]:
+    """One query for the whole batch: the counters table, or a grouped COUNT when it is missing."""
+    _stats["db_reads"] += 1
+    if await _has_table(session):
+        q = select(CaptainActiveOrders.captain_id, CaptainActiveOrders.active_orders).where(
+            CaptainActiveOrders.captain_id.in_(ids)
+        )
+    else:
+        q = (
+            select(Order.captain_id, func.count())
+            .where(Order.captain_id.in_(ids), TRANSITIONS.status_in_sql(Order.status, ACTIVE_STATUSES))
+            .group_by(Order.captain_id)
+        )
+    found = {int(cid): int(n) for cid, n in (await session.execute(q)).all()}
+    return {cid: max(found.get(cid, 0), 0) for cid in ids}
+
+
+async def _write_redis(r, loads: Dict[int, int]) -> None:
+    async with r.pipeline(transaction=False) as pipe:
+        pipe.hset(REDIS_KEY, mapping={str(k): v for k, v in loads.items()})
+        pipe.expire(REDIS_KEY, REDIS_TTL_SEC)
+        await pipe.execute()
+
+
+def _sync_index(loads: Dict[int, int]) -> None:
+    for cid, n in loads.items():
+        captain_index.INDEX.upsert(cid, active_orders=n)
+
+
+async def get_many(captain_ids: Iterable[int], session: Optional[AsyncSession] = None) -> Dict[int, int]:
+    """{captain_id: active_orders} for a batch: one HMGET, plus one DB query for the misses."""
+    ids = list(dict.fromkeys(int(c) for c in captain_ids))
+    if not ids:
+        return {}
+    out: Dict[int, int] = {}
+    r = None
+    try:
+        r = await get_redis()
+        if r:
+            values = await r.hmget(REDIS_KEY, [str(c) for c in ids])
+            for cid, v in zip(ids, values):
+                if v is not None:
+                    out[cid] = int(v)
+            _stats["redis_hits"] += len(out)
+    except Exception:
+        r = None
+
+    missing = [cid for cid in ids if cid not in out]
+    if missing:
+        if session is None:
+            async with AsyncSessionLocal() as own:
+                loaded = await _read_db(own, missing)
+        else:
+            loaded = await _read_db(session, missing)
+        out.update(loaded)
+        if r:
+            try:
+                await _write_redis(r, loaded)
+            except Exception:
+                pass
+    _sync_index(out)
+    return out
+
+
+def crosses(prev_status: Optional[str], status: Optional[str]) -> bool:
+    """Whether a status change moves an order into or out of ACTIVE_STATUSES (only then the counter changes)."""
+    return (TRANSITIONS.status(prev_status) in ACTIVE_STATUSES) != (TRANSITIONS.status(status) in ACTIVE_STATUSES)
+
+
+async def read(captain_ids: Iterable[Optional[int]], db) -> Dict[int, int]:
+    """Counters of `captain_ids` read on the caller's session/connection (e.g. inside its transaction)."""
+    ids = list(dict.fromkeys(int(c) for c in captain_ids if c is not None))
+    if not ids:
+        return {}
+    try:
+        return await _read_db(db, ids)
+    except Exception as e:
+        logger.warning(f"[captain_load] read failed: {e}")
+        return {}
+
+
+async def publish(loads: Dict[int, int]) -> None:
+    """Push freshly read counters (after commit) to Redis and the in-memory index."""
+    if not loads:
+        return
+    _stats["refreshes"] += 1
+    try:
+        r = await get_redis()
+        if r:
+            await _write_redis(r, loads)
+    except Exception:
+        pass
+    for cid, n in loads.items():
+        await captain_index.set_active_orders(cid, n)
+
+
+async def refresh(captain_ids: Iterable[Optional[int]], session: Optional[AsyncSession] = None) -> Dict[int, int]:
+    """Re-read the counters of captains whose orders just changed (after commit) and push them to
+    Redis and the in-memory index; other workers receive the index update through its channel."""
+    captain_ids = [c for c in captain_ids if c is not None]
+    if not captain_ids:
+        return {}
+    if session is None:
+        async with AsyncSessionLocal() as own:
+            loads = await read(captain_ids, own)
+    else:
+        loads = await read(captain_ids, session)
+    await publish(loads)
+    return loads
+
+
+# الانحراف بين العدّ الفعلي وجدول العدادات، في استعلام واحد
+_DRIFT_SQL = sa_text(
+    f"""
+WITH actual AS (
+  SELECT captain_id, COUNT(*) AS n
+  FROM orders
+  WHERE captain_id IS NOT NULL AND lower(trim(status::text)) IN ({', '.join(repr(v) for v in _ACTIVE_RAW)})
+  GROUP BY captain_id
+)
+SELECT COALESCE(a.captain_id, t.captain_id) AS captain_id,
+       COALESCE(a.n, 0) - COALESCE(t.active_orders, 0) AS delta
+FROM actual a
+FULL OUTER JOIN captain_active_orders t ON t.captain_id = a.captain_id
+WHERE COALESCE(a.n, 0) <> COALESCE(t.active_orders, 0)
+    """
+)
+
+_REPAIR_SQL = sa_text(
+    """
+INSERT INTO captain_active_orders(captain_id, active_orders)
+VALUES (:captain_id, :delta)
+ON CONFLICT (captain_id) DO UPDATE SET active_orders = captain_active_orders.active_orders + EXCLUDED.active_orders
+    """
+)
+
+
+async def reconcile(session: AsyncSession, repair: bool = True) -> List[Dict[str, Any]]:
+    """Compare captain_active_orders with a full count and optionally add the missing deltas.
+
+    The caller owns the transaction.
+    """
+    rows = (await session.execute(_DRIFT_SQL)).all()
+    drift = [{"captain_id": int(cid), "delta": int(delta)} for cid, delta in rows]
+    if repair and drift:
+        await session.execute(_REPAIR_SQL, drift)
+    return drift
+
+
+@maintenance.periodic(RECONCILE_JOB, RECONCILE_INTERVAL_SEC)
+async def reconcile_job(session: AsyncSession) -> List[Dict[str, Any]]:
+    if not await _has_table(session):
+        return []
+    drift = await reconcile(session, repair=True)
+    if drift:
+        logger.warning(f"[captain_load] repaired drift: {drift}")
+    # نسخة Redis تُبنى من جديد عند القراءة التالية
+    try:
+        r = await get_redis()
+        if r:
+            await r.delete(REDIS_KEY)
+    except Exception:
+        pass
+    return drift
+
+
+def metrics() -> Dict[str, Any]:
+    return dict(_stats)
@@ -1,5 +1,7 @@
 from enum import Enum
 
+from core.status import ALIASES, VALID, normalize_status
+
 
 class OrderStatus(str, Enum):
 	pending = "pending"
@@ -9,6 +11,8 @@ class OrderStatus(str, Enum):
 	delivered = "delivered"
 	cancelled = "cancelled"
 	problem = "problem"
+	deferred = "deferred"
+	pickup = "pickup"
 
 
 LIFECYCLE: list[str] = [
@@ -19,22 +23,11 @@ LIFECYCLE: list[str] = [
 	OrderStatus.delivered,
 ]
 
-ALIASES: dict[str, str] = {
-	"issue": "problem",
-	"accepted": "choose_captain",
-	"waiting_restaurant_acceptance": "choose_captain",
-	"preparing": "processing",
-	"pick_up_ready": "processing",
-}
-
-VALID: set[str] = {
-	"pending", "choose_captain", "processing", "out_for_delivery", "delivered", 
-	"cancelled", "problem"
-}
+# ALIASES و VALID مصدرهما core.status (انظر core.transitions لقواعد الانتقال)
+__all__ = ["OrderStatus", "LIFECYCLE", "ALIASES", "VALID", "normalize"]
 
 
 def normalize(value: str | None) -> str | None:
 	if not value:
 		return None
-	v = value.strip().lower()
-	return ALIASES.get(v, v)
+	return normalize_status(value)
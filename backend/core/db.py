@@ -44,3 +44,10 @@ async def get_session_context():
 		raise
 	finally:
 		await session.close()
+
+
+@asynccontextmanager
+async def get_autocommit_connection():
+	"""Pooled connection in AUTOCOMMIT mode for single-statement writes (no BEGIN/COMMIT round trips)."""
+	async with engine.connect() as conn:
+		yield await conn.execution_options(isolation_level="AUTOCOMMIT")
@@ -0,0 +1,329 @@
+import asyncio
+import json
+import os
+import time
+from math import cos, radians
+from typing import Any, Dict, List, Tuple
+
+from loguru import logger
+from sqlalchemy import text as sa_text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core import captain_index, captain_load
+from core.captain_index import KM_PER_DEG
+from core.redis import get_redis
+from core.scoring import AVG_SPEED_KMH, ETA_FIXED_SEC, haversine_km, np
+from realtime.connections import manager
+
+# توزيع دفعي: كل طلبات choose_captain غير المعيّنة × الكباتن المتاحين كمسألة تعيين (Hungarian)،
+# مع توزيع جشع (greedy) عندما تكون المصفوفة أكبر من HUNGARIAN_MAX_CELLS أو عند غياب NumPy.
+DISPATCH_RADIUS_KM = float(os.getenv("DISPATCH_RADIUS_KM", "5"))
+DISPATCH_MAX_ORDERS = int(os.getenv("DISPATCH_MAX_ORDERS", "500"))
+DISPATCH_MAX_ACTIVE = int(os.getenv("DISPATCH_MAX_ACTIVE", "2"))
+CANDIDATES_PER_ORDER = int(os.getenv("DISPATCH_CANDIDATES_PER_ORDER", "8"))
+HUNGARIAN_MAX_CELLS = int(os.getenv("DISPATCH_HUNGARIAN_MAX_CELLS", "1000000"))
+# تكلفة التعيين بالثواني: ETA + عقوبة لكل طلب نشط − مكافأة الأداء
+LOAD_PENALTY_SEC = 300.0
+PERFORMANCE_BONUS_SEC = 120.0
+_BIG = 1e9
+# قبول الكابتن محاكى: رسالة accepted على WebSocket بعد هذه المهلة (التعيين اليدوي والدفعي)
+ACCEPT_DELAY_SEC = 3.0
+
+_ORDERS_SQL = sa_text(
+    """
+SELECT o.order_id, r.latitude::float8 AS lat, r.longitude::float8 AS lng
+FROM orders o
+JOIN restaurants r ON r.restaurant_id = o.restaurant_id
+WHERE o.status = 'choose_captain' AND o.captain_id IS NULL
+  AND r.latitude IS NOT NULL AND r.longitude IS NOT NULL
+ORDER BY o.created_at, o.order_id
+LIMIT :limit
+FOR UPDATE OF o SKIP LOCKED
+    """
+)
+
+_CAPTAINS_SQL = sa_text(
+    """
+SELECT c.captain_id, c.last_lat::float8 AS lat, c.last_lng::float8 AS lng,
+       COALESCE(c.performance, 5)::float8 AS performance
+FROM captains c
+WHERE c.available
+  AND c.last_lat BETWEEN :lat0 AND :lat1
+  AND c.last_lng BETWEEN :lng0 AND :lng1
+    """
+)
+
+_ASSIGN_SQL = sa_text(
+    """
+UPDATE orders o SET captain_id = v.captain_id
+FROM unnest(CAST(:order_ids AS int[]), CAST(:captain_ids AS int[])) AS v(order_id, captain_id)
+WHERE o.order_id = v.order_id AND o.captain_id IS NULL
+RETURNING o.order_id, o.captain_id
+    """
+)
+
+# نفس أحداث assign(): assigned ثم accepted لكل طلب
+_EVENTS_SQL = sa_text(
+    """
+INSERT INTO order_events(order_id, event_type, payload, created_at)
+SELECT v.order_id, t.event_type, jsonb_build_object('captain_id', v.captain_id), timezone('utc', now())
+FROM unnest(CAST(:order_ids AS int[]), CAST(:captain_ids AS int[])) AS v(order_id, captain_id)
+CROSS JOIN (VALUES (1, 'assigned'), (2, 'accepted')) AS t(ord, event_type)
+ORDER BY v.order_id, t.ord
+    """
+)
+
+
+def _hungarian(cost) -> List[int]:
+    """Min-cost assignment for an n×m NumPy matrix with n <= m; returns the column of each row.
+
+    Shortest augmenting path with potentials, O(n²·m), inner loop vectorized over columns.
+    """
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.int64)
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (cur < minv[1:])
+            minv[1:][better] = cur[better]
+            way[1:][better] = j0
+            masked = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(masked)) + 1
+            delta = masked[j1 - 1]
+            used_idx = np.flatnonzero(used)
+            u[p[used_idx]] += delta
+            v[used_idx] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    rows = [-1] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            rows[p[j] - 1] = j - 1
+    return rows
+
+
+def _greedy(pairs: List[Tuple[float, int, int]]) -> List[Tuple[int, int]]:
+    taken_rows, taken_cols, out = set(), set(), []
+    for _, i, j in sorted(pairs):
+        if i in taken_rows or j in taken_cols:
+            continue
+        taken_rows.add(i)
+        taken_cols.add(j)
+        out.append((i, j))
+    return out
+
+
+def _cost_np(orders, captains, radius_km):
+    # مسافة مستوية (equirectangular) للمصفوفة الكاملة: دقيقة على مستوى المدينة وأرخص بكثير من haversine
+    olat = np.array([o[1] for o in orders])[:, None]
+    olng = np.array([o[2] for o in orders])[:, None]
+    clat = np.array([c[1] for c in captains], dtype=np.float64)[None, :]
+    clng = np.array([c[2] for c in captains], dtype=np.float64)[None, :]
+    dx = (clng - olng) * np.cos(np.radians(olat))
+    dist = np.sqrt(dx * dx + (clat - olat) ** 2) * KM_PER_DEG
+    perf = np.array([c[3] for c in captains], dtype=np.float64)[None, :]
+    load = np.array([c[4] for c in captains], dtype=np.float64)[None, :]
+    cost = dist * (3600.0 / AVG_SPEED_KMH) + (ETA_FIXED_SEC + LOAD_PENALTY_SEC * load - PERFORMANCE_BONUS_SEC * np.clip(perf / 5.0, 0.0, 1.0))
+    return np.where(dist <= radius_km, cost, _BIG)
+
+
+def solve(orders: List[tuple], captains: List[tuple], radius_km: float) -> Tuple[List[Dict[str, Any]], str]:
+    """Match orders (order_id, lat, lng) to captains (captain_id, lat, lng, performance, active_orders).
+
+    Returns ([{order_id, captain_id, distance_km, eta_sec}], solver name).
+    """
+    if not orders or not captains:
+        return [], "none"
+
+    if np is None:
+        pairs, info = [], {}
+        for i, o in enumerate(orders):
+            for j, c in enumerate(captains):
+                d = haversine_km(o[1], o[2], c[1], c[2])
+                if d <= radius_km:
+                    eta = d / AVG_SPEED_KMH * 3600 + ETA_FIXED_SEC
+                    cost = eta + LOAD_PENALTY_SEC * c[4] - PERFORMANCE_BONUS_SEC * min(max(c[3] / 5.0, 0.0), 1.0)
+                    pairs.append((cost, i, j))
+                    info[(i, j)] = (d, eta)
+        matched = _greedy(pairs)
+        return [
+            {"order_id": orders[i][0], "captain_id": captains[j][0], "distance_km": round(info[(i, j)][0], 3), "eta_sec": int(info[(i, j)][1])}
+            for i, j in matched
+        ], "greedy"
+
+    cost = _cost_np(orders, captains, radius_km)
+    # نُبقي لكل طلب أقرب CANDIDATES_PER_ORDER كباتن فقط (أعمدة أقل → حل أسرع، دون تغيير يُذكر في الأمثلية)
+    k = min(CANDIDATES_PER_ORDER, cost.shape[1])
+    near = np.argpartition(cost, k - 1, axis=1)[:, :k]
+    cols = np.unique(near[np.take_along_axis(cost, near, axis=1) < _BIG])
+    if cols.size == 0:
+        return [], "none"
+    sub = cost[:, cols]
+    n, m = sub.shape
+    if n * m <= HUNGARIAN_MAX_CELLS:
+        solver = "hungarian"
+        if n <= m:
+            matched = [(i, j) for i, j in enumerate(_hungarian(sub)) if j >= 0]
+        else:
+            matched = [(i, j) for j, i in enumerate(_hungarian(sub.T)) if i >= 0]
+    else:
+        solver = "greedy"
+        # أزواج المرشحين القريبين فقط (n × k) بدل كل الأزواج الممكنة
+        col_of = {int(c): j for j, c in enumerate(cols)}
+        pairs = [
+            (float(cost[i, c]), i, col_of[int(c)])
+            for i in range(n)
+            for c in near[i]
+            if cost[i, c] < _BIG
+        ]
+        matched = _greedy(pairs)
+
+    out = []
+    for i, j in matched:
+        if sub[i, j] >= _BIG:
+            continue
+        o, c = orders[i], captains[int(cols[j])]
+        d = haversine_km(o[1], o[2], c[1], c[2])
+        out.append({
+            "order_id": o[0],
+            "captain_id": c[0],
+            "distance_km": round(d, 3),
+            "eta_sec": int(d / AVG_SPEED_KMH * 3600 + ETA_FIXED_SEC),
+        })
+    return out, solver
+
+
+async def _captains_from_index(session: AsyncSession, orders: List[tuple], radius_km: float) -> List[tuple]:
+    lat0, lat1 = min(o[1] for o in orders), max(o[1] for o in orders)
+    lng0, lng1 = min(o[2] for o in orders), max(o[2] for o in orders)
+    clat, clng = (lat0 + lat1) / 2, (lng0 + lng1) / 2
+    span_km = haversine_km(clat, clng, lat1, lng1)
+    ids, lats, lngs, _, perf = captain_index.INDEX.within(clat, clng, span_km + radius_km)
+    loads = await captain_load.get_many(ids, session)
+    return [
+        (ids[i], lats[i], lngs[i], perf[i], loads.get(ids[i], 0))
+        for i in range(len(ids))
+        if loads.get(ids[i], 0) < DISPATCH_MAX_ACTIVE
+    ]
+
+
+async def _captains_from_db(session: AsyncSession, orders: List[tuple], radius_km: float) -> List[tuple]:
+    dlat = radius_km / 111.32
+    lat0, lat1 = min(o[1] for o in orders) - dlat, max(o[1] for o in orders) + dlat
+    dlng = dlat / max(min(cos(radians(lat0)), cos(radians(lat1))), 0.01)
+    lng0, lng1 = min(o[2] for o in orders) - dlng, max(o[2] for o in orders) + dlng
+    rows = (await session.execute(
+        _CAPTAINS_SQL, {"lat0": lat0, "lat1": lat1, "lng0": lng0, "lng1": lng1}
+    )).all()
+    loads = await captain_load.get_many([r.captain_id for r in rows], session)
+    return [
+        (r.captain_id, r.lat, r.lng, r.performance, loads.get(r.captain_id, 0))
+        for r in rows
+        if r.lat is not None and r.lng is not None and loads.get(r.captain_id, 0) < DISPATCH_MAX_ACTIVE
+    ]
+
+
+def notify_accepted(captain_id: int, order_id: int) -> None:
+    """Send the captain's (simulated) `accepted` WS message after ACCEPT_DELAY_SEC."""
+    try:
+        asyncio.create_task(
+            manager.send_json_after(
+                captain_id,
+                {"type": "accepted", "captain_id": captain_id, "order_id": order_id},
+                ACCEPT_DELAY_SEC,
+            )
+        )
+    except Exception:
+        pass
+
+
+async def _publish(assignments: List[Dict[str, Any]]) -> None:
+    for a in assignments:
+        notify_accepted(a["captain_id"], a["order_id"])
+    try:
+        r = await get_redis()
+        if not r:
+            return
+        async with r.pipeline(transaction=False) as pipe:
+            for a in assignments:
+                pipe.publish(
+                    f"captain:{a['captain_id']}",
+                    json.dumps({"type": "assigned", "order_id": a["order_id"], "captain_id": a["captain_id"]}),
+                )
+            await pipe.execute()
+    except Exception:
+        pass
+
+
+async def dispatch(
+    session: AsyncSession,
+    limit: int = DISPATCH_MAX_ORDERS,
+    radius_km: float = DISPATCH_RADIUS_KM,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """Assign up to `limit` unassigned choose_captain orders in one transaction.
+
+    Orders are locked with SKIP LOCKED so concurrent dispatchers (other workers,
+    manual assign) never fight over the same rows. Redis `captain:{id}`
+    messages and the WS `accepted` notifications go out after the commit.
+    """
+    t0 = time.perf_counter()
+    orders = [(r.order_id, r.lat, r.lng) for r in (await session.execute(_ORDERS_SQL, {"limit": limit})).all()]
+    captains: List[tuple] = []
+    if orders:
+        if captain_index.ready():
+            captains = await _captains_from_index(session, orders, radius_km)
+        else:
+            captains = await _captains_from_db(session, orders, radius_km)
+    t1 = time.perf_counter()
+    assignments, solver = solve(orders, captains, radius_km)
+    t2 = time.perf_counter()
+
+    if assignments and not dry_run:
+        params = {
+            "order_ids": [a["order_id"] for a in assignments],
+            "captain_ids": [a["captain_id"] for a in assignments],
+        }
+        done = {r.order_id for r in (await session.execute(_ASSIGN_SQL, params)).all()}
+        assignments = [a for a in assignments if a["order_id"] in done]
+        params = {
+            "order_ids": [a["order_id"] for a in assignments],
+            "captain_ids": [a["captain_id"] for a in assignments],
+        }
+        await session.execute(_EVENTS_SQL, params)
+        await session.commit()
+        await captain_load.refresh([a["captain_id"] for a in assignments], session)
+        await _publish(assignments)
+    else:
+        await session.rollback()
+
+    stats = {
+        "orders": len(orders),
+        "captains": len(captains),
+        "assigned": len(assignments),
+        "solver": solver,
+        "total_eta_sec": sum(a["eta_sec"] for a in assignments),
+        "load_ms": round((t1 - t0) * 1000, 2),
+        "solve_ms": round((t2 - t1) * 1000, 2),
+        "total_ms": round((time.perf_counter() - t0) * 1000, 2),
+        "dry_run": dry_run,
+    }
+    if assignments and not dry_run:
+        logger.info(f"[dispatch] {stats}")
+    return {"stats": stats, "assignments": assignments}
@@ -0,0 +1,84 @@
+import os
+import re
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+from sqlalchemy import text as sa_text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core import maintenance
+from core.events import utcnow
+
+# أقسام order_events الشهرية (migration 015): إنشاء الأشهر القادمة مسبقاً وحذف الأقسام الأقدم من فترة الاحتفاظ.
+# الحذف = DROP للقسم كاملاً (بدون DELETE ولا vacuum)، والقسم الافتراضي order_events_default لا يُحذف أبداً.
+MONTHS_AHEAD = int(os.getenv("ORDER_EVENTS_MONTHS_AHEAD", "3"))
+RETENTION_MONTHS = int(os.getenv("ORDER_EVENTS_RETENTION_MONTHS", "12"))
+INTERVAL_SEC = float(os.getenv("ORDER_EVENTS_PARTITIONS_SEC", "21600"))
+JOB = "order_events_partitions"
+
+_PARTITION_RE = re.compile(r"^order_events_p(\d{4})(\d{2})$")
+
+_partitioned: Optional[bool] = None
+
+
+def _add_months(d: date, months: int) -> date:
+    y, m = divmod(d.year * 12 + d.month - 1 + months, 12)
+    return date(y, m + 1, 1)
+
+
+async def _is_partitioned(session: AsyncSession) -> bool:
+    """Whether migration 015 is applied (order_events is a partitioned table); checked once per worker."""
+    global _partitioned
+    if _partitioned is None:
+        _partitioned = bool((await session.execute(sa_text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('order_events'))"
+        ))).scalar())
+    return _partitioned
+
+
+async def partitions(session: AsyncSession) -> List[str]:
+    rows = (await session.execute(sa_text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('order_events') ORDER BY c.relname"
+    ))).scalars().all()
+    return list(rows)
+
+
+async def ensure(session: AsyncSession, today: Optional[date] = None) -> List[str]:
+    """Create the partitions from this month to MONTHS_AHEAD months ahead (existing ones are kept)."""
+    first = (today or utcnow().date()).replace(day=1)
+    created = []
+    existing = set(await partitions(session))
+    for i in range(MONTHS_AHEAD + 1):
+        month = _add_months(first, i)
+        name = f"order_events_p{month:%Y%m}"
+        if name not in existing:
+            await session.execute(sa_text("SELECT order_events_create_partition(:m)"), {"m": month})
+            created.append(name)
+    return created
+
+
+async def drop_expired(session: AsyncSession, today: Optional[date] = None) -> List[str]:
+    """Drop monthly partitions that end before the retention window."""
+    cutoff = _add_months((today or utcnow().date()).replace(day=1), -RETENTION_MONTHS)
+    dropped = []
+    for name in await partitions(session):
+        m = _PARTITION_RE.match(name)
+        if not m:
+            continue
+        if date(int(m.group(1)), int(m.group(2)), 1) < cutoff:
+            await session.execute(sa_text(f'DROP TABLE IF EXISTS "{name}"'))
+            dropped.append(name)
+    return dropped
+
+
+@maintenance.periodic(JOB, INTERVAL_SEC)
+async def partitions_job(session: AsyncSession) -> Dict[str, Any]:
+    if not await _is_partitioned(session):
+        return {}
+    created = await ensure(session)
+    dropped = await drop_expired(session)
+    if created or dropped:
+        logger.info(f"[order_events] partitions created={created} dropped={dropped}")
+    return {"created": created, "dropped": dropped}
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import text as sa_text
+
+from core.db import AsyncSessionLocal
+
+# كاتب order_events غير متزامن داخل العامل: المسارات تضيف الحدث إلى طابور محدود دون انتظار قاعدة البيانات،
+# ومهمة واحدة تكتبها دفعات بـ INSERT واحد (unnest) عند امتلاء الدفعة أو مرور FLUSH_SEC.
+# الطابور الممتلئ يطبّق backpressure (انتظار حتى PUT_TIMEOUT_SEC ثم إسقاط الحدث مع عدّه)،
+# وعند الإيقاف يُفرَّغ كل ما بقي. created_at يُلتقط لحظة الحدث لا لحظة الكتابة، بتوقيت UTC
+# (مثل افتراضي العمود وإدراجات assign/dispatch في SQL — migration 018) فلا يختلط ترتيب الخط الزمني.
+QUEUE_MAX = int(os.getenv("EVENTS_QUEUE_MAX", "10000"))
+BATCH_SIZE = int(os.getenv("EVENTS_BATCH_SIZE", "500"))
+FLUSH_SEC = float(os.getenv("EVENTS_FLUSH_SEC", "0.5"))
+PUT_TIMEOUT_SEC = float(os.getenv("EVENTS_PUT_TIMEOUT_SEC", "0.05"))
+STOP_TIMEOUT_SEC = float(os.getenv("EVENTS_STOP_TIMEOUT_SEC", "10"))
+MAX_RETRIES = 3
+
+Event = Tuple[int, str, Optional[str], datetime]
+
+_INSERT_SQL = sa_text(
+    """
+INSERT INTO order_events(order_id, event_type, payload, created_at)
+SELECT v.order_id, v.event_type, v.payload::jsonb, v.created_at
+FROM unnest(CAST(:order_ids AS int[]), CAST(:event_types AS text[]),
+            CAST(:payloads AS text[]), CAST(:created_ats AS timestamp[]))
+     AS v(order_id, event_type, payload, created_at)
+    """
+)
+
+_queue: Optional[asyncio.Queue] = None
+_tasks: List[asyncio.Task] = []
+_state = {"stopping": False}
+_stats = {"queued": 0, "written": 0, "batches": 0, "dropped": 0, "blocked": 0, "failed_batches": 0, "last_flush_ms": 0.0}
+
+
+def _get_queue() -> asyncio.Queue:
+    global _queue
+    if _queue is None:
+        _queue = asyncio.Queue(maxsize=QUEUE_MAX)
+    return _queue
+
+
+def utcnow() -> datetime:
+    """Naive UTC timestamp, the clock order_events.created_at uses everywhere."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _event(order_id: int, event_type: str, payload: Optional[Dict[str, Any]]) -> Event:
+    return (
+        int(order_id),
+        event_type,
+        json.dumps(payload, default=str) if payload is not None else None,
+        utcnow(),
+    )
+
+
+def emit_nowait(order_id: int, event_type: str, payload: Optional[Dict[str, Any]] = None) -> bool:
+    """Queue an event without waiting; returns False (and counts a drop) when the queue is full."""
+    try:
+        _get_queue().put_nowait(_event(order_id, event_type, payload))
+    except asyncio.QueueFull:
+        _stats["dropped"] += 1
+        return False
+    _stats["queued"] += 1
+    return True
+
+
+async def emit(order_id: int, event_type: str, payload: Optional[Dict[str, Any]] = None) -> bool:
+    """Queue an event; a full queue makes the caller wait up to PUT_TIMEOUT_SEC before dropping it."""
+    ev = _event(order_id, event_type, payload)
+    q = _get_queue()
+    try:
+        q.put_nowait(ev)
+    except asyncio.QueueFull:
+        _stats["blocked"] += 1
+        try:
+            await asyncio.wait_for(q.put(ev), PUT_TIMEOUT_SEC)
+        except asyncio.TimeoutError:
+            _stats["dropped"] += 1
+            logger.warning(f"[events] queue full, dropped {event_type} for order {order_id}")
+            return False
+    _stats["queued"] += 1
+    return True
+
+
+async def _write(batch: List[Event]) -> None:
+    params = {
+        "order_ids": [e[0] for e in batch],
+        "event_types": [e[1] for e in batch],
+        "payloads": [e[2] for e in batch],
+        "created_ats": [e[3] for e in batch],
+    }
+    for attempt in range(MAX_RETRIES):
+        try:
+            t0 = time.perf_counter()
+            async with AsyncSessionLocal() as session:
+                await session.execute(_INSERT_SQL, params)
+                await session.commit()
+            _stats["written"] += len(batch)
+            _stats["batches"] += 1
+            _stats["last_flush_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+            return
+        except Exception as e:
+            if attempt == MAX_RETRIES - 1:
+                _stats["failed_batches"] += 1
+                _stats["dropped"] += len(batch)
+                logger.warning(f"[events] dropped batch of {len(batch)} after {MAX_RETRIES} attempts: {e}")
+                return
+            await asyncio.sleep(0.2 * (attempt + 1))
+
+
+def _drain(q: asyncio.Queue, batch: List[Event]) -> None:
+    while len(batch) < BATCH_SIZE:
+        try:
+            batch.append(q.get_nowait())
+        except asyncio.QueueEmpty:
+            return
+
+
+async def _writer() -> None:
+    q = _get_queue()
+    while True:
+        try:
+            batch = [await asyncio.wait_for(q.get(), FLUSH_SEC)]
+        except asyncio.TimeoutError:
+            if _state["stopping"]:
+                return
+            continue
+        deadline = time.monotonic() + FLUSH_SEC
+        _drain(q, batch)
+        while len(batch) < BATCH_SIZE and not _state["stopping"]:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(q.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+            _drain(q, batch)
+        await _write(batch)
+
+
+async def flush() -> int:
+    """Write everything queued right now; returns the number of events."""
+    q = _get_queue()
+    n = 0
+    while not q.empty():
+        batch: List[Event] = []
+        _drain(q, batch)
+        await _write(batch)
+        n += len(batch)
+    return n
+
+
+def start() -> None:
+    if _tasks:
+        return
+    _state["stopping"] = False
+    _tasks.append(asyncio.create_task(_writer()))
+
+
+async def stop() -> None:
+    """Let the writer drain the queue and exit (cancelled after STOP_TIMEOUT_SEC), then flush leftovers."""
+    _state["stopping"] = True
+    for t in _tasks:
+        try:
+            await asyncio.wait_for(t, STOP_TIMEOUT_SEC)
+        except BaseException:
+            pass
+    _tasks.clear()
+    n = await flush()
+    if n:
+        logger.info(f"[events] flushed {n} events on shutdown")
+
+
+def metrics() -> Dict[str, Any]:
+    return {**_stats, "pending": _get_queue().qsize(), "queue_max": QUEUE_MAX, "running": bool(_tasks)}
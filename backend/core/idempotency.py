@@ -0,0 +1,165 @@
+import json
+import os
+from typing import Any, Dict, Optional
+
+from fastapi import Header, HTTPException
+from loguru import logger
+from sqlalchemy import text as sa_text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core import maintenance
+from core.redis import get_redis
+
+# Idempotency-Key عام للمسارات التي تعدّل البيانات (اختياري لكل مسار عبر Depends(idempotency("scope"))).
+# Redis أولاً: SET NX مع TTL قصير يحجز المفتاح ثم يحمل الاستجابة (TTL كامل) بعد الـ commit، فالتكرار يُجاب دون قاعدة البيانات.
+# علامة الانتظار في Redis تلميح فقط: "قيد التنفيذ" يقرره قفل استشاري على المفتاح داخل معاملة العملية،
+# فعامل انهار أو DEL فشل لا يحجب المفتاح (تنتهي العلامة بعد PENDING_SEC، وقبلها يمر الطلب إلى Postgres).
+# Postgres (idempotency_keys) هو المرجع: المفتاح والاستجابة يُكتبان داخل معاملة العملية نفسها،
+# وتُحذف المفاتيح الأقدم من TTL دورياً عبر الفهرس على created_at (migration 014).
+TTL_SEC = int(os.getenv("IDEMPOTENCY_TTL_SEC", "86400"))
+PENDING_SEC = int(os.getenv("IDEMPOTENCY_PENDING_SEC", "60"))
+PURGE_INTERVAL_SEC = float(os.getenv("IDEMPOTENCY_PURGE_SEC", "600"))
+PURGE_BATCH = int(os.getenv("IDEMPOTENCY_PURGE_BATCH", "50000"))
+PURGE_JOB = "idempotency_purge"
+REDIS_PREFIX = "idem:"
+_PENDING = "__pending__"
+# مفتاح قديم بلا استجابة مخزّنة
+DUPLICATE = {"ok": True, "duplicate": True}
+
+_LOCK_SQL = sa_text("SELECT pg_try_advisory_xact_lock(hashtextextended(:k, 0))")
+_CLAIM_SQL = sa_text("INSERT INTO idempotency_keys(key) VALUES (:k) ON CONFLICT DO NOTHING RETURNING key")
+_STORED_SQL = sa_text("SELECT response FROM idempotency_keys WHERE key = :k")
+_SAVE_SQL = sa_text("UPDATE idempotency_keys SET response = CAST(:r AS JSONB) WHERE key = :k")
+_PURGE_SQL = sa_text(
+    """
+DELETE FROM idempotency_keys
+WHERE key IN (
+  SELECT key FROM idempotency_keys
+  WHERE created_at < LOCALTIMESTAMP - make_interval(secs => :ttl)
+  ORDER BY created_at
+  LIMIT :batch
+)
+    """
+)
+
+_stats = {"redis_replays": 0, "db_replays": 0, "claims": 0, "in_progress": 0, "stale_pending": 0, "purged": 0}
+
+
+class Idempotency:
+    """One request's Idempotency-Key within a scope (e.g. "assign", "cancel").
+
+    Usage inside the operation's transaction (`db` is a session or connection):
+    `replay(db)` → stored response or None, `save(db, response)` before commit,
+    `done(response)` after commit. Without a key every call is a no-op.
+    """
+
+    def __init__(self, scope: str, key: Optional[str]):
+        self.scope = scope
+        self.key = key.strip() if key and key.strip() else None
+        self._claimed = False
+        self._finished = False
+
+    @property
+    def _db_key(self) -> str:
+        return f"{self.scope}:{self.key}"
+
+    @property
+    def _redis_key(self) -> str:
+        return REDIS_PREFIX + self._db_key
+
+    async def replay(self, db) -> Optional[Any]:
+        """Claim the key, or return the response stored for it.
+
+        Raises 409 while another request holding the same key is still running.
+        """
+        if not self.key:
+            return None
+        pending = False
+        try:
+            r = await get_redis()
+            if r:
+                if await r.set(self._redis_key, _PENDING, nx=True, ex=PENDING_SEC):
+                    self._claimed = True
+                else:
+                    cached = await r.get(self._redis_key)
+                    if cached is not None:
+                        cached = cached.decode() if isinstance(cached, bytes) else cached
+                        if cached != _PENDING:
+                            _stats["redis_replays"] += 1
+                            self._finished = True
+                            return json.loads(cached)
+                        pending = True
+        except Exception:
+            pass
+
+        # القفل الاستشاري يعيش بعمر معاملة الطلب الآخر: محجوز = قيد التنفيذ فعلاً، وإلا فعلامة Redis يتيمة
+        if not (await db.execute(_LOCK_SQL, {"k": self._db_key})).scalar():
+            _stats["in_progress"] += 1
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is in progress")
+        if pending:
+            _stats["stale_pending"] += 1
+            self._claimed = True
+
+        # Postgres: RETURNING فارغ = المفتاح مُثبَّت مسبقاً
+        claimed = (await db.execute(_CLAIM_SQL, {"k": self._db_key})).first()
+        if claimed is not None:
+            _stats["claims"] += 1
+            return None
+        stored = (await db.execute(_STORED_SQL, {"k": self._db_key})).scalar()
+        stored = stored if stored is not None else DUPLICATE
+        _stats["db_replays"] += 1
+        await self.done(stored)
+        return stored
+
+    async def save(self, db, response: Any) -> None:
+        """Store the response next to the key, in the caller's transaction."""
+        if self.key:
+            await db.execute(_SAVE_SQL, {"k": self._db_key, "r": json.dumps(response, default=str)})
+
+    async def done(self, response: Any) -> None:
+        """After commit: later replays are answered from Redis."""
+        if not self.key:
+            return
+        self._finished = True
+        try:
+            r = await get_redis()
+            if r:
+                await r.set(self._redis_key, json.dumps(response, default=str), ex=TTL_SEC)
+        except Exception:
+            pass
+
+    async def release(self) -> None:
+        """Drop an unfinished Redis claim (the request failed; Postgres rolled back its row)."""
+        if not self._claimed or self._finished:
+            return
+        try:
+            r = await get_redis()
+            if r:
+                await r.delete(self._redis_key)
+        except Exception:
+            pass
+
+
+def idempotency(scope: str):
+    """FastAPI dependency reading the optional `Idempotency-Key` header for `scope`."""
+    async def dep(idempotency_key: Optional[str] = Header(default=None)):
+        idem = Idempotency(scope, idempotency_key)
+        try:
+            yield idem
+        finally:
+            await idem.release()
+    return dep
+
+
+@maintenance.periodic(PURGE_JOB, PURGE_INTERVAL_SEC)
+async def purge_job(session: AsyncSession) -> int:
+    """Delete keys older than TTL_SEC, oldest first, at most PURGE_BATCH per run."""
+    n = (await session.execute(_PURGE_SQL, {"ttl": TTL_SEC, "batch": PURGE_BATCH})).rowcount or 0
+    _stats["purged"] += n
+    if n:
+        logger.info(f"[idempotency] purged {n} expired keys")
+    return n
+
+
+def metrics() -> Dict[str, Any]:
+    return {**_stats, "ttl_sec": TTL_SEC, "pending_sec": PENDING_SEC}
@@ -0,0 +1,78 @@
+import asyncio
+import contextlib
+import zlib
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import text as sa_text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.db import AsyncSessionLocal
+
+# مهام صيانة دورية داخل العامل. كل مهمة تأخذ قفلاً استشارياً على مستوى المعاملة
+# (يعمل خلف PgBouncer) حتى تنفّذها نسخة واحدة فقط عبر كل العمال/الحاويات في كل دورة.
+Job = Callable[[AsyncSession], Awaitable[object]]
+
+_jobs: List[Tuple[str, float, Job]] = []
+_tasks: List[asyncio.Task] = []
+
+
+def periodic(name: str, interval_sec: float):
+    """Register `fn(session)` to run every `interval_sec` on one worker at a time."""
+    def deco(fn: Job) -> Job:
+        _jobs.append((name, interval_sec, fn))
+        return fn
+    return deco
+
+
+def _lock_key(name: str) -> int:
+    return zlib.crc32(f"maintenance:{name}".encode())
+
+
+async def run_job(name: str, fn: Job) -> Optional[object]:
+    """Run one job in a single transaction guarded by a transaction-level advisory lock.
+
+    Returns None when another worker holds the lock. Jobs must not commit
+    themselves; the transaction (and the lock) ends when the job returns.
+    """
+    async with AsyncSessionLocal() as session:
+        got = (await session.execute(
+            sa_text("SELECT pg_try_advisory_xact_lock(:k)"), {"k": _lock_key(name)}
+        )).scalar()
+        if not got:
+            await session.rollback()
+            return None
+        try:
+            result = await fn(session)
+            await session.commit()
+            return result
+        except Exception:
+            await session.rollback()
+            raise
+
+
+async def _loop(name: str, interval_sec: float, fn: Job) -> None:
+    while True:
+        await asyncio.sleep(interval_sec)
+        try:
+            await run_job(name, fn)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"[maintenance] {name} failed: {e}")
+
+
+def start() -> None:
+    if _tasks:
+        return
+    for name, interval_sec, fn in _jobs:
+        _tasks.append(asyncio.create_task(_loop(name, interval_sec, fn)))
+
+
+async def stop() -> None:
+    for t in _tasks:
+        t.cancel()
+    for t in _tasks:
+        with contextlib.suppress(BaseException):
+            await t
+    _tasks.clear()
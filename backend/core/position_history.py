@@ -0,0 +1,390 @@
+import asyncio
+import collections
+import contextlib
+import os
+import re
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import text as sa_text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core import maintenance
+from core.db import AsyncSessionLocal
+
+# سجل مسارات الكباتن (migration 017) من رسائل pos على WebSocket: صف واحد لكل كابتن لكل دقيقة،
+# نقاطه مرمّزة بالفروق (zigzag varint): الزمن بوحدات 100ms من بداية الدقيقة، والإحداثيات بدقة 1e-5 (~1 م)،
+# أي نحو 4-5 بايت للنقطة بدل 24. بعد DOWNSAMPLE_AFTER_HOURS تُدمج دقائق كل ساعة في صف واحد
+# بنقطة كل DOWNSAMPLE_SEC، وتُحذف الأقسام اليومية الأقدم من RETENTION_DAYS.
+# bucket وأيام الأقسام بتوقيت UTC (ساعة واحدة للتطبيق والترحيلات)؛ لا قسم افتراضي (migration 019):
+# صف ليومٍ بلا قسم يُنشئ قسمه عند فشل الكتابة ثم يُعاد.
+COORD_SCALE = 100_000
+TIME_UNIT_MS = 100
+RAW_SPAN_SEC = 60
+HOUR_SPAN_SEC = 3600
+FLUSH_SEC = float(os.getenv("POSITION_HISTORY_FLUSH_SEC", "10"))
+MAX_PENDING_ROWS = int(os.getenv("POSITION_HISTORY_MAX_PENDING_ROWS", "200000"))
+BATCH_SIZE = 5000
+STOP_TIMEOUT_SEC = 10.0
+DOWNSAMPLE_AFTER_HOURS = int(os.getenv("POSITION_HISTORY_DOWNSAMPLE_AFTER_HOURS", "168"))
+DOWNSAMPLE_SEC = int(os.getenv("POSITION_HISTORY_DOWNSAMPLE_SEC", "30"))
+DOWNSAMPLE_CAPTAINS = 500
+DOWNSAMPLE_BUDGET_SEC = 20.0
+RETENTION_DAYS = int(os.getenv("POSITION_HISTORY_RETENTION_DAYS", "90"))
+DAYS_AHEAD = 3
+INTERVAL_SEC = float(os.getenv("POSITION_HISTORY_MAINTENANCE_SEC", "300"))
+MAX_WINDOW = timedelta(days=7)
+JOB = "captain_positions_maintenance"
+
+_NO_PARTITION = "no partition of relation"
+_PARTITION_RE = re.compile(r"^captain_positions_p(\d{4})(\d{2})(\d{2})$")
+
+Point = Tuple[int, int, int]  # (t بوحدات TIME_UNIT_MS من بداية الصف، lat × COORD_SCALE، lng × COORD_SCALE)
+Row = Tuple[int, datetime, int, int, bytes]
+
+
+def _utc(ts: float) -> datetime:
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+
+
+def utcnow() -> datetime:
+    """Naive UTC, the clock of captain_positions.bucket and its daily partitions."""
+    return _utc(time.time())
+
+
+def _zigzag(v: int) -> int:
+    return (v << 1) ^ (v >> 63)
+
+
+def encode(points: List[Point]) -> bytes:
+    """Delta + zigzag varint encoding of (t, lat, lng) integer points."""
+    out = bytearray()
+    pt = plat = plng = 0
+    for t, lat, lng in points:
+        for v in (t - pt, lat - plat, lng - plng):
+            v = _zigzag(v)
+            while v >= 0x80:
+                out.append((v & 0x7F) | 0x80)
+                v >>= 7
+            out.append(v)
+        pt, plat, plng = t, lat, lng
+    return bytes(out)
+
+
+def decode(data: bytes) -> Iterator[Point]:
+    vals = [0, 0, 0]
+    i = shift = acc = 0
+    for b in data:
+        acc |= (b & 0x7F) << shift
+        if b & 0x80:
+            shift += 7
+            continue
+        vals[i] += (acc >> 1) ^ -(acc & 1)
+        acc = shift = 0
+        i += 1
+        if i == 3:
+            yield vals[0], vals[1], vals[2]
+            i = 0
+
+
+class _Minute:
+    __slots__ = ("bucket", "points")
+
+    def __init__(self, bucket: int):
+        self.bucket = bucket
+        self.points: List[Point] = []
+
+
+_open: Dict[int, _Minute] = {}
+_sealed: Deque[Row] = collections.deque()
+_tasks: List[asyncio.Task] = []
+_state: Dict[str, Any] = {"stopping": False, "writing": False}
+_stats = {
+    "points": 0, "skipped": 0, "rows_written": 0, "points_written": 0, "bytes_written": 0, "batches": 0,
+    "dropped_rows": 0, "failed_batches": 0, "last_flush_ms": 0.0,
+}
+
+
+def append(captain_id: int, lat: float, lng: float, ts: Optional[float] = None) -> bool:
+    """Buffer one position in the captain's current minute; False for out-of-order points."""
+    ts = time.time() if ts is None else ts
+    bucket = int(ts // RAW_SPAN_SEC) * RAW_SPAN_SEC
+    m = _open.get(captain_id)
+    if m is not None and m.bucket != bucket:
+        if bucket < m.bucket:
+            _stats["skipped"] += 1
+            return False
+        _seal(captain_id, m)
+        m = None
+    if m is None:
+        m = _open[captain_id] = _Minute(bucket)
+    t = int((ts - bucket) * 1000 / TIME_UNIT_MS)
+    if m.points and t <= m.points[-1][0]:
+        _stats["skipped"] += 1
+        return False
+    m.points.append((t, round(lat * COORD_SCALE), round(lng * COORD_SCALE)))
+    _stats["points"] += 1
+    return True
+
+
+def _seal(captain_id: int, m: _Minute) -> None:
+    if not m.points:
+        return
+    if len(_sealed) >= MAX_PENDING_ROWS:
+        _sealed.popleft()
+        _stats["dropped_rows"] += 1
+    _sealed.append((captain_id, _utc(m.bucket), RAW_SPAN_SEC, len(m.points), encode(m.points)))
+
+
+def _seal_closed(everything: bool = False) -> None:
+    """Move finished minutes (or all of them on shutdown) to the write queue."""
+    current = int(time.time() // RAW_SPAN_SEC) * RAW_SPAN_SEC
+    for cid in [c for c, m in _open.items() if everything or m.bucket < current]:
+        _seal(cid, _open.pop(cid))
+
+
+_INSERT_SQL = sa_text(
+    """
+INSERT INTO captain_positions(captain_id, bucket, span_sec, points, data)
+SELECT * FROM unnest(CAST(:ids AS int[]), CAST(:buckets AS timestamp[]), CAST(:spans AS int[]),
+                     CAST(:points AS int[]), CAST(:data AS bytea[]))
+    """
+)
+
+
+def _params(rows: List[Row]) -> Dict[str, list]:
+    return {
+        "ids": [r[0] for r in rows],
+        "buckets": [r[1] for r in rows],
+        "spans": [r[2] for r in rows],
+        "points": [r[3] for r in rows],
+        "data": [r[4] for r in rows],
+    }
+
+
+async def _create_partitions(days: List[date]) -> None:
+    async with AsyncSessionLocal() as session:
+        for day in sorted(set(days)):
+            await session.execute(sa_text("SELECT captain_positions_create_partition(:d)"), {"d": day})
+        await session.commit()
+    logger.info(f"[position_history] created missing partitions for {sorted(set(days))}")
+
+
+async def _insert(rows: List[Row]) -> None:
+    try:
+        async with AsyncSessionLocal() as session:
+            await session.execute(_INSERT_SQL, _params(rows))
+            await session.commit()
+    except Exception as e:
+        if _NO_PARTITION not in str(e):
+            raise
+        # يوم لم تنشئ مهمة الصيانة قسمه بعد (تأخرها أو فرق الساعة): يُنشأ ثم تُعاد الدفعة مرة واحدة
+        await _create_partitions([r[1].date() for r in rows])
+        async with AsyncSessionLocal() as session:
+            await session.execute(_INSERT_SQL, _params(rows))
+            await session.commit()
+
+
+async def flush(everything: bool = False) -> int:
+    """Write sealed rows; returns how many were written."""
+    _seal_closed(everything)
+    n = 0
+    while _sealed:
+        rows = [_sealed.popleft() for _ in range(min(BATCH_SIZE, len(_sealed)))]
+        try:
+            t0 = time.perf_counter()
+            await _insert(rows)
+        except Exception as e:
+            # تُعاد إلى بداية الطابور وتُجرّب في الدورة التالية (الطابور محدود بـ MAX_PENDING_ROWS)
+            _sealed.extendleft(reversed(rows))
+            _stats["failed_batches"] += 1
+            logger.warning(f"[position_history] write of {len(rows)} rows failed: {e}")
+            break
+        n += len(rows)
+        _stats["rows_written"] += len(rows)
+        _stats["points_written"] += sum(r[3] for r in rows)
+        _stats["bytes_written"] += sum(len(r[4]) for r in rows)
+        _stats["batches"] += 1
+        _stats["last_flush_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    return n
+
+
+async def _flusher() -> None:
+    while not _state["stopping"]:
+        await asyncio.sleep(FLUSH_SEC)
+        _state["writing"] = True
+        try:
+            await flush()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"[position_history] flush failed: {e}")
+        finally:
+            _state["writing"] = False
+
+
+def start() -> None:
+    if _tasks:
+        return
+    _state["stopping"] = False
+    _tasks.append(asyncio.create_task(_flusher()))
+
+
+async def stop() -> None:
+    """Finish the in-flight flush, then write every buffered minute including the current one."""
+    _state["stopping"] = True
+    for t in _tasks:
+        if not _state["writing"]:
+            t.cancel()
+        with contextlib.suppress(BaseException):
+            await asyncio.wait_for(t, STOP_TIMEOUT_SEC)
+    _tasks.clear()
+    n = await flush(everything=True)
+    if n:
+        logger.info(f"[position_history] flushed {n} rows on shutdown")
+
+
+# ---- قراءة المسار ----
+
+_TRACK_SQL = sa_text(
+    """
+SELECT bucket, data FROM captain_positions
+WHERE captain_id = :captain_id AND bucket >= :lo AND bucket < :until
+ORDER BY bucket
+    """
+)
+
+
+async def track(captain_id: int, since: datetime, until: datetime) -> AsyncIterator[Tuple[datetime, float, float]]:
+    """Decoded (time, lat, lng) points of one captain in [since, until), oldest first, read with a server-side cursor."""
+    # صف الساعة المخففة يبدأ قبل since بحد أقصى ساعة
+    params = {"captain_id": captain_id, "lo": since - timedelta(seconds=HOUR_SPAN_SEC), "until": until}
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(_TRACK_SQL.execution_options(yield_per=200), params)
+        async for bucket, data in result:
+            for t, lat, lng in decode(data):
+                at = bucket + timedelta(milliseconds=t * TIME_UNIT_MS)
+                if since <= at < until:
+                    yield at, lat / COORD_SCALE, lng / COORD_SCALE
+
+
+# ---- الأقسام والتخفيف ----
+
+async def partitions(session: AsyncSession) -> List[str]:
+    rows = (await session.execute(sa_text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('captain_positions') ORDER BY c.relname"
+    ))).scalars().all()
+    return list(rows)
+
+
+async def ensure(session: AsyncSession, today: Optional[date] = None) -> List[str]:
+    """Create the daily partitions from today (UTC) to DAYS_AHEAD days ahead."""
+    first = today or utcnow().date()
+    existing = set(await partitions(session))
+    created = []
+    for i in range(DAYS_AHEAD + 1):
+        day = first + timedelta(days=i)
+        name = f"captain_positions_p{day:%Y%m%d}"
+        if name not in existing:
+            await session.execute(sa_text("SELECT captain_positions_create_partition(:d)"), {"d": day})
+            created.append(name)
+    return created
+
+
+async def drop_expired(session: AsyncSession, today: Optional[date] = None) -> List[str]:
+    cutoff = (today or utcnow().date()) - timedelta(days=RETENTION_DAYS)
+    dropped = []
+    for name in await partitions(session):
+        m = _PARTITION_RE.match(name)
+        if m and date(int(m.group(1)), int(m.group(2)), int(m.group(3))) < cutoff:
+            await session.execute(sa_text(f'DROP TABLE IF EXISTS "{name}"'))
+            dropped.append(name)
+    return dropped
+
+
+def downsample(rows: List[Tuple[datetime, bytes]], hour: datetime) -> List[Point]:
+    """Merge one captain's minute rows of an hour, keeping the first point of every DOWNSAMPLE_SEC slot."""
+    step = DOWNSAMPLE_SEC * 1000 // TIME_UNIT_MS
+    out: List[Point] = []
+    last_slot = -1
+    for bucket, data in sorted(rows, key=lambda r: r[0]):
+        base = int((bucket - hour).total_seconds() * 1000) // TIME_UNIT_MS
+        for t, lat, lng in decode(data):
+            t += base
+            slot = t // step
+            if slot > last_slot:
+                out.append((t, lat, lng))
+                last_slot = slot
+    return out
+
+
+_OLDEST_RAW_SQL = sa_text(
+    "SELECT date_trunc('hour', min(bucket)) FROM captain_positions WHERE span_sec = 60 AND bucket < :cutoff"
+)
+_RAW_CAPTAINS_SQL = sa_text(
+    """
+SELECT DISTINCT captain_id FROM captain_positions
+WHERE span_sec = 60 AND bucket >= :hour AND bucket < :next
+ORDER BY captain_id LIMIT :n
+    """
+)
+_TAKE_RAW_SQL = sa_text(
+    """
+DELETE FROM captain_positions
+WHERE span_sec = 60 AND bucket >= :hour AND bucket < :next AND captain_id = ANY(CAST(:ids AS int[]))
+RETURNING captain_id, bucket, data
+    """
+)
+
+
+async def downsample_old(session: AsyncSession, budget_sec: float = DOWNSAMPLE_BUDGET_SEC) -> int:
+    """Replace raw minute rows older than DOWNSAMPLE_AFTER_HOURS with hourly rows; returns captain-hours done."""
+    cutoff = utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=DOWNSAMPLE_AFTER_HOURS)
+    deadline = time.monotonic() + budget_sec
+    done = 0
+    while time.monotonic() < deadline:
+        hour = (await session.execute(_OLDEST_RAW_SQL, {"cutoff": cutoff})).scalar()
+        if hour is None:
+            break
+        nxt = hour + timedelta(hours=1)
+        ids = (await session.execute(
+            _RAW_CAPTAINS_SQL, {"hour": hour, "next": nxt, "n": DOWNSAMPLE_CAPTAINS}
+        )).scalars().all()
+        raw: Dict[int, List[Tuple[datetime, bytes]]] = {}
+        for cid, bucket, data in (await session.execute(_TAKE_RAW_SQL, {"hour": hour, "next": nxt, "ids": list(ids)})).all():
+            raw.setdefault(cid, []).append((bucket, bytes(data)))
+        rows: List[Row] = []
+        for cid, minutes in raw.items():
+            pts = downsample(minutes, hour)
+            rows.append((cid, hour, HOUR_SPAN_SEC, len(pts), encode(pts)))
+        if rows:
+            await session.execute(_INSERT_SQL, _params(rows))
+        done += len(rows)
+    return done
+
+
+@maintenance.periodic(JOB, INTERVAL_SEC)
+async def maintenance_job(session: AsyncSession) -> Dict[str, Any]:
+    if (await session.execute(sa_text("SELECT to_regclass('captain_positions')"))).scalar() is None:
+        return {}
+    created = await ensure(session)
+    dropped = await drop_expired(session)
+    downsampled = await downsample_old(session)
+    if created or dropped or downsampled:
+        logger.info(f"[position_history] created={created} dropped={dropped} downsampled={downsampled}")
+    return {"created": created, "dropped": dropped, "downsampled": downsampled}
+
+
+def metrics() -> Dict[str, Any]:
+    return {
+        **_stats,
+        "open_minutes": len(_open),
+        "pending_rows": len(_sealed),
+        "bytes_per_point": (
+            round(_stats["bytes_written"] / _stats["points_written"], 2) if _stats["points_written"] else None
+        ),
+        "running": bool(_tasks),
+    }
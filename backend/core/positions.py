@@ -0,0 +1,146 @@
+import asyncio
+import contextlib
+import os
+import time
+from typing import Any, Dict, List, Tuple
+
+from loguru import logger
+from sqlalchemy import text as sa_text
+
+from core.db import AsyncSessionLocal
+
+# استقبال مواقع الكباتن الحية من /ws/captain/{id}: كل رسالة pos تكتب فوق آخر موقع معلّق للكابتن (الأحدث يفوز)
+# دون أي انتظار، ومهمة واحدة تكتب كل FLUSH_MS ما تجمّع بـ UPDATE واحد لكل دفعة.
+# 10 آلاف كابتن يرسلون كل ثانية = 10 آلاف رسالة، لكن UPDATE واحد في الثانية (أو بضعة حسب BATCH_SIZE).
+FLUSH_MS = int(os.getenv("POSITIONS_FLUSH_MS", "1000"))
+BATCH_SIZE = int(os.getenv("POSITIONS_BATCH_SIZE", "5000"))
+STOP_TIMEOUT_SEC = float(os.getenv("POSITIONS_STOP_TIMEOUT_SEC", "10"))
+MAX_RETRIES = 3
+
+Pending = Tuple[float, float]
+
+# unnest بدل VALUES (...),(...): ثلاث مصفوفات كمعاملات بدل 3×N معامل (asyncpg يقف عند 32767)،
+# والصفوف مرتبة حسب captain_id حتى لا تتعارض أقفال العمال المتزامنين.
+# الكابتن الواقف في مكانه لا يُحدَّث (لا صفوف ميتة ولا تحديث لفهرس GiST بلا داعٍ).
+_UPDATE_SQL = """
+UPDATE captains AS c
+SET last_lat = v.lat, last_lng = v.lng{geo}
+FROM unnest(CAST(:ids AS int[]), CAST(:lats AS float8[]), CAST(:lngs AS float8[])) AS v(captain_id, lat, lng)
+WHERE c.captain_id = v.captain_id
+  AND (c.last_lat IS DISTINCT FROM v.lat OR c.last_lng IS DISTINCT FROM v.lng)
+"""
+_UPDATE_GEO = ", last_geo = ST_SetSRID(ST_MakePoint(v.lng, v.lat), 4326)::geography"
+
+_pending: Dict[int, Pending] = {}
+_tasks: List[asyncio.Task] = []
+_state: Dict[str, Any] = {
+    "postgis": None, "stopping": False, "window_start": time.monotonic(), "window_received": 0, "window_written": 0,
+}
+_stats = {
+    "received": 0, "coalesced": 0, "rejected": 0, "flushed": 0, "updated": 0, "batches": 0,
+    "failed_batches": 0, "dropped": 0, "last_flush_ms": 0.0, "last_batch": 0,
+    "received_per_sec": 0.0, "flushed_per_sec": 0.0,
+}
+
+
+def record(captain_id: int, lat: float, lng: float) -> bool:
+    """Keep the latest position for the next flush; False for out-of-range coordinates."""
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lng <= 180.0):
+        _stats["rejected"] += 1
+        return False
+    _stats["received"] += 1
+    _state["window_received"] += 1
+    if captain_id in _pending:
+        _stats["coalesced"] += 1
+    _pending[captain_id] = (lat, lng)
+    return True
+
+
+async def _has_postgis(session) -> bool:
+    if _state["postgis"] is None:
+        _state["postgis"] = bool((await session.execute(sa_text(
+            "SELECT EXISTS (SELECT 1 FROM pg_attribute WHERE attrelid = to_regclass('captains') "
+            "AND attname = 'last_geo' AND NOT attisdropped)"
+        ))).scalar())
+    return _state["postgis"]
+
+
+async def _write(rows: List[Tuple[int, Pending]]) -> None:
+    params = {"ids": [r[0] for r in rows], "lats": [r[1][0] for r in rows], "lngs": [r[1][1] for r in rows]}
+    for attempt in range(MAX_RETRIES):
+        try:
+            t0 = time.perf_counter()
+            async with AsyncSessionLocal() as session:
+                sql = _UPDATE_SQL.format(geo=_UPDATE_GEO if await _has_postgis(session) else "")
+                res = await session.execute(sa_text(sql), params)
+                await session.commit()
+            _stats["flushed"] += len(rows)
+            _stats["updated"] += res.rowcount or 0
+            _stats["batches"] += 1
+            _stats["last_batch"] = len(rows)
+            _stats["last_flush_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+            _state["window_written"] += len(rows)
+            return
+        except Exception as e:
+            if attempt == MAX_RETRIES - 1:
+                _stats["failed_batches"] += 1
+                _stats["dropped"] += len(rows)
+                logger.warning(f"[positions] dropped batch of {len(rows)} after {MAX_RETRIES} attempts: {e}")
+                return
+            await asyncio.sleep(0.2 * (attempt + 1))
+
+
+async def flush() -> int:
+    """Write every pending position now; returns how many captains were flushed."""
+    global _pending
+    if not _pending:
+        return 0
+    batch, _pending = _pending, {}
+    rows = sorted(batch.items())
+    for i in range(0, len(rows), BATCH_SIZE):
+        await _write(rows[i:i + BATCH_SIZE])
+    return len(rows)
+
+
+def _roll_window() -> None:
+    now = time.monotonic()
+    elapsed = now - _state["window_start"]
+    if elapsed >= 1.0:
+        _stats["received_per_sec"] = round(_state["window_received"] / elapsed, 1)
+        _stats["flushed_per_sec"] = round(_state["window_written"] / elapsed, 1)
+        _state.update(window_start=now, window_received=0, window_written=0)
+
+
+async def _flusher() -> None:
+    while not _state["stopping"]:
+        await asyncio.sleep(FLUSH_MS / 1000)
+        try:
+            await flush()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"[positions] flush failed: {e}")
+        _roll_window()
+
+
+def start() -> None:
+    if _tasks:
+        return
+    _state["stopping"] = False
+    _tasks.append(asyncio.create_task(_flusher()))
+
+
+async def stop() -> None:
+    """Let an in-flight flush finish (cancelled after STOP_TIMEOUT_SEC), then write what is left."""
+    _state["stopping"] = True
+    for t in _tasks:
+        with contextlib.suppress(BaseException):
+            await asyncio.wait_for(t, STOP_TIMEOUT_SEC)
+    _tasks.clear()
+    n = await flush()
+    if n:
+        logger.info(f"[positions] flushed {n} positions on shutdown")
+
+
+def metrics() -> Dict[str, Any]:
+    return {**_stats, "pending": len(_pending), "flush_ms": FLUSH_MS, "batch_size": BATCH_SIZE, "running": bool(_tasks)}
@@ -0,0 +1,94 @@
+import heapq
+from math import asin, cos, radians, sin, sqrt
+from typing import List, Sequence, Tuple
+
+try:
+    import numpy as np
+except Exception:  # pragma: no cover
+    np = None  # type: ignore
+
+# ترتيب المرشحين: قرب المسافة + مكافأة الكابتن غير المشغول + تقييم الأداء (من 5)
+AVG_SPEED_KMH = 25.0
+ETA_FIXED_SEC = 60
+IDLE_BONUS = 0.5
+PERFORMANCE_WEIGHT = 0.2
+EARTH_RADIUS_KM = 6371.0
+
+# (index في المصفوفات المدخلة، المسافة كم، ETA ثوانٍ، السكور)
+Scored = Tuple[int, float, int, float]
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a)))
+
+
+def _score_one(d: float, active: int, perf: float, radius_km: float) -> float:
+    return (
+        max(0.0, 1.0 - d / radius_km)
+        + (IDLE_BONUS if active == 0 else 0.0)
+        + PERFORMANCE_WEIGHT * min(max(perf / 5.0, 0.0), 1.0)
+    )
+
+
+def _eta_sec(d: float) -> int:
+    return int(d / AVG_SPEED_KMH * 3600 + ETA_FIXED_SEC)
+
+
+def _top_k_py(ref_lat, ref_lng, lats, lngs, active_orders, performance, radius_km, k) -> List[Scored]:
+    scored = []
+    for i in range(len(lats)):
+        d = haversine_km(ref_lat, ref_lng, lats[i], lngs[i])
+        if d <= radius_km:
+            scored.append((_score_one(d, active_orders[i], performance[i], radius_km), d, i))
+    best = heapq.nsmallest(k, scored, key=lambda x: (-x[0], x[1]))
+    return [(i, d, _eta_sec(d), s) for s, d, i in best]
+
+
+def _top_k_np(ref_lat, ref_lng, lats, lngs, active_orders, performance, radius_km, k) -> List[Scored]:
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lng = np.radians(np.asarray(lngs, dtype=np.float64))
+    rlat, rlng = radians(ref_lat), radians(ref_lng)
+    a = np.sin((lat - rlat) / 2) ** 2 + cos(rlat) * np.cos(lat) * np.sin((lng - rlng) / 2) ** 2
+    d = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    idx = np.flatnonzero(d <= radius_km)
+    if idx.size == 0:
+        return []
+    d = d[idx]
+    active = np.asarray(active_orders)[idx]
+    perf = np.asarray(performance, dtype=np.float64)[idx]
+    score = (
+        np.maximum(0.0, 1.0 - d / radius_km)
+        + np.where(active == 0, IDLE_BONUS, 0.0)
+        + PERFORMANCE_WEIGHT * np.clip(perf / 5.0, 0.0, 1.0)
+    )
+    if idx.size > k:
+        part = np.argpartition(-score, k - 1)[:k]
+        idx, d, score = idx[part], d[part], score[part]
+    order = np.lexsort((d, -score))
+    eta = (d / AVG_SPEED_KMH * 3600 + ETA_FIXED_SEC).astype(np.int64)
+    return [(int(idx[j]), float(d[j]), int(eta[j]), float(score[j])) for j in order]
+
+
+def top_k(
+    ref_lat: float,
+    ref_lng: float,
+    lats: Sequence[float],
+    lngs: Sequence[float],
+    active_orders: Sequence[int],
+    performance: Sequence[float],
+    radius_km: float,
+    k: int,
+) -> List[Scored]:
+    """Best `k` captains within `radius_km`: [(index, distance_km, eta_sec, score)], best first.
+
+    Distance, ETA and score are computed for the whole batch in one NumPy pass
+    (argpartition for the top-k); without NumPy the same ranking runs in Python.
+    """
+    if k <= 0 or len(lats) == 0:
+        return []
+    fn = _top_k_np if np is not None else _top_k_py
+    return fn(ref_lat, ref_lng, lats, lngs, active_orders, performance, radius_km, k)
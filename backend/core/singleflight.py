@@ -0,0 +1,106 @@
+import asyncio
+import functools
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+# دمج الطلبات المتزامنة المتطابقة داخل العامل: أول نداء ينفّذ الاستعلام والبقية تنتظر نفس النتيجة.
+# النتيجة مشتركة بين المتصلين، فلا يجوز تعديلها.
+
+_registry: Dict[str, "SingleFlight"] = {}
+
+
+def _default_key(args: tuple, kwargs: dict) -> Hashable:
+    return (args, tuple(sorted(kwargs.items()))) if kwargs else args
+
+
+class SingleFlight:
+    def __init__(
+        self,
+        fn: Callable[..., Awaitable[Any]],
+        ttl: float = 0.0,
+        key: Optional[Callable[..., Hashable]] = None,
+        name: Optional[str] = None,
+    ):
+        self.fn = fn
+        self.ttl = ttl
+        self.key = key
+        self.name = name or f"{fn.__module__}.{fn.__qualname__}"
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._cache: Dict[Hashable, Tuple[float, Any]] = {}
+        self._gen = 0
+        # hits: من ذاكرة TTL، shared: انضمّ لنداء جارٍ، misses: نفّذ الدالة فعلاً
+        self.stats = {"hits": 0, "shared": 0, "misses": 0, "errors": 0}
+        functools.update_wrapper(self, fn)
+
+    def _key(self, args: tuple, kwargs: dict) -> Hashable:
+        return self.key(*args, **kwargs) if self.key else _default_key(args, kwargs)
+
+    def _done(self, k: Hashable, gen: int, fut: asyncio.Future) -> None:
+        if self._inflight.get(k) is fut:
+            del self._inflight[k]
+        if fut.cancelled():
+            return
+        if fut.exception() is not None:
+            self.stats["errors"] += 1
+        elif self.ttl > 0 and gen == self._gen:
+            now = time.monotonic()
+            if len(self._cache) > 1024:
+                self._cache = {ck: v for ck, v in self._cache.items() if v[0] > now}
+            self._cache[k] = (now + self.ttl, fut.result())
+
+    async def __call__(self, *args, **kwargs):
+        k = self._key(args, kwargs)
+        if self.ttl > 0:
+            cached = self._cache.get(k)
+            if cached and cached[0] > time.monotonic():
+                self.stats["hits"] += 1
+                return cached[1]
+
+        fut = self._inflight.get(k)
+        if fut is None:
+            self.stats["misses"] += 1
+            fut = asyncio.ensure_future(self.fn(*args, **kwargs))
+            self._inflight[k] = fut
+            fut.add_done_callback(functools.partial(self._done, k, self._gen))
+        else:
+            self.stats["shared"] += 1
+        # shield: إلغاء أحد المنتظرين لا يلغي النتيجة على البقية
+        return await asyncio.shield(fut)
+
+    def forget(self, *args, **kwargs) -> None:
+        """Drop the cached result for these arguments (in-flight calls are unaffected)."""
+        self._cache.pop(self._key(args, kwargs), None)
+
+    def clear(self) -> None:
+        """Invalidate everything: later callers start a fresh call instead of joining
+        one that began before the invalidation, and its result is not cached."""
+        self._gen += 1
+        self._cache.clear()
+        self._inflight.clear()
+
+
+def singleflight(ttl: float = 0.0, key: Optional[Callable[..., Hashable]] = None, name: Optional[str] = None):
+    """Coalesce concurrent identical calls of an async function within this worker.
+
+    `ttl` (seconds) additionally serves the last result for that long;
+    `key(*args, **kwargs)` overrides the default argument-based key.
+    """
+    def deco(fn: Callable[..., Awaitable[Any]]) -> SingleFlight:
+        sf = SingleFlight(fn, ttl=ttl, key=key, name=name)
+        _registry[sf.name] = sf
+        return sf
+    return deco
+
+
+def metrics() -> Dict[str, Dict[str, Any]]:
+    out: Dict[str, Dict[str, Any]] = {}
+    for name, sf in _registry.items():
+        calls = sf.stats["hits"] + sf.stats["shared"] + sf.stats["misses"]
+        out[name] = {
+            **sf.stats,
+            "calls": calls,
+            "hit_ratio": round((calls - sf.stats["misses"]) / calls, 4) if calls else 0.0,
+            "inflight": len(sf._inflight),
+            "ttl": sf.ttl,
+        }
+    return out
@@ -1,5 +1,7 @@
 from typing import Optional
 
+from sqlalchemy import String, case, cast, false, func, literal_column, or_
+
 # status هو مصدر الحقيقة الوحيد للحالة
 VALID = {"pending", "choose_captain", "processing", "out_for_delivery", "delivered", "cancelled", "problem", "deferred", "pickup"}
 
@@ -12,6 +14,20 @@ ALIASES = {
     "pick_up_ready": "processing",
 }
 
+# خريطة current_stage_name إلى substage داخل processing
+SUBSTAGES = {
+    "waiting_approval": "waiting_approval",
+    "waiting_restaurant_acceptance": "waiting_approval",
+    "accepted": "waiting_approval",
+    "preparing": "preparing",
+    "preparation": "preparing",
+    "in_preparation": "preparing",
+    "captain_received": "captain_received",
+    "ready_for_pickup": "captain_received",
+    "ready_for_captain": "captain_received",
+}
+DEFAULT_SUBSTAGE = "waiting_approval"
+
 def normalize_status(status: str | None) -> str:
     """تطبيع الحالة: lowercase, trim, apply aliases."""
     if not status:
@@ -19,31 +35,61 @@ def normalize_status(status: str | None) -> str:
     s = status.strip().lower()
     return ALIASES.get(s, s)
 
+def current_status_of(status: str | None) -> str:
+    """Map a raw status value to its normalized current_status."""
+    normalized = normalize_status((status or "").strip().lower())
+    return normalized if normalized in VALID else "pending"
+
 def compute_current_status(o) -> str:
     """Compute the normalized current_status from the raw status."""
-    s = (getattr(o, "status", "") or "").strip().lower()
-    normalized = normalize_status(s)
-    return normalized if normalized in VALID else "pending"
+    return current_status_of(getattr(o, "status", ""))
+
+def current_status_filter(column, current: str):
+    """SQL predicate equivalent to `compute_current_status(o) == current`.
+
+    The raw values are taken from the column's enum domain so the predicate
+    stays a plain equality/IN on the indexed column.
+    """
+    domain = getattr(column.type, "enums", None) or sorted(VALID | set(ALIASES))
+    raw = [v for v in domain if current_status_of(v) == current]
+    if not raw:
+        clause = false()
+    elif len(raw) == 1:
+        clause = column == raw[0]
+    else:
+        clause = column.in_(raw)
+    if getattr(column, "nullable", True) and current_status_of(None) == current:
+        clause = or_(clause, column.is_(None))
+    return clause
 
 def compute_substage(o) -> Optional[str]:
     """Compute substage for processing orders. Returns None for non-processing orders."""
     if compute_current_status(o) != "processing":
         return None
-    
+
     # للطلبات في حالة processing، نرجع substage بناءً على current_stage_name
-    stage_name = getattr(o, "current_stage_name", "").strip().lower()
-    
-    # إذا لم يكن هناك current_stage_name، نرجع waiting_approval كافتراضي
-    if not stage_name:
-        return "waiting_approval"
-    
-    # تحديد substage بناءً على current_stage_name
-    if stage_name in ["waiting_approval", "waiting_restaurant_acceptance", "accepted"]:
-        return "waiting_approval"
-    elif stage_name in ["preparing", "preparation", "in_preparation"]:
-        return "preparing"
-    elif stage_name in ["captain_received", "ready_for_pickup", "ready_for_captain"]:
-        return "captain_received"
-    else:
-        # افتراضي: انتظار الموافقة
-        return "waiting_approval"
+    # (الافتراضي: انتظار الموافقة)
+    stage_name = (getattr(o, "current_stage_name", None) or "").strip().lower()
+    return SUBSTAGES.get(stage_name, DEFAULT_SUBSTAGE)
+
+def sql_str(value: str):
+    """Inline SQL string literal for internal constants (never user input)."""
+    # تُضمَّن حرفياً كي تتطابق التعابير بين SELECT و GROUP BY
+    return literal_column("'%s'" % value.replace("'", "''"))
+
+def current_status_sql(column):
+    """SQL counterpart of current_status_of(), usable in SELECT/GROUP BY."""
+    v = func.lower(func.trim(cast(column, String)))
+    whens = [(v == sql_str(alias), sql_str(target)) for alias, target in ALIASES.items()]
+    whens.append((v.in_([sql_str(x) for x in sorted(VALID)]), v))
+    return case(*whens, else_=sql_str("pending"))
+
+def substage_sql(status_column, stage_column):
+    """SQL counterpart of compute_substage(); NULL outside processing."""
+    stage = func.lower(func.trim(func.coalesce(stage_column, sql_str(""))))
+    whens = [(stage == sql_str(name), sql_str(sub)) for name, sub in SUBSTAGES.items()]
+    return case(
+        (current_status_sql(status_column) != sql_str("processing"), None),
+        *whens,
+        else_=sql_str(DEFAULT_SUBSTAGE),
+    )
@@ -0,0 +1,224 @@
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+from sqlalchemy import select, func, text as sa_text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core import maintenance
+from core.db import AsyncSessionLocal
+from core.redis import get_redis
+from core.singleflight import singleflight
+from core.status import VALID, current_status_sql, substage_sql
+from models.order import Order
+from models.order_status_counter import OrderStatusCounter
+
+# لقطة قصيرة العمر للعدادات: ذاكرة العامل أولاً ثم Redis (مشتركة بين العمال) ثم قاعدة البيانات
+LOCAL_TTL_SEC = float(os.getenv("STATUS_COUNTS_LOCAL_TTL", "1.0"))
+REDIS_TTL_SEC = float(os.getenv("STATUS_COUNTS_REDIS_TTL", "5.0"))
+REDIS_KEY = "orders:status_counts"
+# جيل اللقطة: كل إبطال يزيده، واللقطة تُخزَّن تحت الجيل الذي قُرئ قبل حسابها (REDIS_KEY:<gen>)،
+# فحساب بدأ قبل الإبطال يكتب في مفتاح لم يعد أحد يقرؤه بدل إعادة لقطة قديمة لكل العمال
+REDIS_GEN_KEY = "orders:status_counts:gen"
+RECONCILE_INTERVAL_SEC = float(os.getenv("STATUS_COUNTERS_RECONCILE_SEC", "300"))
+RECONCILE_JOB = "status_counters_reconcile"
+
+# مفردات التبويبات: current_status → اسم التبويب. المشغّل يرى الحالات كما هي،
+# ولوحة الإدارة تسمّي choose_captain/problem باسمي assign/issue وتضم الباقي إلى pending
+OPERATOR_TABS: Dict[str, str] = {s: s for s in VALID}
+ADMIN_TABS: Dict[str, str] = {
+    "pending": "pending",
+    "choose_captain": "assign",
+    "processing": "processing",
+    "out_for_delivery": "out_for_delivery",
+    "delivered": "delivered",
+    "cancelled": "cancelled",
+    "problem": "issue",
+    "deferred": "pending",
+    "pickup": "pending",
+}
+
+_counters_table: Optional[bool] = None
+
+
+async def _has_counters_table(session: AsyncSession) -> bool:
+    """Whether migration 011 (order_status_counters) is applied; checked once per worker."""
+    global _counters_table
+    if _counters_table is None:
+        _counters_table = bool((await session.execute(
+            sa_text("SELECT to_regclass('order_status_counters') IS NOT NULL")
+        )).scalar())
+    return _counters_table
+
+
+async def _compute(session: AsyncSession) -> Dict[str, Dict[str, int]]:
+    """Read the trigger-maintained counters (a handful of rows) and normalize them in SQL.
+
+    Falls back to one GROUP BY over orders when the counters table is missing.
+    """
+    if await _has_counters_table(session):
+        raw = (
+            select(
+                OrderStatusCounter.status.label("status"),
+                OrderStatusCounter.stage.label("stage"),
+                func.sum(OrderStatusCounter.cnt).label("n"),
+            )
+            .group_by(OrderStatusCounter.status, OrderStatusCounter.stage)
+            .subquery()
+        )
+    else:
+        raw = (
+            select(
+                Order.status.label("status"),
+                Order.current_stage_name.label("stage"),
+                func.count().label("n"),
+            )
+            .group_by(Order.status, Order.current_stage_name)
+            .subquery()
+        )
+    cs = current_status_sql(raw.c.status).label("cs")
+    sub = substage_sql(raw.c.status, raw.c.stage).label("sub")
+    rows = (await session.execute(select(cs, sub, func.sum(raw.c.n)).group_by(cs, sub))).all()
+
+    statuses: Dict[str, int] = {k: 0 for k in VALID}
+    substages: Dict[str, int] = {}
+    for status, substage, n in rows:
+        statuses[status] = statuses.get(status, 0) + int(n)
+        if substage:
+            substages[substage] = substages.get(substage, 0) + int(n)
+    return {"statuses": statuses, "substages": substages}
+
+
+@singleflight(ttl=LOCAL_TTL_SEC, name="status_counts")
+async def _load_snapshot() -> Dict[str, Dict[str, int]]:
+    r = None
+    key = REDIS_KEY
+    try:
+        r = await get_redis()
+        if r:
+            gen = await r.get(REDIS_GEN_KEY)
+            key = f"{REDIS_KEY}:{int(gen or 0)}"
+            cached = await r.get(key)
+            if cached:
+                return json.loads(cached)
+    except Exception:
+        r = None
+
+    async with AsyncSessionLocal() as session:
+        snap = await _compute(session)
+    if r:
+        try:
+            await r.set(key, json.dumps(snap), px=int(REDIS_TTL_SEC * 1000))
+        except Exception:
+            pass
+    return snap
+
+
+async def get_status_counts(
+    session: Optional[AsyncSession] = None, fresh: bool = False
+) -> Dict[str, Dict[str, int]]:
+    """Return {"statuses": {...}, "substages": {...}} from the freshest available snapshot.
+
+    Concurrent callers that miss the snapshot share one load (single-flight),
+    so a burst of dashboard refreshes costs one Redis/DB round trip per worker.
+    `fresh=True` skips the snapshot and reads the counters through `session`.
+    """
+    if fresh:
+        if session is None:
+            async with AsyncSessionLocal() as own:
+                return await _compute(own)
+        return await _compute(session)
+    return await _load_snapshot()
+
+
+def project(statuses: Dict[str, int], tabs: Dict[str, str]) -> Dict[str, int]:
+    """Fold current_status counts into a tab vocabulary (OPERATOR_TABS / ADMIN_TABS)."""
+    out: Dict[str, int] = {tab: 0 for tab in tabs.values()}
+    for status, n in statuses.items():
+        tab = tabs.get(status)
+        if tab is not None:
+            out[tab] += n
+    return out
+
+
+async def operator_tab_counts(substages: bool = False) -> Dict[str, int]:
+    snap = await get_status_counts()
+    out = project(snap["statuses"], OPERATOR_TABS)
+    if substages:
+        out.update({f"processing.{k}": v for k, v in snap["substages"].items()})
+    return out
+
+
+async def admin_tab_counts() -> Dict[str, int]:
+    snap = await get_status_counts()
+    return project(snap["statuses"], ADMIN_TABS)
+
+
+async def invalidate_status_counts() -> None:
+    """Drop the snapshot after a status change (other workers expire within LOCAL_TTL_SEC).
+
+    Bumping the generation also orphans a snapshot still being computed from
+    counters read before the change.
+    """
+    _load_snapshot.clear()
+    try:
+        r = await get_redis()
+        if r:
+            await r.incr(REDIS_GEN_KEY)
+    except Exception:
+        pass
+
+
+# الانحراف = العدّ الفعلي - العدّاد، محسوباً في استعلام واحد (لقطة واحدة) كي تكون المقارنة متسقة
+_DRIFT_SQL = sa_text(
+    """
+WITH actual AS (
+  SELECT COALESCE(status::text, 'pending') AS status, COALESCE(current_stage_name, '') AS stage, COUNT(*) AS n
+  FROM orders
+  GROUP BY 1, 2
+), tracked AS (
+  SELECT status, stage, SUM(cnt) AS n
+  FROM order_status_counters
+  GROUP BY 1, 2
+)
+SELECT COALESCE(a.status, t.status) AS status,
+       COALESCE(a.stage, t.stage) AS stage,
+       COALESCE(a.n, 0) - COALESCE(t.n, 0) AS delta
+FROM actual a
+FULL OUTER JOIN tracked t ON a.status = t.status AND a.stage = t.stage
+WHERE COALESCE(a.n, 0) <> COALESCE(t.n, 0)
+    """
+)
+
+_REPAIR_SQL = sa_text(
+    """
+INSERT INTO order_status_counters(status, stage, slot, cnt)
+VALUES (:status, :stage, 0, :delta)
+ON CONFLICT (status, stage, slot) DO UPDATE SET cnt = order_status_counters.cnt + EXCLUDED.cnt
+    """
+)
+
+
+async def reconcile_status_counters(session: AsyncSession, repair: bool = True) -> List[Dict[str, Any]]:
+    """Compare order_status_counters with a full count and optionally add the missing deltas.
+
+    Repairs are additive, so writes that commit while this runs are not lost.
+    The caller owns the transaction.
+    """
+    rows = (await session.execute(_DRIFT_SQL)).all()
+    drift = [{"status": st, "stage": stage, "delta": int(delta)} for st, stage, delta in rows]
+    if repair and drift:
+        await session.execute(_REPAIR_SQL, drift)
+    return drift
+
+
+@maintenance.periodic(RECONCILE_JOB, RECONCILE_INTERVAL_SEC)
+async def reconcile_job(session: AsyncSession) -> List[Dict[str, Any]]:
+    if not await _has_counters_table(session):
+        return []
+    drift = await reconcile_status_counters(session, repair=True)
+    if drift:
+        logger.warning(f"[status_counters] repaired drift: {drift}")
+        await invalidate_status_counts()
+    return drift
@@ -0,0 +1,81 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Sequence
+
+from fastapi import Request, Response
+from sqlalchemy import text as sa_text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.asyncio import AsyncSession
+
+try:
+    import msgpack
+except Exception:  # pragma: no cover
+    msgpack = None  # type: ignore
+
+# الخط الزمني للطلبات من order_events: استعلام واحد لأي عدد من الطلبات (فهرس order_id, created_at من migration 016)،
+# ETag من (عدد الأحداث، آخر id) لكل طلب لأن الجدول إلحاقي فقط، وترميز msgpack اختياري مع رجوع إلى JSON.
+MAX_BATCH = 500
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# LEFT JOIN على orders: طلب بلا أحداث يعود بصف واحد فارغ، والطلب غير الموجود لا يعود إطلاقاً
+_TIMELINE_SQL = sa_text(
+    """
+SELECT o.order_id, e.id, e.event_type, e.payload, e.created_at
+FROM orders o
+LEFT JOIN order_events e ON e.order_id = o.order_id
+WHERE o.order_id = ANY(CAST(:ids AS int[]))
+ORDER BY o.order_id, e.created_at, e.id
+    """
+).columns(payload=JSONB)
+
+
+async def load(session: AsyncSession, order_ids: Sequence[int]) -> Dict[int, List[Dict[str, Any]]]:
+    """{order_id: [events oldest first]} for the orders that exist."""
+    out: Dict[int, List[Dict[str, Any]]] = {}
+    rows = (await session.execute(_TIMELINE_SQL, {"ids": list(order_ids)})).all()
+    for oid, eid, event_type, payload, created_at in rows:
+        events = out.setdefault(oid, [])
+        if eid is not None:
+            events.append({
+                "id": eid,
+                "event_type": event_type,
+                "payload": payload,
+                "created_at": created_at.isoformat() if created_at else None,
+            })
+    return out
+
+
+def etag(timelines: Dict[int, List[Dict[str, Any]]]) -> str:
+    sig = ";".join(
+        f"{oid}:{len(ev)}:{ev[-1]['id'] if ev else 0}" for oid, ev in sorted(timelines.items())
+    )
+    return 'W/"' + hashlib.sha1(sig.encode()).hexdigest()[:20] + '"'
+
+
+def _wants_msgpack(request: Request, fmt: Optional[str]) -> bool:
+    if fmt:
+        return fmt == "msgpack"
+    accept = request.headers.get("accept", "")
+    return any(t in accept for t in MSGPACK_TYPES)
+
+
+def _not_modified(request: Request, tag: str) -> bool:
+    inm = request.headers.get("if-none-match")
+    if not inm:
+        return False
+    tags = {t.strip() for t in inm.split(",")}
+    return "*" in tags or tag in tags or tag[2:] in tags
+
+
+def respond(request: Request, body: Any, tag: str, fmt: Optional[str] = None) -> Response:
+    """304 when If-None-Match matches, msgpack when asked for (and installed), JSON otherwise."""
+    headers = {"ETag": tag, "Vary": "Accept", "Cache-Control": "private, no-cache"}
+    if _not_modified(request, tag):
+        return Response(status_code=304, headers=headers)
+    if msgpack is not None and _wants_msgpack(request, fmt):
+        return Response(msgpack.packb(body, use_bin_type=True), media_type=MSGPACK_TYPES[0], headers=headers)
+    return Response(
+        json.dumps(body, ensure_ascii=False, separators=(",", ":")),
+        media_type="application/json",
+        headers=headers,
+    )
@@ -0,0 +1,130 @@
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, case, cast, false
+
+from core.status import (
+    ALIASES,
+    DEFAULT_SUBSTAGE,
+    SUBSTAGES,
+    VALID,
+    current_status_of,
+    current_status_sql,
+    sql_str,
+    substage_sql,
+)
+
+# آلة حالات الطلب: كل القواعد هنا، وتُترجم مرة واحدة إلى جداول بحث (dict) وإلى CASE في SQL.
+# الحالة = (current_status, substage أو None، is_deferred). stage=None في الهدف يعني إبقاء current_stage_name كما هو.
+State = Tuple[str, Optional[str]]
+
+NEXT_RULES: List[Tuple[Tuple[str, Optional[str], Optional[bool]], State]] = [
+    (("pending", None, True), ("processing", "waiting_approval")),
+    (("pending", None, False), ("choose_captain", None)),
+    (("choose_captain", None, None), ("processing", "waiting_approval")),
+    (("processing", "waiting_approval", None), ("processing", "preparing")),
+    (("processing", "preparing", None), ("processing", "captain_received")),
+    (("processing", "captain_received", None), ("out_for_delivery", None)),
+    (("out_for_delivery", None, None), ("delivered", None)),
+]
+
+# أي حالة يمكن إلغاؤها أو تحويلها إلى problem (عدا الحالة نفسها)،
+# ومن problem يمكن الحل إلى أي حالة أخرى
+TERMINAL_TARGETS = ("cancelled", "problem")
+RESOLVE_FROM = "problem"
+
+_PROCESSING_SUBSTAGES = tuple(dict.fromkeys(SUBSTAGES.values()))
+
+
+class TransitionTable:
+    """Order state machine compiled into dict lookups plus matching SQL expressions."""
+
+    def __init__(self, next_rules, terminal_targets: Iterable[str], resolve_from: str):
+        self.rules = list(next_rules)
+        self.resolve_from = resolve_from
+        # كل صيغة خام (حالة أو alias) → current_status؛ غير ذلك يمرّ عبر التطبيع الكامل
+        self._status: Dict[Optional[str], str] = {s: s for s in VALID}
+        self._status.update(ALIASES)
+        self._status[None] = current_status_of(None)
+        self._stage: Dict[Optional[str], str] = dict(SUBSTAGES)
+        self._stage[None] = self._stage[""] = DEFAULT_SUBSTAGE
+
+        self._next: Dict[Tuple[str, Optional[str], bool], State] = {}
+        for (status, sub, deferred), target in self.rules:
+            subs = _PROCESSING_SUBSTAGES if status == "processing" and sub is None else (sub,)
+            flags = (True, False) if deferred is None else (deferred,)
+            for sb in subs:
+                for flag in flags:
+                    self._next.setdefault((status, sb, flag), target)
+
+        targets: Dict[str, FrozenSet[str]] = {}
+        for status in VALID:
+            allowed = {t[0] for k, t in self._next.items() if k[0] == status}
+            allowed.update(terminal_targets)
+            if status == resolve_from:
+                allowed.update(VALID)
+            allowed.discard(status)
+            targets[status] = frozenset(allowed)
+        self._targets = targets
+        self.advanceable = frozenset(k[0] for k in self._next)
+
+    # ---- بحث O(1) ----
+    def status(self, raw: Optional[str]) -> str:
+        """current_status of a raw status/alias value."""
+        try:
+            return self._status[raw]
+        except KeyError:
+            return current_status_of(raw)
+
+    def substage(self, status: str, stage: Optional[str]) -> Optional[str]:
+        if status != "processing":
+            return None
+        try:
+            return self._stage[stage]
+        except KeyError:
+            return SUBSTAGES.get((stage or "").strip().lower(), DEFAULT_SUBSTAGE)
+
+    def next(self, status: Optional[str], stage: Optional[str] = None, deferred: bool = False) -> Optional[State]:
+        """(status, stage) after "next", or None when the order cannot advance.
+
+        A None stage in the result means current_stage_name stays as it is.
+        """
+        cs = self.status(status)
+        return self._next.get((cs, self.substage(cs, stage), bool(deferred)))
+
+    def can_transition(self, status: Optional[str], target: str) -> bool:
+        return target in self._targets.get(self.status(status), ())
+
+    def sources(self, target: str) -> List[str]:
+        """current_status values from which `target` is reachable."""
+        return sorted(s for s, allowed in self._targets.items() if target in allowed)
+
+    # ---- SQL ----
+    def status_in_sql(self, column, statuses: Iterable[str]):
+        """Index-friendly `current_status IN (...)` as a plain IN over the raw enum values."""
+        wanted = set(statuses)
+        domain = getattr(column.type, "enums", None) or sorted(VALID | set(ALIASES))
+        raw = [v for v in domain if self.status(v) in wanted]
+        return column.in_(raw) if raw else false()
+
+    def next_sql(self, status_col, stage_col, deferred_col) -> Tuple[object, object, object]:
+        """(guard, new_status, new_stage) SQL expressions for "next" generated from the rules."""
+        cs = current_status_sql(status_col)
+        sub = substage_sql(status_col, stage_col)
+        status_whens, stage_whens = [], []
+        for (status, substage, deferred), (to_status, to_stage) in self.rules:
+            cond = [cs == sql_str(status)]
+            if substage is not None:
+                cond.append(sub == sql_str(substage))
+            if deferred is not None:
+                cond.append(deferred_col.is_(True) if deferred else deferred_col.is_not(True))
+            cond = and_(*cond)
+            status_whens.append((cond, sql_str(to_status)))
+            if to_stage is not None:
+                stage_whens.append((cond, sql_str(to_stage)))
+        guard = self.status_in_sql(status_col, self.advanceable)
+        new_status = cast(case(*status_whens, else_=cs), status_col.type)
+        new_stage = case(*stage_whens, else_=stage_col)
+        return guard, new_status, new_stage
+
+
+TRANSITIONS = TransitionTable(NEXT_RULES, TERMINAL_TARGETS, RESOLVE_FROM)
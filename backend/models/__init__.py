@@ -9,8 +9,10 @@ from .order import Order
 from .captain import Captain
 from .note import Note
 from .rating import Rating
+from .order_status_counter import OrderStatusCounter
+from .captain_active_orders import CaptainActiveOrders
 
 # تصدير النماذج للاستخدام الخارجي
-__all__ = ['Base', 'Customer', 'Restaurant', 'Order', 'Captain', 'Note', 'Rating']
+__all__ = ['Base', 'Customer', 'Restaurant', 'Order', 'Captain', 'Note', 'Rating', 'OrderStatusCounter', 'CaptainActiveOrders']
 
 
@@ -0,0 +1,10 @@
+from . import Base
+from sqlalchemy import Column, Integer
+
+
+class CaptainActiveOrders(Base):
+    __tablename__ = "captain_active_orders"
+
+    # يحدّثه التريغر orders_captain_active: عدد طلبات الكابتن في choose_captain/processing/out_for_delivery
+    captain_id = Column(Integer, primary_key=True)
+    active_orders = Column(Integer, nullable=False, default=0)
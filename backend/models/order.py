@@ -11,7 +11,7 @@ class Order(Base):
     restaurant_id = Column(Integer, ForeignKey("restaurants.restaurant_id"))
     captain_id = Column(Integer, ForeignKey("captains.captain_id"))
 
-    status = Column(Enum('pending', 'choose_captain', 'processing', 'out_for_delivery', 'delivered', 'cancelled', 'problem', 'deferred', 'pickup', name='order_status_enum'), default="pending")
+    status = Column(Enum('pending', 'choose_captain', 'processing', 'out_for_delivery', 'delivered', 'cancelled', 'problem', 'deferred', 'pickup', name='order_status_enum'), default="pending", nullable=False)
     current_stage_name = Column(String(50))
     payment_method = Column(Enum('cash', 'card', 'mobile_payment', 'online', name='payment_method_enum'), default='cash')
     delivery_method = Column(Enum('standard', 'express', 'scheduled', 'pick_up', name='delivery_method_enum'), default='standard')
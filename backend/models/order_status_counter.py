@@ -0,0 +1,13 @@
+from . import Base
+from sqlalchemy import Column, String, SmallInteger, BigInteger
+
+
+class OrderStatusCounter(Base):
+    __tablename__ = "order_status_counters"
+
+    # يحدّثه التريغر orders_status_counters؛ كل (status, stage) موزّع على عدة slots
+    # لتجنّب صفاً ساخناً واحداً، والقراءة تجمع SUM عبرها
+    status = Column(String(32), primary_key=True)
+    stage = Column(String(50), primary_key=True, default='')
+    slot = Column(SmallInteger, primary_key=True, default=0)
+    cnt = Column(BigInteger, nullable=False, default=0)
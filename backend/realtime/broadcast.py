@@ -0,0 +1,278 @@
+import asyncio
+import contextlib
+import json
+import os
+import time
+from math import cos, radians, sqrt
+from typing import Any, Callable, Dict, List, Mapping, Optional, Set, Tuple
+
+from core import captain_index
+
+# سياسة بث المواقع لكل اتصال: أقل مسافة تستحق الإرسال، أقل فاصل لكل كابتن، وأقصى معدل رسائل/إطارات.
+# الموقع الذي لم يتحرك (أو تحرك أقل من min_distance_m) لا يُرسل أبداً. لوحات المتابعة (/ws/positions)
+# تستقبل إطاراً واحداً يجمع كل الكباتن المتغيرين بدل رسالة لكل كابتن، من مهمة واحدة تدق كل TICK_SEC.
+M_PER_DEG = 111_320.0
+TICK_SEC = float(os.getenv("WS_FEED_TICK_SEC", "0.1"))
+
+
+def _env(name: str, default: str) -> float:
+    return float(os.getenv(name, default))
+
+
+class BroadcastPolicy:
+    """min_distance_m / min_interval_ms per captain and max_rate messages (or frames) per second; 0 = no limit."""
+
+    __slots__ = ("min_distance_m", "min_interval_sec", "max_rate")
+
+    def __init__(self, min_distance_m: float = 0.0, min_interval_ms: float = 0.0, max_rate: float = 0.0):
+        self.min_distance_m = max(0.0, float(min_distance_m))
+        self.min_interval_sec = max(0.0, float(min_interval_ms)) / 1000
+        self.max_rate = max(0.0, float(max_rate))
+
+    def override(self, params: Mapping[str, Any]) -> "BroadcastPolicy":
+        """A copy with min_distance_m / min_interval_ms / max_rate taken from query parameters when valid."""
+        def num(name: str, default: float) -> float:
+            try:
+                return float(params[name])
+            except (KeyError, TypeError, ValueError):
+                return default
+        return BroadcastPolicy(
+            num("min_distance_m", self.min_distance_m),
+            num("min_interval_ms", self.min_interval_sec * 1000),
+            num("max_rate", self.max_rate),
+        )
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "min_distance_m": self.min_distance_m,
+            "min_interval_ms": self.min_interval_sec * 1000,
+            "max_rate": self.max_rate,
+        }
+
+
+# مقبس الكابتن: موقعه هو فقط؛ لوحات المتابعة: كل الكباتن، فالحدود أشد افتراضياً
+CAPTAIN_POLICY = BroadcastPolicy(
+    _env("WS_POS_MIN_DISTANCE_M", "5"), _env("WS_POS_MIN_INTERVAL_MS", "0"), _env("WS_POS_MAX_RATE", "5")
+)
+FEED_POLICY = BroadcastPolicy(
+    _env("WS_FEED_MIN_DISTANCE_M", "10"), _env("WS_FEED_MIN_INTERVAL_MS", "1000"), _env("WS_FEED_MAX_RATE", "1")
+)
+
+SEND, SKIP, LATER = 0, 1, 2
+
+
+def distance_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Equirectangular distance; exact enough for the few metres a throttle compares."""
+    dy = (lat2 - lat1) * M_PER_DEG
+    dx = (lng2 - lng1) * M_PER_DEG * cos(radians(lat1))
+    return sqrt(dx * dx + dy * dy)
+
+
+class PositionFilter:
+    """Per-connection memory of the last position sent for each captain, plus a token bucket for max_rate."""
+
+    __slots__ = ("policy", "last", "tokens", "refill_at", "sent", "suppressed")
+
+    def __init__(self, policy: BroadcastPolicy):
+        self.policy = policy
+        self.last: Dict[int, Tuple[float, float, float]] = {}
+        self.tokens = max(policy.max_rate, 1.0)
+        self.refill_at = time.monotonic()
+        self.sent = 0
+        self.suppressed = 0
+
+    def check(self, captain_id: int, lat: float, lng: float, now: float) -> int:
+        """SEND (and remember it), SKIP for a no-op/too small move, LATER when the captain is not due yet."""
+        prev = self.last.get(captain_id)
+        if prev is not None:
+            d = distance_m(prev[0], prev[1], lat, lng)
+            if d == 0.0 or d < self.policy.min_distance_m:
+                self.suppressed += 1
+                return SKIP
+            if now - prev[2] < self.policy.min_interval_sec:
+                return LATER
+        self.last[captain_id] = (lat, lng, now)
+        return SEND
+
+    def ready(self, now: float) -> bool:
+        """Whether max_rate leaves budget for one more message/frame (spent with take())."""
+        rate = self.policy.max_rate
+        if rate <= 0:
+            return True
+        self.tokens = min(max(rate, 1.0), self.tokens + max(0.0, now - self.refill_at) * rate)
+        self.refill_at = now
+        return self.tokens >= 1.0
+
+    def take(self) -> None:
+        if self.policy.max_rate > 0:
+            self.tokens -= 1.0
+        self.sent += 1
+
+
+# (south, west, north, east)
+BBox = Tuple[float, float, float, float]
+
+
+def parse_bbox(value: Any) -> Optional[BBox]:
+    """[south, west, north, east] (list or "s,w,n,e") → BBox; None when missing or invalid."""
+    if isinstance(value, str):
+        value = value.split(",")
+    try:
+        s, w, n, e = (float(v) for v in value)
+    except (TypeError, ValueError):
+        return None
+    if not (-90.0 <= s <= n <= 90.0 and -180.0 <= w <= e <= 180.0):
+        return None
+    return s, w, n, e
+
+
+def _inside(bbox: BBox, lat: float, lng: float) -> bool:
+    return bbox[0] <= lat <= bbox[2] and bbox[1] <= lng <= bbox[3]
+
+
+class _Subscriber:
+    __slots__ = ("send", "filter", "bbox", "pending", "frames", "items")
+
+    def __init__(self, send: Callable[[Dict[str, Any]], Any], policy: BroadcastPolicy, bbox: Optional[BBox]):
+        self.send = send
+        self.filter = PositionFilter(policy)
+        self.bbox = bbox
+        self.pending: Set[int] = set()
+        self.frames = 0
+        self.items = 0
+
+
+class PositionFeed:
+    """Captain moves from core.captain_index fanned out to subscribers as batched, throttled frames."""
+
+    def __init__(self, tick_sec: float = TICK_SEC):
+        self.tick_sec = tick_sec
+        self._subs: Dict[Any, _Subscriber] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"moves": 0, "ticks": 0, "frames": 0, "items": 0, "suppressed": 0}
+
+    def moved(self, captain_id: int) -> None:
+        self.stats["moves"] += 1
+        for s in self._subs.values():
+            s.pending.add(captain_id)
+
+    def subscribe(
+        self, key: Any, send: Callable[[Dict[str, Any]], Any], policy: BroadcastPolicy, bbox: Optional[BBox] = None
+    ) -> None:
+        """Register `send(frame)`; the first frame is a snapshot of every known captain (inside `bbox` if given)."""
+        s = _Subscriber(send, policy, bbox)
+        s.pending = self._visible(bbox)
+        self._subs[key] = s
+        self._wake.set()
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._subs
+
+    def set_bbox(self, key: Any, bbox: Optional[BBox]) -> None:
+        """Move a subscriber's viewport: captains now inside are sent, those that left come back as `removed`."""
+        s = self._subs.get(key)
+        if s is None:
+            return
+        s.bbox = bbox
+        s.pending |= self._visible(bbox) | set(s.filter.last)
+
+    @staticmethod
+    def _visible(bbox: Optional[BBox]) -> Set[int]:
+        if bbox is None:
+            return {cid for cid, _, _ in captain_index.INDEX.positions()}
+        return {cid for cid, lat, lng in captain_index.INDEX.positions() if _inside(bbox, lat, lng)}
+
+    def set_policy(self, key: Any, policy: BroadcastPolicy) -> None:
+        s = self._subs.get(key)
+        if s is not None:
+            s.filter.policy = policy
+
+    def unsubscribe(self, key: Any) -> None:
+        s = self._subs.pop(key, None)
+        if s is not None:
+            self.stats["suppressed"] += s.filter.suppressed
+
+    def _frame(self, s: _Subscriber, now: float) -> Tuple[List[List[float]], List[int]]:
+        items: List[List[float]] = []
+        removed: List[int] = []
+        later: Set[int] = set()
+        position, check, shown, bbox = captain_index.INDEX.position, s.filter.check, s.filter.last, s.bbox
+        for cid in s.pending:
+            pos = position(cid)
+            if pos is None or (bbox is not None and not _inside(bbox, pos[0], pos[1])):
+                # خرج من نطاق العرض (أو من الفهرس): يُبلّغ مرة واحدة ثم يُنسى
+                if shown.pop(cid, None) is not None:
+                    removed.append(cid)
+                continue
+            verdict = check(cid, pos[0], pos[1], now)
+            if verdict == SEND:
+                items.append([cid, round(pos[0], 6), round(pos[1], 6)])
+            elif verdict == LATER:
+                # لا يُسقط: آخر موقع لكابتن توقف بعد حركة قصيرة يجب أن يصل في إطار لاحق
+                later.add(cid)
+        s.pending = later
+        return items, removed
+
+    def tick(self, now: Optional[float] = None) -> int:
+        """Send one frame to every subscriber that has changes and rate budget; returns frames sent."""
+        now = time.monotonic() if now is None else now
+        self.stats["ticks"] += 1
+        sent = 0
+        for s in list(self._subs.values()):
+            if not s.pending or not s.filter.ready(now):
+                continue
+            items, removed = self._frame(s, now)
+            if not items and not removed:
+                continue
+            s.filter.take()
+            frame: Dict[str, Any] = {"type": "positions", "items": items}
+            if removed:
+                frame["removed"] = removed
+            s.send(frame)
+            s.frames += 1
+            s.items += len(items)
+            sent += 1
+            self.stats["items"] += len(items)
+        self.stats["frames"] += sent
+        return sent
+
+    async def _run(self) -> None:
+        while True:
+            if not self._subs:
+                # لا مشتركين = لا استيقاظ
+                self._wake.clear()
+                await self._wake.wait()
+            await asyncio.sleep(self.tick_sec)
+            self.tick()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(BaseException):
+                await self._task
+        self._task = None
+
+    def metrics(self) -> Dict[str, Any]:
+        subs = list(self._subs.values())
+        return {
+            **self.stats,
+            "suppressed": self.stats["suppressed"] + sum(s.filter.suppressed for s in subs),
+            "subscribers": len(subs),
+            "pending": sum(len(s.pending) for s in subs),
+            "viewports": sum(1 for s in subs if s.bbox is not None),
+            "tick_sec": self.tick_sec,
+            "default_policy": FEED_POLICY.to_dict(),
+        }
+
+
+def encode(frame: Dict[str, Any]) -> str:
+    return json.dumps(frame, separators=(",", ":"))
+
+
+feed = PositionFeed()
+captain_index.on_move(feed.moved)
@@ -0,0 +1,196 @@
+import asyncio
+import collections
+import contextlib
+import json
+import os
+import time
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from fastapi import WebSocket
+from loguru import logger
+
+from realtime.broadcast import SEND, PositionFilter
+
+# كل WebSocket له طابور إرسال محدود ومهمة كتابة خاصة به، فالمقبس البطيء لا يؤخر البقية.
+# الرسالة تُسلسل مرة واحدة وتُشارك كنص بين كل المقابس. عند امتلاء الطابور تُحذف أقدم رسالة pos
+# (الموقع الأحدث يغني عنها)؛ وإن لم يكن فيه pos تُسقط pos الجديدة، أما رسائل التحكم فتغلق المقبس العالق.
+SEND_QUEUE_MAX = int(os.getenv("WS_SEND_QUEUE_MAX", "256"))
+SEND_TIMEOUT_SEC = float(os.getenv("WS_SEND_TIMEOUT_SEC", "10"))
+DROPPABLE_TYPES = frozenset({"pos"})
+
+Item = Tuple[str, bool]
+
+
+class Connection:
+    """One socket: bounded outbound queue drained by its own writer task."""
+
+    __slots__ = ("ws", "queue", "wakeup", "task", "closed", "sent", "dropped", "max_depth", "filter", "_on_close")
+
+    def __init__(self, ws: WebSocket, on_close=None):
+        self.ws = ws
+        self.queue: Deque[Item] = collections.deque()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+        # سياسة بث المواقع لهذا المقبس (realtime.broadcast)؛ None = كل رسالة pos تُرسل
+        self.filter: Optional[PositionFilter] = None
+        self._on_close = on_close
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self._writer())
+
+    def put(self, text: str, droppable: bool) -> bool:
+        """Queue a serialized message; False when it (or the connection) had to be dropped."""
+        if self.closed:
+            return False
+        if len(self.queue) >= SEND_QUEUE_MAX:
+            for i, (_, d) in enumerate(self.queue):
+                if d:
+                    del self.queue[i]
+                    self.dropped += 1
+                    break
+            else:
+                if droppable:
+                    self.dropped += 1
+                    return False
+                logger.warning("[ws] send queue full of control messages, closing slow socket")
+                self.close()
+                return False
+        self.queue.append((text, droppable))
+        if len(self.queue) > self.max_depth:
+            self.max_depth = len(self.queue)
+        self.wakeup.set()
+        return True
+
+    async def _writer(self) -> None:
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.queue:
+                    text, _ = self.queue.popleft()
+                    await asyncio.wait_for(self.ws.send_text(text), SEND_TIMEOUT_SEC)
+                    self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.close()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        if self.task and self.task is not asyncio.current_task():
+            self.task.cancel()
+        if self._on_close:
+            self._on_close(self)
+
+
+class ConnectionManager:
+    def __init__(self):
+        self.active: Dict[int, Dict[WebSocket, Connection]] = {}
+        self.stats = {"messages": 0, "enqueued": 0, "dropped": 0, "closed_slow": 0, "pos_suppressed": 0}
+
+    async def connect(self, captain_id: int, websocket: WebSocket) -> Connection:
+        await websocket.accept()
+        conn = Connection(websocket, on_close=lambda c: self._closed(captain_id, c))
+        self.active.setdefault(captain_id, {})[websocket] = conn
+        conn.start()
+        return conn
+
+    def _closed(self, captain_id: int, conn: Connection) -> None:
+        conns = self.active.get(captain_id)
+        if conns and conns.get(conn.ws) is conn:
+            # أُغلق بسبب بطء/خطأ إرسال وليس من disconnect()
+            self.stats["closed_slow"] += 1
+            del conns[conn.ws]
+            if not conns:
+                self.active.pop(captain_id, None)
+            self.stats["dropped"] += conn.dropped
+            with contextlib.suppress(Exception):
+                asyncio.create_task(conn.ws.close(code=1013))
+
+    def disconnect(self, captain_id: int, websocket: WebSocket):
+        conns = self.active.get(captain_id)
+        if not conns:
+            return
+        conn = conns.pop(websocket, None)
+        if not conns:
+            self.active.pop(captain_id, None)
+        if conn is not None:
+            self.stats["dropped"] += conn.dropped
+            conn._on_close = None
+            conn.close()
+
+    def send_text(self, captain_id: int, text: str, droppable: bool = False) -> int:
+        """Queue an already serialized message on every socket of the captain; returns how many took it."""
+        conns = self.active.get(captain_id)
+        if not conns:
+            return 0
+        self.stats["messages"] += 1
+        n = 0
+        for conn in list(conns.values()):
+            if conn.put(text, droppable):
+                n += 1
+        self.stats["enqueued"] += n
+        return n
+
+    def send_pos(self, captain_id: int, lat: float, lng: float) -> int:
+        """Queue a pos message on the captain's sockets whose broadcast policy lets it through."""
+        conns = self.active.get(captain_id)
+        if not conns:
+            return 0
+        now = time.monotonic()
+        text = None
+        n = 0
+        for conn in list(conns.values()):
+            f = conn.filter
+            if f is not None:
+                # لا إرسال لاحق للموقع المؤجل: المحاكاة/الكابتن يرسل موقعاً أحدث في الدورة التالية
+                if not f.ready(now) or f.check(captain_id, lat, lng, now) != SEND:
+                    self.stats["pos_suppressed"] += 1
+                    continue
+                f.take()
+            if text is None:
+                # أسرع من json.dumps لهذا الشكل الثابت (repr لعدد عشري منتهٍ صالح في JSON)
+                text = '{"type":"pos","captain_id":%d,"lat":%r,"lng":%r}' % (captain_id, float(lat), float(lng))
+            if conn.put(text, True):
+                n += 1
+        if text is not None:
+            self.stats["messages"] += 1
+            self.stats["enqueued"] += n
+        return n
+
+    async def send_json(self, captain_id: int, data: dict):
+        if captain_id not in self.active:
+            return
+        self.send_text(
+            captain_id,
+            json.dumps(data, ensure_ascii=False, separators=(",", ":")),
+            droppable=data.get("type") in DROPPABLE_TYPES,
+        )
+
+    async def send_json_after(self, captain_id: int, data: dict, delay_sec: float):
+        await asyncio.sleep(delay_sec)
+        await self.send_json(captain_id, data)
+
+    def metrics(self) -> Dict[str, Any]:
+        conns = [c for cs in self.active.values() for c in cs.values()]
+        depths = [len(c.queue) for c in conns]
+        return {
+            **self.stats,
+            "dropped": self.stats["dropped"] + sum(c.dropped for c in conns),
+            "captains": len(self.active),
+            "connections": len(conns),
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "max_queue_depth_seen": max((c.max_depth for c in conns), default=0),
+            "queue_max": SEND_QUEUE_MAX,
+        }
+
+
+manager = ConnectionManager()
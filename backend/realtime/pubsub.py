@@ -0,0 +1,150 @@
+import asyncio
+import contextlib
+import json
+import os
+from typing import Any, Dict, Optional, Set
+
+from loguru import logger
+
+from core.redis import get_redis
+from realtime.connections import DROPPABLE_TYPES, ConnectionManager, manager
+
+# اشتراك Redis واحد لكل عامل بدل pubsub ومهمة استماع لكل WebSocket: عدد اتصالات Redis ثابت مهما زاد الكباتن.
+# channels: اشتراك في captain:{id} فقط للكباتن المتصلين بهذا العامل (Redis يرشّح، والطلبات تُجمع في أمر واحد).
+# pattern: psubscribe captain:* مرة واحدة ويُرشَّح محلياً؛ أبسط لكن كل عامل يستقبل رسائل كل الكباتن.
+CHANNEL_PREFIX = "captain:"
+MODE = os.getenv("CAPTAIN_PUBSUB_MODE", "channels")
+POLL_SEC = float(os.getenv("CAPTAIN_PUBSUB_POLL_SEC", "0.1"))
+RECONNECT_MAX_SEC = 30.0
+SUBSCRIBE_BATCH = 500
+
+
+class CaptainPubSub:
+    """One Redis pubsub per process fanning `captain:{id}` messages out to the local ConnectionManager."""
+
+    def __init__(self, connections: ConnectionManager, mode: str = MODE):
+        self.connections = connections
+        self.pattern = mode == "pattern"
+        self._refs: Dict[int, int] = {}
+        self._subscribed: Set[int] = set()
+        self._dirty = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"messages": 0, "dispatched": 0, "no_socket": 0, "bad": 0, "reconnects": 0, "subscribe_cmds": 0}
+        self.connected = False
+        self._healthy = False
+
+    def add(self, captain_id: int) -> None:
+        """A socket for this captain opened on this worker."""
+        self._refs[captain_id] = self._refs.get(captain_id, 0) + 1
+        if captain_id not in self._subscribed:
+            self._dirty.set()
+
+    def remove(self, captain_id: int) -> None:
+        n = self._refs.get(captain_id, 0) - 1
+        if n > 0:
+            self._refs[captain_id] = n
+            return
+        self._refs.pop(captain_id, None)
+        if captain_id in self._subscribed:
+            self._dirty.set()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(BaseException):
+                await self._task
+        self._task = None
+
+    async def _sync(self, psub) -> None:
+        """Apply pending socket changes as batched SUBSCRIBE/UNSUBSCRIBE commands."""
+        self._dirty.clear()
+        wanted = set(self._refs)
+        add = [CHANNEL_PREFIX + str(c) for c in wanted - self._subscribed]
+        drop = [CHANNEL_PREFIX + str(c) for c in self._subscribed - wanted]
+        for i in range(0, len(add), SUBSCRIBE_BATCH):
+            await psub.subscribe(*add[i:i + SUBSCRIBE_BATCH])
+            self.stats["subscribe_cmds"] += 1
+        for i in range(0, len(drop), SUBSCRIBE_BATCH):
+            await psub.unsubscribe(*drop[i:i + SUBSCRIBE_BATCH])
+            self.stats["subscribe_cmds"] += 1
+        self._subscribed = wanted
+
+    def _dispatch(self, channel: Any, data: Any) -> None:
+        self.stats["messages"] += 1
+        try:
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            captain_id = int(channel[len(CHANNEL_PREFIX):])
+            text = data.decode() if isinstance(data, bytes) else str(data)
+            msg = json.loads(text)
+        except Exception:
+            self.stats["bad"] += 1
+            return
+        if captain_id not in self.connections.active:
+            self.stats["no_socket"] += 1
+            return
+        # النص كما وصل من Redis يُرسل دون إعادة تسلسل
+        droppable = isinstance(msg, dict) and msg.get("type") in DROPPABLE_TYPES
+        if self.connections.send_text(captain_id, text, droppable=droppable):
+            self.stats["dispatched"] += 1
+
+    async def _listen(self, r) -> None:
+        psub = r.pubsub(ignore_subscribe_messages=True)
+        try:
+            if self.pattern:
+                await psub.psubscribe(CHANNEL_PREFIX + "*")
+            else:
+                self._subscribed = set()
+                # get_message يتطلب اشتراكاً واحداً على الأقل
+                while not self._refs:
+                    await self._dirty.wait()
+                    self._dirty.clear()
+                await self._sync(psub)
+            self.connected = True
+            self._healthy = True
+            while True:
+                if self._dirty.is_set() and not self.pattern:
+                    await self._sync(psub)
+                msg = await psub.get_message(timeout=POLL_SEC)
+                if msg and msg.get("type") in ("message", "pmessage"):
+                    self._dispatch(msg["channel"], msg["data"])
+        finally:
+            self.connected = False
+            self._subscribed = set()
+            with contextlib.suppress(Exception):
+                await psub.close()
+
+    async def _run(self) -> None:
+        delay = 1.0
+        while True:
+            self._healthy = False
+            try:
+                r = await get_redis()
+                if not r:
+                    return
+                await self._listen(r)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self._healthy:
+                    delay = 1.0
+                self.stats["reconnects"] += 1
+                logger.warning(f"[ws] captain pubsub lost ({e}), retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_SEC)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "mode": "pattern" if self.pattern else "channels",
+            "connected": self.connected,
+            "captains": len(self._refs),
+            "channels": 1 if self.pattern else len(self._subscribed),
+        }
+
+
+bus = CaptainPubSub(manager)
@@ -0,0 +1,213 @@
+import asyncio
+import contextlib
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from realtime.connections import ConnectionManager, manager
+
+try:
+    import numpy as np
+except Exception:  # pragma: no cover
+    np = None  # type: ignore
+
+# محاكاة حركة الكباتن (تجوال عشوائي ومسار مطعم→زبون) بمجدول واحد لكل عامل بدل مهمة sleep(1) لكل مقبس.
+# كل الحالة في مصفوفات (numpy إن وُجد): كل دقة تحرك كل الكباتن بخطوة متجهة واحدة، ثم رسالة pos واحدة لكل مقبس.
+# الكلفة تتبع معدل الدقات وليس عدد الاتصالات، ويصلح المجدول نفسه مولّد حمل لقياس البث (scripts/bench_sim_tick.py).
+TICK_SEC = float(os.getenv("SIM_TICK_SEC", "1.0"))
+WANDER_DEG = 0.0005
+ROUTE_STEPS = 30
+HOME = (33.5138, 36.2765)
+
+IDLE, WANDER, ROUTE = 0, 1, 2
+_FIELDS = ("lat", "lng", "a_lat", "a_lng", "b_lat", "b_lng")
+
+
+class Simulator:
+    """Simulated captain positions advanced together on one fixed-rate tick."""
+
+    def __init__(self, connections: ConnectionManager, tick_sec: float = TICK_SEC, seed: Optional[int] = None):
+        self.connections = connections
+        self.tick_sec = tick_sec
+        self._rnd = random.Random(seed)
+        self._np_rnd = np.random.default_rng(seed) if np is not None else None
+        self._slot: Dict[int, int] = {}
+        self._ids: List[int] = []
+        self._n = 0
+        self._cap = 0
+        self._arr: Dict[str, Any] = {}
+        self._grow(64)
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"ticks": 0, "moved": 0, "delivered": 0, "overruns": 0, "last_tick_ms": 0.0}
+
+    # ---- تخزين الحالة (عمود لكل حقل، إزالة بالمبادلة مع آخر صف) ----
+    def _grow(self, cap: int) -> None:
+        for name in _FIELDS:
+            old = self._arr.get(name)
+            new = np.zeros(cap) if np is not None else [0.0] * cap
+            if old is not None:
+                new[:self._n] = old[:self._n]
+            self._arr[name] = new
+        for name in ("mode", "step", "steps"):
+            old = self._arr.get(name)
+            new = np.zeros(cap, dtype=np.int32) if np is not None else [0] * cap
+            if old is not None:
+                new[:self._n] = old[:self._n]
+            self._arr[name] = new
+        self._cap = cap
+
+    def _slot_for(self, captain_id: int) -> int:
+        i = self._slot.get(captain_id)
+        if i is None:
+            if self._n == self._cap:
+                self._grow(self._cap * 2)
+            i = self._n
+            self._n += 1
+            self._slot[captain_id] = i
+            self._ids.append(captain_id)
+            a = self._arr
+            a["lat"][i] = HOME[0] + self._rnd.uniform(-0.01, 0.01)
+            a["lng"][i] = HOME[1] + self._rnd.uniform(-0.01, 0.01)
+            a["mode"][i] = IDLE
+        return i
+
+    def remove(self, captain_id: int) -> None:
+        i = self._slot.pop(captain_id, None)
+        if i is None:
+            return
+        last = self._n - 1
+        if i != last:
+            moved = self._ids[last]
+            for col in self._arr.values():
+                col[i] = col[last]
+            self._ids[i] = moved
+            self._slot[moved] = i
+        self._ids.pop()
+        self._n = last
+
+    # ---- أوامر ----
+    def wander(self, captain_id: int) -> None:
+        """Random walk around the captain's current position (what _pos_loop did)."""
+        i = self._slot_for(captain_id)
+        self._arr["mode"][i] = WANDER
+
+    def route(
+        self, captain_id: int, r_lat: float, r_lng: float, c_lat: float, c_lng: float, steps: int = ROUTE_STEPS
+    ) -> None:
+        """Straight restaurant → customer drive, one step per tick, then a `delivered` message."""
+        i = self._slot_for(captain_id)
+        a = self._arr
+        a["a_lat"][i], a["a_lng"][i], a["b_lat"][i], a["b_lng"][i] = r_lat, r_lng, c_lat, c_lng
+        a["step"][i], a["steps"][i], a["mode"][i] = 0, max(1, steps), ROUTE
+
+    # ---- الدقة ----
+    def _step_np(self) -> Tuple[List[int], List[int]]:
+        n = self._n
+        a = {k: v[:n] for k, v in self._arr.items()}
+        mode = a["mode"]
+        wander = np.flatnonzero(mode == WANDER)
+        if wander.size:
+            a["lat"][wander] += self._np_rnd.uniform(-WANDER_DEG, WANDER_DEG, wander.size)
+            a["lng"][wander] += self._np_rnd.uniform(-WANDER_DEG, WANDER_DEG, wander.size)
+        route = np.flatnonzero(mode == ROUTE)
+        done = np.empty(0, dtype=np.int64)
+        if route.size:
+            t = a["step"][route] / a["steps"][route]
+            a["lat"][route] = a["a_lat"][route] + (a["b_lat"][route] - a["a_lat"][route]) * t
+            a["lng"][route] = a["a_lng"][route] + (a["b_lng"][route] - a["a_lng"][route]) * t
+            a["step"][route] += 1
+            done = route[a["step"][route] > a["steps"][route]]
+        moved = np.flatnonzero(mode != IDLE).tolist()
+        if done.size:
+            mode[done] = IDLE
+        return moved, done.tolist()
+
+    def _step_py(self) -> Tuple[List[int], List[int]]:
+        a = self._arr
+        lat, lng, mode, step, steps = a["lat"], a["lng"], a["mode"], a["step"], a["steps"]
+        uniform = self._rnd.uniform
+        moved: List[int] = []
+        done: List[int] = []
+        for i in range(self._n):
+            m = mode[i]
+            if m == WANDER:
+                lat[i] += uniform(-WANDER_DEG, WANDER_DEG)
+                lng[i] += uniform(-WANDER_DEG, WANDER_DEG)
+            elif m == ROUTE:
+                t = step[i] / steps[i]
+                lat[i] = a["a_lat"][i] + (a["b_lat"][i] - a["a_lat"][i]) * t
+                lng[i] = a["a_lng"][i] + (a["b_lng"][i] - a["a_lng"][i]) * t
+                step[i] += 1
+                if step[i] > steps[i]:
+                    mode[i] = IDLE
+                    done.append(i)
+            else:
+                continue
+            moved.append(i)
+        return moved, done
+
+    def tick(self) -> int:
+        """Advance every simulated captain one step and queue the sends; returns positions sent."""
+        t0 = time.perf_counter()
+        moved, done = self._step_np() if np is not None else self._step_py()
+        ids, lat, lng = self._ids, self._arr["lat"], self._arr["lng"]
+        if np is not None:
+            lat, lng = lat[:self._n].tolist(), lng[:self._n].tolist()
+        send_pos = self.connections.send_pos
+        for i in moved:
+            send_pos(ids[i], lat[i], lng[i])
+        finished = [ids[i] for i in done]
+        for cid in finished:
+            self.connections.send_text(cid, '{"type":"delivered","captain_id":%d}' % cid)
+            if cid not in self.connections.active:
+                # مسار تجريبي لكابتن غير متصل (test_start_delivery)
+                self.remove(cid)
+        self.stats["ticks"] += 1
+        self.stats["moved"] += len(moved)
+        self.stats["delivered"] += len(done)
+        self.stats["last_tick_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+        return len(moved)
+
+    async def _run(self) -> None:
+        # معدل ثابت: الموعد التالي يُحسب من السابق لا من نهاية الدقة
+        next_at = time.monotonic()
+        while True:
+            next_at += self.tick_sec
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                self.stats["overruns"] += 1
+                next_at = time.monotonic()
+            try:
+                self.tick()
+            except Exception as e:
+                logger.warning(f"[sim] tick failed: {e}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(BaseException):
+                await self._task
+        self._task = None
+
+    def metrics(self) -> Dict[str, Any]:
+        modes = [int(m) for m in self._arr["mode"][:self._n]]
+        return {
+            **self.stats,
+            "captains": self._n,
+            "wandering": modes.count(WANDER),
+            "routing": modes.count(ROUTE),
+            "tick_sec": self.tick_sec,
+            "vectorized": np is not None,
+        }
+
+
+sim = Simulator(manager)
@@ -1,6 +1,11 @@
+import asyncio
 import os
+from typing import Any, Callable, Dict, Set
+
 import socketio
 
+from realtime.broadcast import FEED_POLICY, feed, parse_bbox
+
 REDIS_URL = os.getenv("REDIS_URL")
 
 manager = socketio.AsyncRedisManager(REDIS_URL) if REDIS_URL else None
@@ -52,3 +57,50 @@ async def notify_tab(tab: str, payload: dict):
 
 async def notify_order(order_id: int, payload: dict):
     await sio.emit("notify", payload, room=f"order:{order_id}")
+
+
+# خريطة لوحة التحكم الحية: كل لوحة تشترك بمستطيل العرض (bbox) فتصلها فروق مواقع الكباتن داخله فقط،
+# مجمّعة ومخنوقة من realtime.broadcast.feed (الذاكرة لا قاعدة البيانات) بدل استطلاع /admin/captains/live.
+# subscribe {bbox: [s, w, n, e], min_distance_m?, min_interval_ms?, max_rate?} → حدث positions
+# {"items": [[id, lat, lng], ...], "removed": [id, ...]}؛ إعادة subscribe بعد تحريك الخريطة تحدّث النطاق فقط.
+LIVE_MAP_NAMESPACE = os.getenv("LIVE_MAP_NAMESPACE", "/live-map")
+
+
+class LiveMapNamespace(socketio.AsyncNamespace):
+    def __init__(self, namespace: str):
+        super().__init__(namespace)
+        self._emits: Set[asyncio.Task] = set()
+
+    def _sender(self, sid: str) -> Callable[[Dict[str, Any]], None]:
+        def send(frame: Dict[str, Any]) -> None:
+            # المقبس محلي لهذا العامل: لا داعي لتمرير الإطار عبر Redis
+            task = asyncio.create_task(
+                self.emit("positions", frame, to=sid, ignore_queue=True)
+            )
+            self._emits.add(task)
+            task.add_done_callback(self._emits.discard)
+        return send
+
+    async def on_subscribe(self, sid, data):
+        data = data or {}
+        bbox = parse_bbox(data.get("bbox"))
+        if bbox is None:
+            return {"ok": False, "error": "bbox must be [south, west, north, east]"}
+        key = (self.namespace, sid)
+        policy = FEED_POLICY.override(data)
+        if key in feed:
+            feed.set_policy(key, policy)
+            feed.set_bbox(key, bbox)
+        else:
+            feed.subscribe(key, self._sender(sid), policy, bbox)
+        return {"ok": True, "bbox": list(bbox), "policy": policy.to_dict()}
+
+    async def on_unsubscribe(self, sid, data=None):
+        feed.unsubscribe((self.namespace, sid))
+        return {"ok": True}
+
+    async def on_disconnect(self, sid):
+        feed.unsubscribe((self.namespace, sid))
+
+
+sio.register_namespace(LiveMapNamespace(LIVE_MAP_NAMESPACE))
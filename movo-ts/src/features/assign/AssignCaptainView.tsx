@@ -135,7 +135,7 @@ export default function AssignCaptainView(props: {
               console.log('WebSocket message:', msg);
               if (msg?.type === 'accepted' && msg.order_id === orderId) {
                 console.log('Captain accepted order');
-                await api.orders.next(orderId);
+                await api.orders.next(orderId, { status: 'choose_captain' });
                 onAssigned?.();
                 ws.close();
                 setAssigningId(null);
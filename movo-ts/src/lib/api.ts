@@ -15,6 +15,19 @@ async function toJson(response: Response) {
   return response.json();
 }
 
+// الحالة التي رآها المستخدم؛ يرفض الخادم الانتقال بـ 409 إن تغيّر الطلب في الأثناء
+export type ExpectedState = { status?: string | null; substage?: string | null };
+// /next يجب أن يحمل الحالة التي رآها المستخدم، وإلا فنقرة مزدوجة تتقدم مرحلتين
+export type NextExpected = { status: string; substage?: string | null };
+
+function expectedQuery(expected?: ExpectedState) {
+  const q = new URLSearchParams();
+  if (expected?.status) q.set('expected_status', expected.status);
+  if (expected?.substage) q.set('expected_substage', expected.substage);
+  const s = q.toString();
+  return s ? `?${s}` : '';
+}
+
 async function _fetchJSON(url: string, signal?: AbortSignal) {
   const res = await fetch(url, { signal, headers: { Accept: "application/json" } });
   return toJson(res);
@@ -71,16 +84,17 @@ export const api = {
       await queryClient.invalidateQueries({ queryKey: ["orders"] });
       return res;
     },
-    next: async (id: number | string) => {
-      const res = await fetch(`${BASE}/orders/${id}/next`, {
+    next: async (id: number | string, expected: NextExpected) => {
+      if (!expected.status) throw new Error('orders.next requires the expected status');
+      const res = await fetch(`${BASE}/orders/${id}/next${expectedQuery(expected)}`, {
         method: 'PATCH',
         headers: { 'Content-Type': 'application/json' },
       }).then(toJson);
       await queryClient.invalidateQueries({ queryKey: ["orders"] });
       return res;
     },
-    cancel: async (id: number | string) => {
-      const res = await fetch(`${BASE}/orders/${id}/cancel`, {
+    cancel: async (id: number | string, expected?: ExpectedState) => {
+      const res = await fetch(`${BASE}/orders/${id}/cancel${expectedQuery(expected)}`, {
         method: 'PATCH',
         headers: { 'Content-Type': 'application/json' },
       }).then(toJson);
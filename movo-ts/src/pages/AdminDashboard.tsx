@@ -97,14 +97,16 @@ export default function Dashboard() {
 
   // Handler functions for order actions
   const handleStatusChange = async (orderId: number, newStatus: string) => {
+    const current = orders.find((o) => o.order_id === orderId);
+    const expected = current ? { status: current.current_status, substage: current.substage } : undefined;
     try {
       if (newStatus === 'cancelled') {
-        await api.orders.cancel(orderId);
+        await api.orders.cancel(orderId, { status: expected?.status });
       } else if (newStatus === 'problem') {
         await api.orders.updateStatus(orderId, 'problem');
-      } else {
+      } else if (expected) {
         // اتبع مسار next في الباكيند فقط، ولا تغيّر التبويب
-        await api.orders.next(orderId);
+        await api.orders.next(orderId, expected);
       }
       // جدّد أوامر التبويب الحالي فقط دون تبديل التبويب
       const [data, cnt] = await Promise.all([
@@ -321,7 +323,7 @@ export default function Dashboard() {
                   customer={{ lat: cust?.lat ?? 33.515, lng: cust?.lng ?? 36.28 }}
                   captainId={capId}
                   onDelivered={async () => {
-                    await api.orders.next(sel?.order_id ?? 0);
+                    await api.orders.next(sel?.order_id ?? 0, { status: 'out_for_delivery' });
                     // حدث عدادات وقوائم
                     const [data, cnt] = await Promise.all([
                       api.orders.list({ order_status: activeTab }),
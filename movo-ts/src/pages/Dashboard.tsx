@@ -274,15 +274,17 @@ export default function Dashboard() {
   };
 
   const handleStatusChange = async (orderId: number, newStatus: string) => {
+    const current = orders.find((o) => o.order_id === orderId);
+    const expected = current ? { status: current.current_status, substage: current.substage } : undefined;
     try {
       setLoading(true);
       if (newStatus === 'cancelled') {
-        await api.orders.cancel(orderId);
+        await api.orders.cancel(orderId, { status: expected?.status });
       } else if (newStatus === 'problem') {
         await api.orders.updateStatus(orderId, 'problem');
-      } else {
+      } else if (expected) {
         // نوحّد كل الأزرار التي تعني الانتقال إلى التالي تحت /next
-        await api.orders.next(orderId);
+        await api.orders.next(orderId, expected);
       }
       // حدث القائمة والعدادات دون تغيير التبويب الحالي
       const [data, cnt] = await Promise.all([
@@ -0,0 +1,66 @@
+"""Benchmark dashboard position broadcasts (realtime.broadcast.PositionFeed) against one pos message per captain.
+
+Usage: python scripts/bench_broadcast.py [captains] [moving_fraction]
+
+Simulates 10 s of captains reporting every second, where only a fraction of
+them move. "old" is what the per-connection loops did: one full JSON pos
+message per captain per second. "feed" is one dashboard subscriber with the
+default policy, ticked at WS_FEED_TICK_SEC.
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from core import captain_index  # noqa: E402
+from realtime.broadcast import FEED_POLICY, PositionFeed, encode  # noqa: E402
+
+CENTER = (33.5138, 36.2765)
+SECONDS = 10
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    total = int(args[0]) if args else 10_000
+    moving = float(args[1]) if len(args) > 1 else 0.1
+    rnd = random.Random(0)
+    pos = {cid: [CENTER[0] + rnd.uniform(-0.1, 0.1), CENTER[1] + rnd.uniform(-0.1, 0.1)] for cid in range(1, total + 1)}
+    movers = set(rnd.sample(sorted(pos), int(total * moving)))
+    for cid, (lat, lng) in pos.items():
+        captain_index.INDEX.upsert(cid, lat, lng, ts=0.0)
+
+    feed = PositionFeed()
+    out = []
+    feed.subscribe("dash", lambda frame: out.append(encode(frame)), FEED_POLICY)
+    now = time.monotonic()
+    feed.tick(now)
+    snapshot_bytes = sum(len(f) for f in out)
+    out.clear()
+
+    old_msgs = old_bytes = 0
+    ticks_per_sec = round(1 / feed.tick_sec)
+    for sec in range(1, SECONDS + 1):
+        for cid, p in pos.items():
+            if cid in movers:
+                # ~5-15 م في الثانية
+                p[0] += rnd.uniform(-0.0001, 0.0001)
+                p[1] += rnd.uniform(-0.0001, 0.0001)
+                captain_index.INDEX.upsert(cid, p[0], p[1])
+            feed.moved(cid)
+            old_msgs += 1
+            old_bytes += len(json.dumps({"type": "pos", "captain_id": cid, "lat": p[0], "lng": p[1]}))
+        for _ in range(ticks_per_sec):
+            now += feed.tick_sec
+            feed.tick(now)
+
+    new_bytes = sum(len(f) for f in out)
+    print(f"captains={total} moving={moving:.0%} snapshot={snapshot_bytes / 1024:.0f} KiB")
+    print(f"old  {old_msgs / SECONDS:10.0f} sends/s {old_bytes / SECONDS / 1024:10.1f} KiB/s")
+    print(f"feed {len(out) / SECONDS:10.1f} sends/s {new_bytes / SECONDS / 1024:10.1f} KiB/s  {feed.metrics()['suppressed']} suppressed")
+
+
+if __name__ == "__main__":
+    main()
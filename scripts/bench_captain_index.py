@@ -0,0 +1,113 @@
+"""Benchmark core.captain_index against the previous full scan.
+
+Usage: python scripts/bench_captain_index.py [captains] [--db]
+
+Without --db the baseline is the old candidates() loop (haversine over every
+available captain, as it ran after loading them from the database). With --db
+the captains are also inserted (inside a rolled-back transaction) and the SQL
+radius query from api/routes/assign.py is timed. Requires DATABASE_URL.
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from core.captain_index import CaptainGrid  # noqa: E402
+from core.scoring import haversine_km  # noqa: E402
+
+CENTER = (33.5138, 36.2765)
+SPREAD = 0.25  # ≈ ±28 كم حول المركز
+
+
+def _timeit(fn, n: int) -> float:
+    fn()
+    t = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t) / n
+
+
+def _queries(n: int):
+    rnd = random.Random(1)
+    return [(CENTER[0] + rnd.uniform(-0.05, 0.05), CENTER[1] + rnd.uniform(-0.05, 0.05)) for _ in range(n)]
+
+
+async def _bench_db(rows, radius_km: float, limit: int, n: int) -> float:
+    from sqlalchemy import text as sa_text
+    from core.db import AsyncSessionLocal
+    from api.routes import assign
+
+    async with AsyncSessionLocal() as s:
+        await s.execute(sa_text(
+            "INSERT INTO captains(name, phone, vehicle_type, available, last_lat, last_lng) "
+            "SELECT 'bench', '0', 'bike', a, la, ln FROM unnest(CAST(:a AS boolean[]), CAST(:la AS float8[]), CAST(:ln AS float8[])) AS t(a, la, ln)"
+        ), {"a": [r[2] for r in rows], "la": [r[0] for r in rows], "ln": [r[1] for r in rows]})
+        await s.execute(sa_text("ANALYZE captains"))
+        order_id = (await s.execute(sa_text("SELECT min(order_id) FROM orders"))).scalar()
+        sql = assign._CANDIDATES_POSTGIS_SQL if await assign._has_postgis(s) else assign._CANDIDATES_BBOX_SQL
+        params = {"order_id": order_id, "radius_m": radius_km * 1000, "limit": limit, "dlat": radius_km / 111.32}
+        await s.execute(sql, params)
+        t = time.perf_counter()
+        for _ in range(n):
+            (await s.execute(sql, params)).all()
+        elapsed = (time.perf_counter() - t) / n
+        await s.rollback()
+    return elapsed
+
+
+def main() -> None:
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    total = int(args[0]) if args else 50_000
+    radius_km, k = 5.0, 20
+    rnd = random.Random(0)
+    rows = [
+        (CENTER[0] + rnd.uniform(-SPREAD, SPREAD), CENTER[1] + rnd.uniform(-SPREAD, SPREAD), rnd.random() < 0.7)
+        for _ in range(total)
+    ]
+    grid = CaptainGrid()
+    t = time.perf_counter()
+    for cid, (lat, lng, available) in enumerate(rows, 1):
+        grid.upsert(cid, lat, lng, available)
+    print(f"captains={total} build={((time.perf_counter() - t) * 1e3):.1f} ms cells={len(grid._cells)}")
+
+    qs = _queries(200)
+    it = iter(qs * 1000)
+
+    def scan():
+        lat, lng = next(it)
+        out = [(cid, d) for cid, (la, ln, av) in enumerate(rows, 1) if av and (d := haversine_km(lat, lng, la, ln)) <= radius_km]
+        out.sort(key=lambda x: x[1])
+        return out[:k]
+
+    def radius():
+        lat, lng = next(it)
+        return grid.radius(lat, lng, radius_km, limit=k)
+
+    def nearest():
+        lat, lng = next(it)
+        return grid.nearest(lat, lng, k)
+
+    def update():
+        cid = rnd.randrange(1, total + 1)
+        lat, lng = next(it)
+        grid.upsert(cid, lat, lng)
+
+    print(f"full scan (old)      {_timeit(scan, 5) * 1e6:10.1f} us/query")
+    print(f"grid radius {radius_km:g} km   {_timeit(radius, 2000) * 1e6:10.1f} us/query")
+    print(f"grid nearest k={k}    {_timeit(nearest, 2000) * 1e6:10.1f} us/query")
+    print(f"grid position update {_timeit(update, 20000) * 1e6:10.1f} us/update")
+    snap = grid.snapshot()
+    t = time.perf_counter()
+    CaptainGrid().restore(snap)
+    print(f"restore snapshot     {(time.perf_counter() - t) * 1e3:10.1f} ms")
+
+    if "--db" in sys.argv:
+        elapsed = asyncio.run(_bench_db(rows, radius_km, k, 50))
+        print(f"db radius query      {elapsed * 1e6:10.1f} us/query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Benchmark core.dispatch.solve: Hungarian vs greedy on synthetic batches.
+
+Usage: python scripts/bench_dispatch.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from core import dispatch  # noqa: E402
+
+CENTER = (33.5138, 36.2765)
+
+
+def _batch(n_orders: int, n_captains: int):
+    rnd = random.Random(n_orders)
+    orders = [(i, CENTER[0] + rnd.uniform(-0.1, 0.1), CENTER[1] + rnd.uniform(-0.1, 0.1)) for i in range(n_orders)]
+    captains = [
+        (j, CENTER[0] + rnd.uniform(-0.1, 0.1), CENTER[1] + rnd.uniform(-0.1, 0.1), rnd.uniform(3, 5), rnd.choice((0, 0, 1)))
+        for j in range(n_captains)
+    ]
+    return orders, captains
+
+
+def main() -> None:
+    print(f"{'orders':>7} {'captains':>9} {'solver':>10} {'assigned':>9} {'total eta s':>12} {'ms':>8} {'assign/s':>9}")
+    for n, m in ((100, 1_000), (300, 2_000), (1_000, 5_000)):
+        orders, captains = _batch(n, m)
+        for limit in (10 ** 12, 0):
+            dispatch.HUNGARIAN_MAX_CELLS = limit
+            t = time.perf_counter()
+            out, solver = dispatch.solve(orders, captains, 5.0)
+            elapsed = time.perf_counter() - t
+            total = sum(a["eta_sec"] for a in out)
+            print(f"{n:>7} {m:>9} {solver:>10} {len(out):>9} {total:>12} {elapsed * 1e3:>8.1f} {len(out) / elapsed:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
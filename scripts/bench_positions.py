@@ -0,0 +1,68 @@
+"""Benchmark live position ingestion (core.positions) against one UPDATE per message.
+
+Usage: python scripts/bench_positions.py [captains]
+
+Inserts the captains inside a rolled-back transaction, then times a second of
+traffic (every captain reports once): "per message" runs one UPDATE per pos
+(a sample, extrapolated), "batched" is the single unnest UPDATE the flusher
+runs. record() is timed in memory. Requires DATABASE_URL.
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from sqlalchemy import text as sa_text  # noqa: E402
+
+from core import positions  # noqa: E402
+from core.db import AsyncSessionLocal  # noqa: E402
+
+CENTER = (33.5138, 36.2765)
+SAMPLE = 500
+
+
+async def main() -> None:
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    total = int(args[0]) if args else 10_000
+    rnd = random.Random(0)
+
+    async with AsyncSessionLocal() as s:
+        ids = (await s.execute(sa_text(
+            "INSERT INTO captains(name, phone, vehicle_type, available, last_lat, last_lng) "
+            "SELECT 'bench', '0', 'bike', true, :lat, :lng FROM generate_series(1, :n) RETURNING captain_id"
+        ), {"lat": CENTER[0], "lng": CENTER[1], "n": total})).scalars().all()
+        msgs = [(cid, CENTER[0] + rnd.uniform(-0.1, 0.1), CENTER[1] + rnd.uniform(-0.1, 0.1)) for cid in ids]
+
+        t = time.perf_counter()
+        for cid, lat, lng in msgs:
+            positions.record(cid, lat, lng)
+        record_us = (time.perf_counter() - t) / total * 1e6
+
+        one = sa_text("UPDATE captains SET last_lat = :lat, last_lng = :lng WHERE captain_id = :cid")
+        t = time.perf_counter()
+        for cid, lat, lng in msgs[:SAMPLE]:
+            await s.execute(one, {"cid": cid, "lat": lat, "lng": lng})
+        per_msg = (time.perf_counter() - t) / SAMPLE * total
+
+        rows = sorted(positions._pending.items())
+        positions._pending.clear()
+        sql = sa_text(positions._UPDATE_SQL.format(geo=positions._UPDATE_GEO if await positions._has_postgis(s) else ""))
+        t = time.perf_counter()
+        for i in range(0, len(rows), positions.BATCH_SIZE):
+            chunk = rows[i:i + positions.BATCH_SIZE]
+            await s.execute(sql, {"ids": [r[0] for r in chunk], "lats": [r[1][0] for r in chunk], "lngs": [r[1][1] for r in chunk]})
+        batched = time.perf_counter() - t
+        await s.rollback()
+
+    statements = -(-total // positions.BATCH_SIZE)
+    print(f"captains={total} (one report each)")
+    print(f"record()             {record_us:10.2f} us/message")
+    print(f"per message UPDATE   {per_msg * 1e3:10.1f} ms  ({total} statements, extrapolated from {SAMPLE})")
+    print(f"batched UPDATE       {batched * 1e3:10.1f} ms  ({statements} statements)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""Benchmark core.scoring.top_k against the previous per-captain loop.
+
+Usage: python scripts/bench_scoring.py [k]
+
+"loop" is the old candidates() ranking: haversine per captain, a Candidate
+object for every captain inside the radius, then a full sort. "batch" is
+top_k() plus Candidate objects for the top-k only.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from api.routes.assign import Candidate, _candidate  # noqa: E402
+from core import scoring  # noqa: E402
+from core.scoring import haversine_km, top_k  # noqa: E402
+
+REF = (33.5138, 36.2765)
+RADIUS_KM = 15.0
+
+
+def _data(n: int):
+    rnd = random.Random(n)
+    lats = [REF[0] + rnd.uniform(-0.15, 0.15) for _ in range(n)]
+    lngs = [REF[1] + rnd.uniform(-0.15, 0.15) for _ in range(n)]
+    active = [rnd.choice((0, 0, 1, 2)) for _ in range(n)]
+    perf = [round(rnd.uniform(3, 5), 2) for _ in range(n)]
+    return lats, lngs, active, perf
+
+
+def loop(lats, lngs, active, perf, k):
+    out = []
+    for i in range(len(lats)):
+        d = haversine_km(REF[0], REF[1], lats[i], lngs[i])
+        if d <= RADIUS_KM:
+            eta_sec = int(d / 25.0 * 3600 + 60)
+            score = scoring._score_one(d, active[i], perf[i], RADIUS_KM)
+            out.append(Candidate(
+                captain_id=i, captain_name="c", last_lat=lats[i], last_lng=lngs[i], active_orders=active[i],
+                distance_km=round(d, 2), eta_sec=eta_sec, score=round(score, 3), last_order_ids=[],
+            ))
+    out.sort(key=lambda x: (-(x.score or 0), x.distance_km))
+    return out[:k]
+
+
+def batch(lats, lngs, active, perf, k):
+    best = top_k(REF[0], REF[1], lats, lngs, active, perf, RADIUS_KM, k)
+    return [_candidate(b[0], "c", lats[b[0]], lngs[b[0]], b, active[b[0]]) for b in best]
+
+
+def _time(fn, *args, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def main() -> None:
+    k = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f"numpy: {'yes' if scoring.np is not None else 'no'}  radius={RADIUS_KM} km  k={k}")
+    print(f"{'captains':>9} {'loop ms':>10} {'batch ms':>10} {'python ms':>10} {'speedup':>8}")
+    for n in (1_000, 10_000, 100_000):
+        data = _data(n)
+        a = loop(*data, k)
+        b = batch(*data, k)
+        assert [c.score for c in a] == [c.score for c in b], "rankings differ"
+        t_loop = _time(loop, *data, k, repeat=3)
+        t_batch = _time(batch, *data, k)
+        np_saved, scoring.np = scoring.np, None
+        t_py = _time(batch, *data, k, repeat=3)
+        scoring.np = np_saved
+        print(f"{n:>9} {t_loop * 1e3:>10.2f} {t_batch * 1e3:>10.2f} {t_py * 1e3:>10.2f} {t_loop / t_batch:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
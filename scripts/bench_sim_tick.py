@@ -0,0 +1,101 @@
+"""Benchmark realtime.simulator against one sleeping task per captain socket.
+
+Usage: python scripts/bench_sim_tick.py [captains] [seconds]
+
+Both variants drive the same ConnectionManager with fake sockets for
+`seconds` of wall time. "tasks" is the previous _pos_loop: one asyncio task per
+connection that moves, sends and sleeps 1s. "tick" is the shared simulator.
+The table shows process CPU time and timer wakeups; messages are what reached
+the sockets.
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from realtime.connections import ConnectionManager  # noqa: E402
+from realtime.simulator import Simulator  # noqa: E402
+
+
+class FakeSocket:
+    sent = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        FakeSocket.sent += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def _connect(n: int) -> ConnectionManager:
+    manager = ConnectionManager()
+    for cid in range(1, n + 1):
+        await manager.connect(cid, FakeSocket())
+    return manager
+
+
+async def _tasks(n: int, seconds: float):
+    manager = await _connect(n)
+    wakeups = 0
+
+    async def _pos_loop(cid: int):
+        nonlocal wakeups
+        lat = 33.5138 + random.uniform(-0.01, 0.01)
+        lng = 36.2765 + random.uniform(-0.01, 0.01)
+        while True:
+            lat += random.uniform(-0.0005, 0.0005)
+            lng += random.uniform(-0.0005, 0.0005)
+            await manager.send_json(cid, {"type": "pos", "captain_id": cid, "lat": lat, "lng": lng})
+            await asyncio.sleep(1)
+            wakeups += 1
+
+    tasks = [asyncio.create_task(_pos_loop(cid)) for cid in range(1, n + 1)]
+    await asyncio.sleep(seconds)
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return manager, wakeups
+
+
+async def _tick(n: int, seconds: float):
+    manager = await _connect(n)
+    sim = Simulator(manager, tick_sec=1.0, seed=0)
+    for cid in range(1, n + 1):
+        sim.wander(cid)
+    sim.start()
+    await asyncio.sleep(seconds)
+    await sim.stop()
+    print(f"{'':>6} last tick (step + enqueue): {sim.stats['last_tick_ms']:.1f} ms")
+    return manager, sim.stats["ticks"]
+
+
+async def _run(name: str, fn, n: int, seconds: float) -> None:
+    FakeSocket.sent = 0
+    cpu = time.process_time()
+    manager, wakeups = await fn(n, seconds)
+    # مهام الكتابة تفرغ ما بقي في الطوابير
+    await asyncio.sleep(0.2)
+    cpu = time.process_time() - cpu
+    for cid in list(manager.active):
+        for ws in list(manager.active.get(cid, {})):
+            manager.disconnect(cid, ws)
+    print(f"{name:>6} {n:>8} {cpu:>10.2f} {wakeups:>10} {FakeSocket.sent:>10}")
+
+
+async def main() -> None:
+    args = sys.argv[1:]
+    n = int(args[0]) if args else 10_000
+    seconds = float(args[1]) if len(args) > 1 else 5.0
+    print(f"{'':>6} {'captains':>8} {'cpu_s':>10} {'wakeups':>10} {'messages':>10}")
+    await _run("tasks", _tasks, n, seconds)
+    await _run("tick", _tick, n, seconds)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
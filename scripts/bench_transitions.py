@@ -0,0 +1,40 @@
+"""Microbenchmark for core.transitions lookups.
+
+Usage: python scripts/bench_transitions.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from core.transitions import TRANSITIONS  # noqa: E402
+
+CASES = [
+    ("next", ("pending", None, False)),
+    ("next", ("pending", None, True)),
+    ("next", ("processing", "preparing", False)),
+    ("next", ("processing", None, False)),
+    ("next", ("delivered", None, False)),
+    ("next", ("issue", None, False)),
+    ("can_transition", ("problem", "processing")),
+    ("can_transition", ("delivered", "problem")),
+    ("can_transition", ("cancelled", "cancelled")),
+]
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    worst = 0.0
+    for name, args in CASES:
+        fn = getattr(TRANSITIONS, name)
+        best = min(timeit.repeat(lambda: fn(*args), number=n, repeat=5)) / n
+        worst = max(worst, best)
+        print(f"{name}{args!s:<40} {best * 1e9:8.1f} ns/call -> {fn(*args)}")
+    print(f"worst: {worst * 1e9:.1f} ns/call ({'OK' if worst < 1e-6 else 'OVER'} 1us budget)")
+    if worst >= 1e-6:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Benchmark WebSocket fan-out of realtime.connections.ConnectionManager.
+
+Usage: python scripts/bench_ws_fanout.py
+
+Every run has one socket that takes 1s per send. "old" is the previous
+send_json: json per socket, awaiting each send in turn, so it waits for the
+slow socket. "queued" serializes once and only enqueues; the writer tasks send.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from realtime.connections import ConnectionManager  # noqa: E402
+
+MSG = {"type": "pos", "captain_id": 1, "lat": 33.5138, "lng": 36.2765}
+
+
+class FakeSocket:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+    async def send_json(self, data):
+        await self.send_text(json.dumps(data))
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def _old(sockets) -> float:
+    t = time.perf_counter()
+    for ws in sockets:
+        await ws.send_json(MSG)
+    return time.perf_counter() - t
+
+
+async def _queued(manager: ConnectionManager) -> float:
+    t = time.perf_counter()
+    await manager.send_json(1, MSG)
+    return time.perf_counter() - t
+
+
+async def main():
+    print(f"{'sockets':>8} {'old_ms':>10} {'queued_ms':>10} {'queued_ns/socket':>17}")
+    for n in (10, 100, 1000, 10000):
+        sockets = [FakeSocket() for _ in range(n - 1)] + [FakeSocket(1.0)]
+        old = await _old(sockets)
+
+        manager = ConnectionManager()
+        for ws in sockets:
+            await manager.connect(1, ws)
+        runs = 20
+        queued = sum([await _queued(manager) for _ in range(runs)]) / runs
+        for ws in sockets:
+            manager.disconnect(1, ws)
+        await asyncio.sleep(0)
+        print(f"{n:>8} {old * 1000:>10.1f} {queued * 1000:>10.3f} {queued / n * 1e9:>17.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())